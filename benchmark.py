@@ -0,0 +1,303 @@
+# Benchmarks of the generation, serialization and rendering hot paths
+#
+# Every benchmark is run for several grid sizes and sample counts, the results are written
+# as JSON so that a later run can be compared against them:
+#   python benchmark.py --output before.json
+#   ... change grid_maker.py or data_driver.py ...
+#   python benchmark.py --output after.json --compare before.json --threshold 0.2
+# The comparison prints the change of every result and exits with status 1 if one of them
+# is more than --threshold (20%) worse than before.
+# The startup group times `import grid_maker` and the --help of the CLIs in fresh interpreters, and exits
+# with status 1 if one of them loads a heavy module (matplotlib, pandas, ...) that it does not need.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+from grid_maker import BATCH_MODES, GridMaker
+from grid_plotting import GridPlotter, plot_grid
+from grid_renderer import write_episodes
+from trajectory_dataset import TrajectoryDataset
+from trajectory_io import from_padded, load_trajectories, read_csv, save_trajectories
+import data_driver
+
+GROUPS = ('episodes', 'place_rectangles', 'io', 'plot_grid', 'startup')
+
+# commands timed by the startup benchmark, each in a fresh interpreter started in this directory
+STARTUP_COMMANDS = {
+    'import_grid_maker': ['-c', 'import grid_maker'],
+    'data_driver_help': ['data_driver.py', '--help'],
+    'visualizer_help': ['grid_dataset_visualizer.py', '--help'],
+    }
+# modules the startup commands must not import, they are only loaded by the code paths that use them
+HEAVY_MODULES = ('matplotlib', 'pandas', 'tqdm', 'PIL', 'imageio', 'torch')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks of generation, serialization and rendering')
+    parser.add_argument('--groups', type=str, nargs='+', default=list(GROUPS), choices=GROUPS, help='Benchmarks to run')
+    parser.add_argument('--grid_sizes', type=int, nargs='+', default=[10, 20, 50], help='Grid sizes to benchmark')
+    parser.add_argument('--num_samples', type=int, nargs='+', default=[100, 1000], help='Numbers of episodes to benchmark (plot_grid renders num_samples // 20 frames)')
+    parser.add_argument('--min_time', type=float, default=0.2, help='Minimum time in seconds spent on every measurement')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated episodes')
+    parser.add_argument('--output', type=str, default='benchmark_results.json', help='Where to write the results')
+    parser.add_argument('--compare', type=str, default=None, help='Results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown that counts as a regression')
+    return parser
+
+
+def throughput(fn, count, min_time):
+    """
+    - Calls fn() until min_time seconds have passed (at least twice), returns count / (seconds per call)
+      of the fastest call, fn() processes `count` items
+    """
+    best, elapsed, calls = float('inf'), 0.0, 0
+    while elapsed < min_time or calls < 2:
+        start = time.perf_counter()
+        fn()
+        duration = time.perf_counter() - start
+        best, elapsed, calls = min(best, duration), elapsed + duration, calls + 1
+    return count / best
+
+
+def result(name, value, unit, **params):
+    return {'name': name, 'value': value, 'unit': unit, 'higher_is_better': True, 'params': params}
+
+
+def bench_episodes(grid_sizes, num_samples, min_time, seed):
+    """
+    - Episodes per second of every GridMaker mode, one episode at a time and with generate_batch
+    """
+    results = []
+    for grid_size in grid_sizes:
+        grid_maker = GridMaker(grid_size=grid_size, min_distance=min(3, grid_size - 1))
+        scalar = {
+            'find_path': lambda: grid_maker.find_path(*grid_maker.place_rectangles(), randomness_factor=0.1),
+            'find_non_collision_path': lambda: grid_maker.find_non_collision_path(*grid_maker.place_rectangles(), randomness_factor=0.1),
+            'fix_direction_action': lambda: grid_maker.fix_direction_action(),
+            }
+        for n in num_samples:
+            for mode in BATCH_MODES:
+                # the one-episode methods draw from the stream of the GridMaker
+                grid_maker = GridMaker(grid_size=grid_size, min_distance=min(3, grid_size - 1), seed=seed)
+                def run_scalar():
+                    for _ in range(n):
+                        scalar[mode]()
+                rate = throughput(run_scalar, n, min_time)
+                results.append(result(f'episodes/{mode}/scalar/grid{grid_size}/n{n}', rate, 'episodes/s', grid_size=grid_size, num_samples=n))
+
+                rng = np.random.default_rng(seed)
+                rate = throughput(lambda: grid_maker.generate_batch(n, mode=mode, randomness_factor=0.1, rng=rng), n, min_time)
+                results.append(result(f'episodes/{mode}/batch/grid{grid_size}/n{n}', rate, 'episodes/s', grid_size=grid_size, num_samples=n))
+    return results
+
+
+def valid_pair_ratio(grid_size, min_distance):
+    """
+    - Fraction of the (blue, red) position pairs that are at least min_distance apart,
+      1 / ratio would be the expected number of draws of a rejection sampler
+    """
+    offsets = np.arange(-(grid_size - 1), grid_size)
+    # number of position pairs with a given offset along one axis
+    pairs = grid_size - np.abs(offsets)
+    valid = offsets[:, None] ** 2 + offsets[None, :] ** 2 >= min_distance ** 2
+    return (pairs[:, None] * pairs[None, :])[valid].sum() / grid_size ** 4
+
+
+def bench_place_rectangles(grid_sizes, num_samples, min_time, seed):
+    """
+    - Placements per second as min_distance approaches the diagonal of the grid,
+      where fewer and fewer pairs of positions are valid
+    """
+    results = []
+    for grid_size in grid_sizes:
+        diagonal = np.hypot(grid_size - 1, grid_size - 1)
+        for fraction in (0.1, 0.5, 0.75, 0.9):
+            min_distance = fraction * diagonal
+            # the scalar placements draw from the stream of the GridMaker
+            grid_maker = GridMaker(grid_size=grid_size, min_distance=min_distance, seed=seed)
+            params = {'grid_size': grid_size, 'min_distance': round(min_distance, 3),
+                      'valid_pair_ratio': valid_pair_ratio(grid_size, min_distance)}
+
+            n = min(num_samples)
+            def run_scalar():
+                for _ in range(n):
+                    grid_maker.place_rectangles()
+            rate = throughput(run_scalar, n, min_time)
+            results.append(result(f'place_rectangles/scalar/grid{grid_size}/d{fraction}', rate, 'placements/s', **params))
+
+            rng = np.random.default_rng(seed)
+            n = max(num_samples)
+            rate = throughput(lambda: grid_maker.place_rectangles_batch(n, rng), n, min_time)
+            results.append(result(f'place_rectangles/batch/grid{grid_size}/d{fraction}', rate, 'placements/s', **params))
+    return results
+
+
+def bench_io(grid_sizes, num_samples, min_time, seed):
+    """
+    - Episodes per second written and read, in the npz and csv formats
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        npz_path, csv_path = os.path.join(tmp_dir, 'dataset.npz'), os.path.join(tmp_dir, 'dataset.csv')
+        for grid_size in grid_sizes:
+            grid_maker = GridMaker(grid_size=grid_size, min_distance=min(3, grid_size - 1))
+            for n in num_samples:
+                object1, object2, lengths, collisions = grid_maker.generate_batch(n, mode='find_path', rng=np.random.default_rng(seed))
+                params = {'grid_size': grid_size, 'num_samples': n, 'steps': int(lengths.sum())}
+                tag = f'grid{grid_size}/n{n}'
+
+                write_npz = lambda: save_trajectories(npz_path, from_padded(object1, object2, lengths, grid_size, collisions))
+                results.append(result(f'io/npz_write/{tag}', throughput(write_npz, n, min_time), 'episodes/s', **params))
+                results.append(result(f'io/npz_read/{tag}', throughput(lambda: load_trajectories(npz_path), n, min_time), 'episodes/s', **params))
+
+                def read_mmap():
+                    dataset = TrajectoryDataset(npz_path)
+                    for i in range(len(dataset)):
+                        dataset[i]['object1_action'].sum()
+                results.append(result(f'io/npz_mmap_episodes/{tag}', throughput(read_mmap, n, min_time), 'episodes/s', **params))
+
+                write_csv = lambda: data_driver.write_chunk(csv_path, object1, object2, lengths, collisions)
+                results.append(result(f'io/csv_write/{tag}', throughput(write_csv, n, min_time), 'episodes/s', **params))
+                results.append(result(f'io/csv_read/{tag}', throughput(lambda: read_csv(csv_path), n, min_time), 'episodes/s', **params))
+    return results
+
+
+def bench_plot_grid(grid_sizes, num_samples, min_time, seed):
+    """
+    - Frames per second of plot_grid, of the reused GridPlotter figure and of the NumPy rasterizer,
+      episodes per second of the gif and contact sheet export
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for grid_size in grid_sizes:
+            grid_maker = GridMaker(grid_size=grid_size, min_distance=min(3, grid_size - 1))
+            for n in num_samples:
+                num_frames = max(1, n // 20)
+                object1, object2, lengths, _ = grid_maker.generate_batch(num_frames, mode='find_path', rng=np.random.default_rng(seed))
+                positions = [(tuple(a), tuple(b)) for a, b in zip(object1[:, 0].tolist(), object2[:, 0].tolist())]
+                params = {'grid_size': grid_size, 'num_frames': num_frames}
+                tag = f'grid{grid_size}/frames{num_frames}'
+
+                def run_plot_grid():
+                    for k, (a, b) in enumerate(positions):
+                        plot_grid(grid_size, a, b, os.path.join(tmp_dir, f'frame{k}'))
+                results.append(result(f'plot_grid/plot_grid/{tag}', throughput(run_plot_grid, num_frames, min_time), 'frames/s', **params))
+
+                plotter = GridPlotter(grid_size)
+                def run_plotter():
+                    for k, (a, b) in enumerate(positions):
+                        plotter.plot(a, b, os.path.join(tmp_dir, f'frame{k}'))
+                results.append(result(f'plot_grid/grid_plotter/{tag}', throughput(run_plotter, num_frames, min_time), 'frames/s', **params))
+
+                # first frame of every episode, like the frames above
+                ones = np.ones(num_frames, dtype=np.int64)
+                run_raster = lambda: write_episodes(object1[:, :1], object2[:, :1], ones, grid_size, tmp_dir)
+                results.append(result(f'plot_grid/raster/{tag}', throughput(run_raster, num_frames, min_time), 'frames/s', **params))
+
+                # whole episodes as gif animations and as one contact sheet, with small cells: the images of
+                # a batch are held in memory and episodes of large grids have many frames
+                for fmt, batch_size in (('gif', 8), ('sheet', num_frames)):
+                    run_export = lambda: write_episodes(object1, object2, lengths, grid_size, tmp_dir, fmt=fmt, cell_size=4, batch_size=batch_size)
+                    results.append(result(f'plot_grid/{fmt}/{tag}', throughput(run_export, num_frames, min_time), 'episodes/s', **params))
+    return results
+
+
+def heavy_imports(args):
+    """
+    - HEAVY_MODULES imported by `python *args`, read from the -X importtime log
+    """
+    log = subprocess.run([sys.executable, '-X', 'importtime', *args], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__))).stderr
+    modules = {line.split('|')[-1].strip().split('.')[0] for line in log.splitlines() if line.startswith('import time:')}
+    return sorted(modules.intersection(HEAVY_MODULES))
+
+
+def bench_startup(grid_sizes, num_samples, min_time, seed):
+    """
+    - Seconds to run each of STARTUP_COMMANDS in a new interpreter (fastest run), lower is better
+    """
+    results = []
+    for name, args in STARTUP_COMMANDS.items():
+        run = lambda: subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+        entry = result(f'startup/{name}', 1 / throughput(run, 1, min_time), 's', heavy_modules=heavy_imports(args))
+        entry['higher_is_better'] = False
+        results.append(entry)
+    return results
+
+
+BENCHMARKS = {
+    'episodes': bench_episodes,
+    'place_rectangles': bench_place_rectangles,
+    'io': bench_io,
+    'plot_grid': bench_plot_grid,
+    'startup': bench_startup,
+    }
+
+
+def compare(results, previous, threshold):
+    """
+    - Prints the change of every result also in `previous`, returns the names of the regressions
+    """
+    previous = {entry['name']: entry for entry in previous['results']}
+    regressions = []
+    print(f'\n{"benchmark":<60} {"before":>12} {"after":>12} {"change":>8}')
+    for entry in results:
+        if entry['name'] not in previous:
+            continue
+        before, after = previous[entry['name']]['value'], entry['value']
+        # > 1 is an improvement, whether higher or lower values are better
+        ratio = after / before if entry['higher_is_better'] else before / after
+        regression = ratio < 1 - threshold
+        if regression:
+            regressions.append(entry['name'])
+        print(f'{entry["name"]:<60} {before:12.3f} {after:12.3f} {ratio - 1:+8.1%}{"  REGRESSION" if regression else ""}')
+    return regressions
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+
+    results = []
+    for group in args.groups:
+        print(f'Running {group} benchmarks...')
+        group_results = BENCHMARKS[group](args.grid_sizes, args.num_samples, args.min_time, args.seed)
+        for entry in group_results:
+            print(f'  {entry["name"]:<60} {entry["value"]:12.3f} {entry["unit"]}')
+        results.extend(group_results)
+
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'args': vars(args),
+        'results': results,
+        }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    failed = False
+    heavy = [entry for entry in results if entry['params'].get('heavy_modules')]
+    for entry in heavy:
+        print(f'{entry["name"]} imports {", ".join(entry["params"]["heavy_modules"])}, import them where they are used')
+        failed = True
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) of more than {args.threshold:.0%}')
+            failed = True
+        else:
+            print(f'\nNo regression of more than {args.threshold:.0%}')
+    if failed:
+        sys.exit(1)
@@ -1,17 +1,393 @@
 # Driver file for the data, datasets, dataloaders, and etc
 
 import argparse
-from grid_maker import GridMaker, plot_grid
-import pandas as pd 
+import json
+import os
+import shutil
+import time
+from multiprocessing import Pool
+from generation import GRID_SIZE, MIN_DISTANCE, RANDOMNESS_FACTOR, generate_episodes, generate_samples
+from episode_rng import VERSION as RNG_VERSION
+from grid_renderer import CELL_SIZE, RENDER_WINDOW, encode_episodes, window_origins, write_files
+from episode_cache import EpisodeCache
+import profiling
+from episode_index import compute_features, concatenate_indexes, episode_modes, index_path, save_index
+from trajectory_io import concatenate_files, from_padded, load_trajectories, save_trajectories, to_padded
+from dataset_shards import MANIFEST_NAME, add_shard, next_shard_path, read_manifest
 import numpy as np
-from tqdm import tqdm
+from utils.basic_functions import str2bool
+
+# Output file (without extension) of every supported --data option
+DATASETS = {
+    'grid_maker_random_directions': './data/grid_dataset/grid_dataset',
+    'grid_maker_fixed_direction': './data/grid_dataset/grid_dataset_fixed_direction',
+}
+
+# Frames of the collision samples of 'grid_maker_random_directions'
+FRAMES_DIR = './data/grid_dataset_images'
+
+# Samples of a cache entry of --cache_dir: the cache holds aligned blocks of sample ids [k * CACHE_BLOCK, (k + 1) * CACHE_BLOCK)
+# whatever the --chunk_size, a chunk is assembled from the blocks holding it (chunk sizes that are multiples of it do no extra work)
+CACHE_BLOCK = 1000
+
+# Stages of run_pipeline
+PIPELINE_STAGES = ('generate', 'encode', 'write')
 
 def get_parser():
     parser = argparse.ArgumentParser(description='Driver file for the data')
     parser.add_argument('--data', type=str, default='data.csv', help='Path to the data file')
     parser.add_argument('--num_samples', type=int, default=100, help='Number of samples to generate')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes generating chunks in parallel')
+    parser.add_argument('--chunk_size', '--shard_size', type=int, default=10000, help='Number of samples generated and written to disk at once')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the dataset, a random one is picked (and printed) if not given')
+    parser.add_argument('--resume', type=str2bool, default=False, help='Continue an interrupted run from its last completed chunk')
+    parser.add_argument('--grid_size', type=int, default=GRID_SIZE, help='Size of the grid (grid_size x grid_size)')
+    parser.add_argument('--render_window', type=int, default=RENDER_WINDOW, help='Frames of grids larger than this are cropped to a window of this many cells around the collision cell')
+    parser.add_argument('--cell_size', type=int, default=CELL_SIZE, help='Size of a grid cell in pixels in the rendered frames')
+    parser.add_argument('--format', type=str, default='npz', choices=['npz', 'csv'], help='npz (columnar, see trajectory_io.py) or csv (stringified tuples)')
+    parser.add_argument('--append', type=str2bool, default=False, help='Add the samples as a new shard of the dataset (see dataset_shards.py) instead of overwriting it')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Cache of generated chunks and frames shared by all runs (see episode_cache.py), disabled by default')
+    parser.add_argument('--cache_size', type=float, default=1024, help='Size cap of the cache in MB, least recently used entries are evicted')
+    parser.add_argument('--profile', type=str2bool, default=False, help=f'Time the stages of the run and count steps, placements and frames (see profiling.py), also enabled by ${profiling.ENV_VAR}')
+    parser.add_argument('--profile_output', type=str, default=profiling.DEFAULT_OUTPUT, help='Where --profile writes its JSON summary')
+    parser.add_argument('--pipeline', type=str2bool, default=True, help='With --workers 1, overlap the generation, png encoding and file writes of consecutive chunks (see run_pipeline)')
+    parser.add_argument('--queue_size', type=int, default=4, help='Items (chunks or frame batches) waiting between two stages of --pipeline before the earlier stage pauses')
+    parser.add_argument('--cprofile_chunks', type=int, default=0, help='Run the first N chunks under cProfile, the statistics are written next to --profile_output (.prof)')
     return parser
 
+
+def to_tuples(actions, lengths):
+    """
+    - Converts padded (n, T, 2) position arrays to lists of tuples, the format stored in the csv
+    """
+    return [list(map(tuple, episode[:length])) for episode, length in zip(actions.tolist(), lengths.tolist())]
+
+
+def write_chunk(chunk_path, object1_actions, object2_actions, lengths, collisions, grid_size=GRID_SIZE):
+    """
+    - Writes one chunk of samples to its own file.
+    - The file is written under a temporary name and renamed when complete, so after a crash
+      every existing chunk file is a complete chunk and --resume can skip it.
+    """
+    tmp_path = chunk_path + '.tmp'
+    if chunk_path.endswith('.csv'):
+        dataset = {
+            'grid_size': [grid_size] * len(lengths),
+            'object1_action': to_tuples(object1_actions, lengths),
+            'object2_action': to_tuples(object2_actions, lengths),
+            'collision_status': collisions.tolist()
+            }
+        import pandas as pd
+        df = pd.DataFrame(dataset)
+        df.to_csv(tmp_path, index=False)
+    else:
+        save_trajectories(tmp_path, from_padded(object1_actions, object2_actions, lengths, grid_size, collisions))
+    os.replace(tmp_path, chunk_path)
+
+
+def frame_batches(start, object1_actions, object2_actions, lengths, grid_size=GRID_SIZE, cell_size=CELL_SIZE, render_window=None, batch_size=64):
+    """
+    - Encodes the frames of the collision samples of 'grid_maker_random_directions' (samples [start, start + n))
+      as cell_size pixel cells, yields lists of (file name, png bytes) of batch_size episodes
+    - Grids larger than render_window are cropped to render_window x render_window cells around the collision cell
+    """
+    #TODO: Move visualization part to grid_dataset_visualizer.py
+    collision_ids = np.flatnonzero((start + np.arange(len(lengths))) % 2 == 0)
+    window = None
+    if render_window is not None and grid_size > render_window:
+        # the episodes end on the collision cell
+        last = lengths[collision_ids] - 1
+        window = (window_origins(object1_actions[collision_ids, last], object2_actions[collision_ids, last], grid_size, render_window),
+                  render_window)
+    batches = encode_episodes(object1_actions[collision_ids], object2_actions[collision_ids], lengths[collision_ids],
+                              grid_size, sample_ids=start + collision_ids + 1, cell_size=cell_size, batch_size=batch_size, window=window)
+    while True:
+        with profiling.stage('encode'):
+            files = next(batches, None)
+        if files is None:
+            return
+        yield files
+
+
+def cache_blocks(start, stop):
+    """
+    - First sample ids of the cache blocks holding samples [start, stop), see CACHE_BLOCK
+    """
+    return range(start - start % CACHE_BLOCK, stop, CACHE_BLOCK)
+
+
+def frame_sample(name):
+    # sample id of a frame file of frame_batches, sample{id + 1}_frame{j}.png
+    return int(name[6:name.index('_')]) - 1
+
+
+def simulate_chunk(task):
+    """
+    - First part of generate_chunk: generates the samples of the chunk and their features,
+      or writes the chunk files from the cached blocks holding it
+    - With a cache, the whole blocks holding the chunk are generated (chunk['range']), so that they can be stored
+    - Returns the chunk as a dict, with 'cached' True if it was copied from the cache
+    """
+    data, chunk_id, start, stop, seed, chunk_path, cell_size, cache_dir, cache_size, grid_size, render_window = task
+    chunk = {'task': task, 'num_samples': stop - start, 'render': data == 'grid_maker_random_directions',
+             'cache': None, 'cached': False, 'range': (start, stop), 'frame_paths': []}
+
+    if cache_dir is not None:
+        cache = chunk['cache'] = EpisodeCache(cache_dir, int(cache_size * 2 ** 20))
+        # a block only depends on these, every sample is drawn from the stream of its id (episode_rng.py),
+        # not on the chunk size or the chunk id
+        key = (data, grid_size, MIN_DISTANCE, RANDOMNESS_FACTOR, RNG_VERSION, seed, CACHE_BLOCK)
+        # the window only changes the frames when they are cropped
+        frame_params = (cell_size,) if grid_size <= render_window else (cell_size, render_window)
+        chunk['blocks'] = [(first, EpisodeCache.key('samples', *key, first), EpisodeCache.key('index', *key, first),
+                            EpisodeCache.key('frames', *key, first, *frame_params)) for first in cache_blocks(start, stop)]
+
+        with profiling.stage('cache_fetch'):
+            if fetch_blocks(chunk):
+                chunk['cached'] = True
+                return chunk
+        if chunk['blocks']:
+            chunk['range'] = (chunk['blocks'][0][0], chunk['blocks'][-1][0] + CACHE_BLOCK)
+
+    # samples past the end of the dataset (at the end of the last block) are generated like the others
+    first, last = chunk['range']
+    with profiling.stage('generate'):
+        chunk['samples'] = object1_actions, object2_actions, lengths, collisions = generate_samples(data, first, last, seed, grid_size)
+    with profiling.stage('index'):
+        chunk['features'] = compute_features(object1_actions, object2_actions, lengths, grid_size, collisions, episode_modes(data, first, last))
+    return chunk
+
+
+def fetch_blocks(chunk):
+    """
+    - Writes the chunk file and its index from the cached blocks holding the chunk, and extracts the frames
+      of its samples, returns False if a block is missing
+    - The blocks are fetched to a scratch directory next to the chunk file, removed afterwards
+    """
+    data, chunk_id, start, stop, seed, chunk_path, cell_size, cache_dir, cache_size, grid_size, render_window = chunk['task']
+    cache = chunk['cache']
+    scratch = chunk_path + '.blocks'
+    os.makedirs(scratch, exist_ok=True)
+    try:
+        paths = []
+        for first, samples_key, features_key, frames_key in chunk['blocks']:
+            path = os.path.join(scratch, f'{first}.npz')
+            if not (cache.fetch(features_key, index_path(path)) and cache.fetch(samples_key, path)):
+                return False
+            paths.append(path)
+        if chunk['render']:
+            for first, samples_key, features_key, frames_key in chunk['blocks']:
+                if not cache.fetch_files(frames_key, FRAMES_DIR, lambda name: start <= frame_sample(name) < stop):
+                    return False
+
+        # ids in the concatenated blocks
+        ids = np.arange(start, stop) - (start - start % CACHE_BLOCK)
+        blocks_path = os.path.join(scratch, 'blocks.npz')
+        concatenate_files(paths, blocks_path)
+        dataset = load_trajectories(blocks_path, mmap=True)
+        features = concatenate_indexes([index_path(path) for path in paths])
+        save_index(index_path(chunk_path), {feature: values[ids] for feature, values in features.items()})
+        write_chunk(chunk_path, *to_padded(dataset, ids), dataset['collision_status'][ids], grid_size=grid_size)
+        # the memory maps are closed before the scratch directory is removed
+        del dataset
+        return True
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def chunk_frames(chunk):
+    # frame_batches of a simulated chunk
+    data, chunk_id, start, stop, seed, chunk_path, cell_size, cache_dir, cache_size, grid_size, render_window = chunk['task']
+    return frame_batches(chunk['range'][0], *chunk['samples'][:3], grid_size=grid_size, cell_size=cell_size, render_window=render_window)
+
+
+def write_frames(chunk, files):
+    """
+    - Writes a batch of encoded frames of the chunk (from frame_batches)
+    - Frames of the samples of the blocks outside the chunk only go to the cache, they are written to a scratch
+      directory next to the chunk file until save_chunk stores them
+    """
+    data, chunk_id, start, stop, seed, chunk_path, cell_size, cache_dir, cache_size, grid_size, render_window = chunk['task']
+    inside = [start <= frame_sample(name) < stop for name, png in files]
+    with profiling.stage('write_frames'):
+        chunk['frame_paths'] += write_files(FRAMES_DIR, [file for file, keep in zip(files, inside) if keep])
+        if not all(inside):
+            os.makedirs(chunk_path + '.blocks', exist_ok=True)
+            chunk['frame_paths'] += write_files(chunk_path + '.blocks', [file for file, keep in zip(files, inside) if not keep])
+    profiling.count('frames_rendered', len(files))
+
+
+def save_chunk(chunk):
+    """
+    - Last part of generate_chunk, once the frames are written: writes the index and then the chunk file,
+      so that a chunk file on disk always has its index and frames (--resume skips it), and stores the blocks
+      holding the chunk in the cache
+    """
+    data, chunk_id, start, stop, seed, chunk_path, cell_size, cache_dir, cache_size, grid_size, render_window = chunk['task']
+    first, last = chunk['range']
+    rows = slice(start - first, stop - first)
+    with profiling.stage('index'):
+        save_index(index_path(chunk_path), {feature: values[rows] for feature, values in chunk['features'].items()})
+    with profiling.stage('serialize'):
+        write_chunk(chunk_path, *[array[rows] for array in chunk['samples']], grid_size=grid_size)
+
+    if chunk['cache'] is not None:
+        scratch = chunk_path + '.blocks'
+        os.makedirs(scratch, exist_ok=True)
+        with profiling.stage('cache_store'):
+            for block, samples_key, features_key, frames_key in chunk['blocks']:
+                rows = slice(block - first, block - first + CACHE_BLOCK)
+                object1_actions, object2_actions, lengths, collisions = [array[rows] for array in chunk['samples']]
+                block_path = os.path.join(scratch, f'{block}.npz')
+                save_trajectories(block_path, from_padded(object1_actions, object2_actions, lengths, grid_size, collisions))
+                save_index(index_path(block_path), {feature: values[rows] for feature, values in chunk['features'].items()})
+                chunk['cache'].store(samples_key, block_path)
+                chunk['cache'].store(features_key, index_path(block_path))
+                if chunk['render']:
+                    chunk['cache'].store_files(frames_key, [path for path in chunk['frame_paths']
+                                                            if block <= frame_sample(os.path.basename(path)) < block + CACHE_BLOCK])
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def chunk_result(chunk):
+    # (number of samples, 1 if the chunk was in the cache, 1 if it was not)
+    if chunk['cache'] is None:
+        return chunk['num_samples'], 0, 0
+    return (chunk['num_samples'], 1, 0) if chunk['cached'] else (chunk['num_samples'], 0, 1)
+
+
+def generate_chunk(task):
+    """
+    - Generates samples [start, stop) of the dataset and flushes them to their own chunk file.
+    - Every sample draws from its own random stream, derived from the dataset seed and the sample id,
+      so the content of a chunk does not depend on which process (or how many) generates it, nor on the chunk size.
+    - Only one chunk is held in memory at a time, whatever the number of samples.
+    - The frames and the feature index of the chunk (episode_index.py) are written before the chunk file,
+      so that a chunk file on disk always has its index and frames
+    - With a cache, chunks (and their index and frames) generated by an earlier run with the same parameters are
+      copied from the cache instead. Returns (number of samples, 1 if the chunk was in the cache, 1 if it was not).
+    """
+    chunk = simulate_chunk(task)
+    if not chunk['cached']:
+        if chunk['render']:
+            for files in chunk_frames(chunk):
+                write_frames(chunk, files)
+        save_chunk(chunk)
+    return chunk_result(chunk)
+
+
+def run_pipeline(tasks, queue_size=4, progress=None):
+    """
+    - Generates the chunks of tasks like generate_chunk, as three stages running concurrently (one thread each):
+        generate: simulate_chunk, the samples and features of the next chunk (or its cache lookup)
+        encode: the png frames of the chunk, one batch of episodes at a time
+        write: the frame files, then the index and chunk files
+      NumPy, zlib and file writes release the GIL, so the disk writes of a chunk overlap with the encoding
+      of the next frames and the simulation of the next chunk, and the wall time approaches the time of
+      the slowest stage instead of the sum of all stages.
+    - The stages are connected by queues of queue_size items: a stage waits when the next one is that far behind
+      (backpressure), so only a few chunks and frame batches are held in memory
+    - Returns (hits, misses, stats), stats: {stage: {'items', 'samples', 'frames', 'seconds'}}, seconds is the busy time
+    """
+    import asyncio
+
+    stats = {stage: {'items': 0, 'samples': 0, 'frames': 0, 'seconds': 0.0} for stage in PIPELINE_STAGES}
+    hits = misses = 0
+
+    async def work(stage, fn, *args):
+        start = time.perf_counter()
+        result = await asyncio.to_thread(fn, *args)
+        stats[stage]['seconds'] += time.perf_counter() - start
+        stats[stage]['items'] += 1
+        return result
+
+    async def generate(encode_queue):
+        for task in tasks:
+            chunk = await work('generate', simulate_chunk, task)
+            stats['generate']['samples'] += 0 if chunk['cached'] else chunk['num_samples']
+            await encode_queue.put(chunk)
+        await encode_queue.put(None)
+
+    async def encode(encode_queue, write_queue):
+        while (chunk := await encode_queue.get()) is not None:
+            if chunk['render'] and not chunk['cached']:
+                batches = chunk_frames(chunk)
+                while (files := await work('encode', next, batches, None)) is not None:
+                    stats['encode']['frames'] += len(files)
+                    await write_queue.put((chunk, files))
+                stats['encode']['samples'] += chunk['num_samples']
+            # the chunk itself comes after its frames
+            await write_queue.put((chunk, None))
+        await write_queue.put(None)
+
+    async def write(write_queue):
+        nonlocal hits, misses
+        while (item := await write_queue.get()) is not None:
+            chunk, files = item
+            if files is not None:
+                await work('write', write_frames, chunk, files)
+                stats['write']['frames'] += len(files)
+                continue
+            if not chunk['cached']:
+                await work('write', save_chunk, chunk)
+            n, chunk_hits, chunk_misses = chunk_result(chunk)
+            stats['write']['samples'] += n
+            hits, misses = hits + chunk_hits, misses + chunk_misses
+            if progress is not None:
+                progress.update(n)
+
+    async def pipeline():
+        encode_queue, write_queue = asyncio.Queue(queue_size), asyncio.Queue(queue_size)
+        await asyncio.gather(generate(encode_queue), encode(encode_queue, write_queue), write(write_queue))
+
+    asyncio.run(pipeline())
+    return hits, misses, stats
+
+
+def pipeline_report(stats, wall_time):
+    """
+    - Table of the throughput of every stage of run_pipeline while it was busy, and its share of the wall time
+    """
+    lines = [f'{"stage":<10} {"items":>8} {"samples":>10} {"frames":>10} {"busy s":>8} {"busy %":>7} {"samples/s":>10} {"frames/s":>10}']
+    for stage, entry in stats.items():
+        busy = entry['seconds']
+        lines.append(f'{stage:<10} {entry["items"]:>8} {entry["samples"]:>10} {entry["frames"]:>10} {busy:>8.2f} {busy / wall_time:>7.1%} '
+                     f'{entry["samples"] / busy if busy else 0:>10.0f} {entry["frames"] / busy if busy else 0:>10.0f}')
+    lines.append(f'{"wall time":<10} {"":>8} {"":>10} {"":>10} {wall_time:>8.2f}')
+    return '\n'.join(lines)
+
+
+def run_chunk(task):
+    """
+    - generate_chunk(task) for a (task, cprofile_path) pair, under cProfile when cprofile_path is not None
+    - Returns the result of generate_chunk and the profiling timers of the chunk (None when profiling is disabled)
+    """
+    task, cprofile_path = task
+    if cprofile_path is None:
+        result = generate_chunk(task)
+    else:
+        result = profiling.run_cprofile(cprofile_path, generate_chunk, task)
+    return result + (profiling.collect() if profiling.enabled else None,)
+
+
+def merge_chunks(chunk_paths, output_path):
+    """
+    - Concatenates the chunk files (in chunk order) into one file, one chunk at a time
+    - csv chunks are concatenated as text, keeping only the first header
+    """
+    if not output_path.endswith('.csv'):
+        concatenate_files(chunk_paths, output_path)
+        return
+
+    with open(output_path, 'w') as output:
+        for k, chunk_path in enumerate(chunk_paths):
+            with open(chunk_path) as chunk:
+                header = chunk.readline()
+                if k == 0:
+                    output.write(header)
+                shutil.copyfileobj(chunk, output)
+
+
 if __name__ == '__main__':
     parser = get_parser()
     args = parser.parse_args()
@@ -19,90 +395,115 @@ if __name__ == '__main__':
     # Display the arguments
     print(args)
 
+    # before the worker processes are started, so that they inherit it
+    if args.profile:
+        profiling.enable(args.profile_output)
+
     #TODO: Decide if we want to manage our data_driver this way
     # Long statements of if-else to determine which data to use
     # It will be easily readable, but a bit long in the future
-    
+
     # 'grid_maker' is the data that we will use to test our "main" idea on a smaller scale
-    # Data contains 10x10 grid with two objects (1 and 2)
-    if args.data == 'grid_maker_random_directions':
-        # Create a dictionary dataset
-        dataset = {
-            'grid_size': [],
-            'object1_action': [],
-            'object2_action': [],
-            'collision_status': []
-            }
+    if args.data in DATASETS:
+        output_path = f'{DATASETS[args.data]}.{args.format}'
+        if args.append:
+            # the run becomes a new shard next to the manifest, the previous shards are not touched
+            manifest_path = os.path.join(f'{DATASETS[args.data]}_shards', MANIFEST_NAME)
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            output_path = next_shard_path(manifest_path, args.format)
 
-        # Create a grid 
-        grid_maker = GridMaker(grid_size=10, min_distance=3)
-        
-        grid_maker.create_grid()
+        # chunks of the run are written next to the output, with the parameters needed to resume it
+        chunk_dir = DATASETS[args.data] + '_chunks'
+        config_path = os.path.join(chunk_dir, 'config.json')
+        config = {'data': args.data, 'num_samples': args.num_samples, 'chunk_size': args.chunk_size, 'format': args.format, 'grid_size': args.grid_size,
+                  'rng_version': RNG_VERSION}
 
-        # use tqdm to display the progress bar
-        for i in tqdm(range(args.num_samples), desc='Generating samples'):
-            # Generate initial positions for the objects 
-            object1_pos, object2_pos = grid_maker.place_rectangles()
-
-            # Find the path for the objects to collide
-            # or
-            # Find the path for the objects to not collide
-            # randomly generate max_length from 3 to 10
-
-            #TODO: Move visualization part to grid_dataset_visualizer.py
-            dataset['grid_size'].append(grid_maker.grid_size)
-            if i % 2 == 0:
-                object1_coll_actions, object2_coll_actions = grid_maker.find_path(object1_pos, object2_pos, randomness_factor=0.1)
-                dataset['collision_status'].append(1)
-                dataset['object1_action'].append(object1_coll_actions)
-                dataset['object2_action'].append(object2_coll_actions)
-                
-                for j, (pos_1, pos_2) in enumerate(zip(object1_coll_actions, object2_coll_actions)):
-                    grid_maker.grid.fill(0)
-                    grid_maker.grid[pos_1] = 2
-                    grid_maker.grid[pos_2] = 1
-                    plot_grid(grid_maker.grid, pos_1, pos_1, path=f'./data/grid_dataset_images/sample{i+1}_frame{j}')
+        if args.resume and os.path.exists(config_path):
+            with open(config_path) as f:
+                resumed_config = json.load(f)
+            if args.seed is None:
+                args.seed = resumed_config['seed']
+            if resumed_config != dict(config, seed=args.seed):
+                parser.error(f'--resume: the interrupted run in {chunk_dir} was started with {resumed_config}')
+        else:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
 
-            else:
-                max_length = np.random.randint(3, 10)
-                object1_noncoll_actions, object2_noncoll_actions = grid_maker.find_non_collision_path(object1_pos, object2_pos, max_length=max_length, randomness_factor=0.1)
-                dataset['collision_status'].append(0)
-                dataset['object1_action'].append(object1_noncoll_actions)
-                dataset['object2_action'].append(object2_noncoll_actions)
+        # the seed is printed so that the same dataset can be generated again
+        seed = np.random.SeedSequence(args.seed).entropy
+        print(f'Seed: {seed}')
 
-        # Save the dataset to a csv file
-        df = pd.DataFrame(dataset)
-        df.to_csv('./data/grid_dataset/grid_dataset.csv', index=False)
+        os.makedirs(chunk_dir, exist_ok=True)
+        with open(config_path, 'w') as f:
+            json.dump(dict(config, seed=seed), f)
 
-    elif args.data == 'grid_maker_fixed_direction':
-        # Create a dictionary dataset
-        dataset = {
-            'grid_size': [],
-            'object1_action': [],
-            'object2_action': [],
-            'collision_status': []
-            }
+        # the dataset is split into chunks of --chunk_size samples, each written to its own file
+        # the output only depends on --seed, not on --chunk_size or --workers
+        tasks = []
+        for chunk_id, start in enumerate(range(0, args.num_samples, args.chunk_size)):
+            stop = min(start + args.chunk_size, args.num_samples)
+            tasks.append((args.data, chunk_id, start, stop, seed, os.path.join(chunk_dir, f'chunk_{chunk_id:05d}.{args.format}'),
+                          args.cell_size, args.cache_dir, args.cache_size, args.grid_size, args.render_window))
 
-        # Create a grid 
-        grid_maker = GridMaker(grid_size=10, min_distance=3)
-        
-        grid_maker.create_grid()
+        # chunks completed by an interrupted run are kept
+        done = lambda task: os.path.exists(task[5]) and os.path.exists(index_path(task[5]))
+        pending = [(task, os.path.join(chunk_dir, f'chunk_{task[1]:05d}.prof') if task[1] < args.cprofile_chunks else None)
+                   for task in tasks if not done(task)]
+        completed = sum(task[3] - task[2] for task in tasks if done(task))
 
         # use tqdm to display the progress bar
-        for i in tqdm(range(args.num_samples), desc='Generating samples'):
-            # Generate initial positions for the objects 
-            object1_pos, object2_pos = grid_maker.place_rectangles()
-
-            dataset['grid_size'].append(grid_maker.grid_size)
-            
-            object1_coll_actions, object2_coll_actions, collision = grid_maker.fix_direction_action()
-            dataset['collision_status'].append(collision[0])
-            dataset['object1_action'].append(object1_coll_actions)
-            dataset['object2_action'].append(object2_coll_actions)
-
-        # Save the dataset to a csv file
-        df = pd.DataFrame(dataset)
-        df.to_csv('./data/grid_dataset/grid_dataset_fixed_direction.csv', index=False)
+        from tqdm import tqdm
+        hits = misses = 0
+        with tqdm(total=args.num_samples, initial=completed, desc='Generating samples') as progress:
+            if args.workers > 1:
+                with Pool(args.workers) as pool:
+                    results = pool.imap_unordered(run_chunk, pending)
+                    for n, chunk_hits, chunk_misses, stats in results:
+                        progress.update(n)
+                        hits, misses = hits + chunk_hits, misses + chunk_misses
+                        if stats is not None:
+                            profiling.merge(stats)
+            else:
+                # chunks run under cProfile are generated one at a time, the others go through the pipeline
+                for task in (pending if not args.pipeline else [task for task in pending if task[1] is not None]):
+                    n, chunk_hits, chunk_misses, stats = run_chunk(task)
+                    progress.update(n)
+                    hits, misses = hits + chunk_hits, misses + chunk_misses
+                    if stats is not None:
+                        profiling.merge(stats)
+                if args.pipeline:
+                    pipeline_start = time.perf_counter()
+                    chunk_hits, chunk_misses, pipeline_stats = run_pipeline([task for task, path in pending if path is None], args.queue_size, progress)
+                    pipeline_time = time.perf_counter() - pipeline_start
+                    hits, misses = hits + chunk_hits, misses + chunk_misses
+
+        if args.workers <= 1 and args.pipeline:
+            print(pipeline_report(pipeline_stats, pipeline_time))
+
+        cprofile_paths = [path for _, path in pending if path is not None and os.path.exists(path)]
+        if cprofile_paths:
+            cprofile_output = os.path.splitext(args.profile_output)[0] + '.prof'
+            print(profiling.cprofile_report(cprofile_paths, cprofile_output))
+            print(f'cProfile statistics of {len(cprofile_paths)} chunks written to {cprofile_output}')
+
+        # Save the dataset to a single file
+        with profiling.stage('merge'):
+            merge_chunks([task[5] for task in tasks], output_path)
+            # the feature index is a small sidecar file next to the dataset, e.g. grid_dataset.index.npz
+            concatenate_indexes([index_path(task[5]) for task in tasks], index_path(output_path))
+        shutil.rmtree(chunk_dir)
+
+        if args.append:
+            if any(shard.get('seed') == seed for shard in read_manifest(manifest_path)['shards']):
+                print(f'Warning: a shard of {manifest_path} was already generated with seed {seed}, it has the same samples')
+            shard = add_shard(manifest_path, output_path, data=args.data, seed=seed, chunk_size=args.chunk_size, grid_size=args.grid_size,
+                              min_distance=MIN_DISTANCE, randomness_factor=RANDOMNESS_FACTOR, rng_version=RNG_VERSION)
+            print(f'Added {shard["path"]} ({shard["num_samples"]} samples) to {manifest_path}')
+
+        if args.cache_dir is not None:
+            # hits and misses are counted in chunks, the cap is enforced even if nothing was stored
+            cache = EpisodeCache(args.cache_dir, int(args.cache_size * 2 ** 20))
+            cache.evict()
+            print(cache.report(hits, misses))
 
     else:
-        print(f'--data {args.data} is not supported')
\ No newline at end of file
+        print(f'--data {args.data} is not supported')
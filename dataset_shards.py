@@ -0,0 +1,227 @@
+# Datasets made of several shard files listed in a manifest
+#
+# `python data_driver.py --append True` writes every run as a new shard next to a manifest.json,
+# instead of overwriting the dataset file. The manifest records the number of samples, parameters,
+# seed and collision ratio of every shard:
+#   {"shards": [{"path": "shard_00000.npz", "num_samples": 1000000, "collisions": 500000, "collision_ratio": 0.5,
+#                "data": "grid_maker_random_directions", "seed": 1234, ...}, ...]}
+# Readers (load_trajectories, TrajectoryDataset, grid_dataset_visualizer.py) given the manifest see the union
+# of the shards, episode ids follow the shard order and nothing is copied.
+#
+#   python dataset_shards.py merge --manifest M --inputs a.npz b.npz other/manifest.json   add existing files as shards
+#   python dataset_shards.py compact --manifest M                                         rewrite all shards as one
+#   python dataset_shards.py info --manifest M                                            print the shards
+
+import argparse
+import json
+import os
+import numpy as np
+from episode_index import build_index, concatenate_indexes, index_path, save_index
+from trajectory_io import concatenate_files, convert_csv, load_trajectories
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class ConcatenatedArray:
+    """
+    - Read-only view of arrays concatenated along the first axis, without copying them
+    - Supports slices (a view when the slice is inside one array) and integer (array) indexing
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.starts = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(array) for array in arrays], out=self.starts[1:])
+        self.dtype = np.result_type(*arrays)
+        self.shape = (int(self.starts[-1]),) + arrays[0].shape[1:]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.concatenate(self.arrays).astype(dtype or self.dtype, copy=False)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            k = np.searchsorted(self.starts, start, side='right') - 1
+            if step == 1 and stop <= self.starts[k + 1]:
+                return self.arrays[k][start - self.starts[k]:stop - self.starts[k]]
+            return np.asarray(self)[index]
+
+        index = np.asarray(index)
+        shard = np.searchsorted(self.starts, index, side='right') - 1
+        if index.ndim == 0:
+            return self.arrays[shard][index - self.starts[shard]]
+
+        values = np.empty(index.shape + self.shape[1:], dtype=self.dtype)
+        for k in np.unique(shard):
+            in_shard = shard == k
+            values[in_shard] = self.arrays[k][index[in_shard] - self.starts[k]]
+        return values
+
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return {'shards': []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    # written under a temporary name and renamed, readers never see a partial manifest
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def shard_paths(manifest_path):
+    """
+    - Paths of the shards of a manifest, relative paths are relative to the manifest
+    """
+    directory = os.path.dirname(manifest_path)
+    return [os.path.join(directory, shard['path']) for shard in read_manifest(manifest_path)['shards']]
+
+
+def next_shard_path(manifest_path, fmt='npz'):
+    """
+    - Unused shard file name next to the manifest
+    """
+    directory = os.path.dirname(manifest_path)
+    k = len(read_manifest(manifest_path)['shards'])
+    while os.path.exists(os.path.join(directory, f'shard_{k:05d}.{fmt}')):
+        k += 1
+    return os.path.join(directory, f'shard_{k:05d}.{fmt}')
+
+
+def shard_info(path):
+    """
+    - Number of samples and collisions of a dataset file, read from its small columns only
+    """
+    collision_status = load_trajectories(path, mmap=True)['collision_status']
+    num_samples, collisions = len(collision_status), int(np.count_nonzero(collision_status == 1))
+    return {
+        'num_samples': num_samples,
+        'collisions': collisions,
+        'collision_ratio': collisions / num_samples if num_samples else 0.0,
+        }
+
+
+def add_shard(manifest_path, path, **parameters):
+    """
+    - Adds the dataset file at path to the manifest (created if needed), with its counts and the given parameters
+    - The file is not copied, its path is stored relative to the manifest
+    """
+    manifest = read_manifest(manifest_path)
+    entry = {'path': os.path.relpath(path, os.path.dirname(manifest_path) or '.')}
+    entry.update(shard_info(path))
+    entry.update(parameters)
+    manifest['shards'].append(entry)
+    write_manifest(manifest_path, manifest)
+    return entry
+
+
+def load_shards(manifest_path, mmap=False):
+    """
+    - Union of the shards of a manifest in the columnar format of trajectory_io.py
+    - The per-episode columns are concatenated, the per-step columns (object#_action) are
+      ConcatenatedArray views of the shards, so no trajectory is copied
+    """
+    datasets = [load_trajectories(path, mmap=mmap) for path in shard_paths(manifest_path)]
+    if not datasets:
+        raise ValueError(f'{manifest_path} has no shards')
+
+    # offsets of every shard start at 0, they are shifted by the steps of the previous shards
+    steps = np.cumsum([0] + [int(dataset['offsets'][-1]) for dataset in datasets])
+    offsets = [np.zeros(1, dtype=np.int64)] + [np.asarray(dataset['offsets'][1:]) + base for dataset, base in zip(datasets, steps)]
+
+    return {
+        'object1_action': ConcatenatedArray([dataset['object1_action'] for dataset in datasets]),
+        'object2_action': ConcatenatedArray([dataset['object2_action'] for dataset in datasets]),
+        'offsets': np.concatenate(offsets),
+        'grid_size': np.concatenate([dataset['grid_size'] for dataset in datasets]),
+        'collision_status': np.concatenate([dataset['collision_status'] for dataset in datasets]),
+        }
+
+
+def merge(manifest_path, inputs):
+    """
+    - Adds dataset files, or the shards of other manifests, to a manifest without copying them
+    """
+    for path in inputs:
+        if path.endswith('.json'):
+            directory = os.path.dirname(path)
+            for shard in read_manifest(path)['shards']:
+                parameters = {key: value for key, value in shard.items() if key not in ('path', 'num_samples', 'collisions', 'collision_ratio')}
+                add_shard(manifest_path, os.path.join(directory, shard['path']), **parameters)
+        else:
+            add_shard(manifest_path, path)
+
+
+def compact(manifest_path):
+    """
+    - Rewrites all the shards of a manifest as a single npz shard, offline: run it when no one reads the dataset
+    - The entries of the previous shards are kept in the new entry, shard files next to the manifest are deleted,
+      files added from elsewhere by merge are left in place
+    - The feature indexes of the shards (episode_index.py) are concatenated too, the index of a shard without one
+      (e.g. a file added by merge) is built from its trajectories first
+    """
+    manifest = read_manifest(manifest_path)
+    paths = shard_paths(manifest_path)
+
+    # csv shards are converted to temporary npz files first
+    converted = {path: f'{path}.compact.npz' for path in paths if path.endswith('.csv')}
+    for path, npz_path in converted.items():
+        convert_csv(path, npz_path)
+
+    output_path = next_shard_path(manifest_path)
+    concatenate_files([converted.get(path, path) for path in paths], output_path)
+
+    # indexes of the shards, the missing ones are built into temporary files next to the output
+    indexes, built = [], []
+    for shard, path in zip(manifest['shards'], paths):
+        if os.path.exists(index_path(path)):
+            indexes.append(index_path(path))
+            continue
+        built.append(f'{os.path.splitext(output_path)[0]}.{len(built)}.index.npz')
+        save_index(built[-1], build_index(converted.get(path, path), shard.get('data')))
+        indexes.append(built[-1])
+    concatenate_indexes(indexes, index_path(output_path))
+    for path in list(converted.values()) + built:
+        os.remove(path)
+
+    entry = {'path': os.path.basename(output_path)}
+    entry.update(shard_info(output_path))
+    entry['compacted_from'] = manifest['shards']
+    write_manifest(manifest_path, {'shards': [entry]})
+
+    directory = os.path.abspath(os.path.dirname(manifest_path))
+    for path in paths:
+        if os.path.dirname(os.path.abspath(path)) == directory:
+            os.remove(path)
+            if os.path.exists(index_path(path)):
+                os.remove(index_path(path))
+    return entry
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Merge, compact or list the shards of a dataset manifest')
+    parser.add_argument('command', type=str, choices=['merge', 'compact', 'info'], help='What to do with the manifest')
+    parser.add_argument('--manifest', type=str, required=True, help=f'Path to the manifest ({MANIFEST_NAME} of a shard directory)')
+    parser.add_argument('--inputs', type=str, nargs='+', default=[], help='merge: dataset files or manifests to add')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+
+    if args.command == 'merge':
+        os.makedirs(os.path.dirname(args.manifest) or '.', exist_ok=True)
+        merge(args.manifest, args.inputs)
+    elif args.command == 'compact':
+        compact(args.manifest)
+
+    shards = read_manifest(args.manifest)['shards']
+    for shard in shards:
+        print(f'{shard["path"]}: {shard["num_samples"]} samples, collision ratio {shard["collision_ratio"]:.3f}')
+    print(f'{len(shards)} shards, {sum(shard["num_samples"] for shard in shards)} samples')
@@ -0,0 +1,167 @@
+# Content-addressed cache of generated episodes and rendered frames, shared by all runs
+#
+# Entries are files named by the hash of their key, e.g. the parameters, seed and episode range of
+# a chunk of data_driver.py, or the positions of a plot_grid frame. The cache lives in a local
+# directory with a size cap: every hit refreshes the modification time of the entry, and when the
+# cache grows over the cap the least recently used entries are deleted.
+# Several processes can share a cache, entries are written under a temporary name and renamed.
+
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+
+# Bump when the generation or rendering code changes, so that old entries are not reused
+CACHE_VERSION = 1
+
+
+class EpisodeCache:
+    """
+    - fetch(key, path) copies the entry of key to path and returns True, or returns False on a miss
+    - store(key, path) copies the file at path into the cache
+    - fetch_files / store_files do the same for a group of files (kept as one zip entry)
+    - hits and misses count the fetches of this object
+    """
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # size of the cache, scanned at the first store
+        self._size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """
+        - Hash of the key parts (anything json can serialize), the name of the entry
+        """
+        text = json.dumps([CACHE_VERSION, *parts], sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        # 256 sub-directories, so that no directory holds too many entries
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _lookup(self, key):
+        path = self._path(key)
+        try:
+            # the access time of an entry is its modification time, refreshed on every hit
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def fetch(self, key, path):
+        entry = self._lookup(key)
+        if entry is None:
+            return False
+        try:
+            _copy(entry, path)
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            self.hits, self.misses = self.hits - 1, self.misses + 1
+            return False
+        return True
+
+    def store(self, key, path):
+        entry = self._path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        _copy(path, entry)
+        self._grow(os.path.getsize(entry))
+
+    def fetch_files(self, key, directory, select=None):
+        """
+        - Extracts the files stored with store_files into directory, returns False on a miss
+        - select(name) picks the files to extract, all of them by default
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            return False
+        try:
+            with zipfile.ZipFile(entry) as archive:
+                archive.extractall(directory, None if select is None else [name for name in archive.namelist() if select(name)])
+        except FileNotFoundError:
+            self.hits, self.misses = self.hits - 1, self.misses + 1
+            return False
+        return True
+
+    def store_files(self, key, paths):
+        """
+        - Stores the files at paths as one entry, they are extracted by their base names
+        """
+        entry = self._path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp_path = f'{entry}.{os.getpid()}.tmp'
+        # png files are already compressed
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as archive:
+            for path in paths:
+                archive.write(path, os.path.basename(path))
+        os.replace(tmp_path, entry)
+        self._grow(os.path.getsize(entry))
+
+    def _grow(self, size):
+        if self._size is None:
+            self._size = sum(entry_size for _, entry_size, _ in self._entries())
+        else:
+            self._size += size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        # (modification time, size, path) of every entry
+        entries = []
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self, max_bytes=None):
+        """
+        - If the cache is over max_bytes, deletes the least recently used entries until it is under 90%
+          of max_bytes, so that the next stores do not evict again right away
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size <= max_bytes:
+            entries = []
+        for _, entry_size, path in entries:
+            if size <= 0.9 * max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def report(self, hits=None, misses=None):
+        """
+        - One line summary of the hits and misses (of this object, or the given totals)
+        """
+        hits = self.hits if hits is None else hits
+        misses = self.misses if misses is None else misses
+        total = hits + misses
+        rate = hits / total if total else 0
+        if self._size is None:
+            self._size = sum(entry_size for _, entry_size, _ in self._entries())
+        return f'Cache {self.cache_dir}: {hits} hits, {misses} misses ({rate:.1%} hit rate), {self._size / 2 ** 20:.1f} MB'
+
+
+def _copy(src, dst):
+    # written under a temporary name and renamed, readers never see a partial file
+    tmp_path = f'{dst}.{os.getpid()}.tmp'
+    shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
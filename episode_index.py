@@ -0,0 +1,228 @@
+# Sidecar index of per-episode features, for filtering and sampling without reading the trajectories
+#
+# data_driver.py writes it next to the dataset: grid_dataset.npz -> grid_dataset.index.npz, one value per episode:
+#   length: number of recorded positions
+#   collision_step: first step where both objects are on the same cell, -1 if they never are
+#   min_distance: smallest Euclidean distance between the objects
+#   start_side: (n, 2) side of the start position of each object, index in SIDES (first matching side,
+#               with the bands of GridMaker.side_selection), -1 if it is not near an edge
+#   direction: (n, 2) direction of the first move of each object, index in DIRECTIONS, -1 if it did not move
+#   mode: GridMaker mode that generated the episode, index in BATCH_MODES, -1 if unknown
+#   collision_status: the label of the dataset
+#
+#   index = EpisodeIndex.load('./data/grid_dataset/grid_dataset.npz')
+#   ids = index.ids(index['length'] >= 8)
+#   ids = index.stratified_sample(1000, by='collision_status', where=index['length'] >= 8, rng=rng)  # 50/50
+#
+# python episode_index.py --data_path P --data D builds the index of a dataset written without it.
+
+import argparse
+import os
+import zipfile
+import numpy as np
+from grid_maker import BATCH_MODES, MOVES
+from trajectory_io import load_trajectories, to_padded, write_member
+
+SIDES = ('left', 'right', 'top', 'bottom')
+DIRECTIONS = ('up', 'down', 'left', 'right')
+FEATURES = ('length', 'collision_step', 'min_distance', 'start_side', 'direction', 'mode', 'collision_status')
+
+
+def index_path(dataset_path):
+    """
+    - Path of the index of a dataset file, or of a shard
+    """
+    return os.path.splitext(dataset_path)[0] + '.index.npz'
+
+
+def episode_modes(data, start, stop):
+    """
+    - Mode (index in BATCH_MODES) of samples [start, stop) of a data_driver.py dataset
+    """
+    ids = np.arange(start, stop)
+    if data == 'grid_maker_random_directions':
+        # even samples collide (find_path), odd samples do not (find_non_collision_path)
+        return np.where(ids % 2 == 0, BATCH_MODES.index('find_path'), BATCH_MODES.index('find_non_collision_path')).astype(np.int8)
+    if data == 'grid_maker_fixed_direction':
+        return np.full(len(ids), BATCH_MODES.index('fix_direction_action'), dtype=np.int8)
+    return np.full(len(ids), -1, dtype=np.int8)
+
+
+def compute_features(object1_actions, object2_actions, lengths, grid_size, collision_status, modes):
+    """
+    - Features of a batch of episodes given as the padded (n, T, 2) arrays of GridMaker.generate_batch
+    """
+    object1 = np.asarray(object1_actions, dtype=np.int32)
+    object2 = np.asarray(object2_actions, dtype=np.int32)
+    lengths = np.asarray(lengths)
+    n, steps = object1.shape[:2]
+    recorded = np.arange(steps) < lengths[:, None]
+
+    same = (object1 == object2).all(axis=2) & recorded
+    collision_step = np.where(same.any(axis=1), same.argmax(axis=1), -1)
+
+    distance = np.sqrt(((object1 - object2) ** 2).sum(axis=2), dtype=np.float32)
+    min_distance = np.where(recorded, distance, np.inf).min(axis=1, initial=np.inf)
+
+    # the first matching band of GridMaker.side_selection, corners are 'left' or 'right'
+    x, y = np.stack([object1[:, 0], object2[:, 0]], axis=1).transpose(2, 0, 1)
+    start_side = np.select([x <= 2, x >= grid_size - 3, y >= grid_size - 3, y <= 2], [0, 1, 2, 3], -1)
+
+    # first move of each object, compared with MOVES (same order as DIRECTIONS)
+    if steps > 1:
+        move = np.stack([object1[:, 1] - object1[:, 0], object2[:, 1] - object2[:, 0]], axis=1)
+        move[lengths < 2] = 0
+    else:
+        move = np.zeros((n, 2, 2), dtype=np.int32)
+    matches = (move[:, :, None, :] == MOVES).all(axis=3)
+    direction = np.where(matches.any(axis=2), matches.argmax(axis=2), -1)
+
+    return {
+        'length': lengths.astype(np.int32),
+        'collision_step': collision_step.astype(np.int32),
+        'min_distance': min_distance.astype(np.float32),
+        'start_side': start_side.astype(np.int8),
+        'direction': direction.astype(np.int8),
+        'mode': np.asarray(modes, dtype=np.int8),
+        'collision_status': np.asarray(collision_status, dtype=np.int8),
+        }
+
+
+def save_index(path, features):
+    # uncompressed, like the datasets
+    with open(path, 'wb') as f:
+        np.savez(f, **{feature: features[feature] for feature in FEATURES})
+
+
+def concatenate_indexes(paths, output_path=None):
+    """
+    - Concatenates the indexes of consecutive parts of a dataset (chunks or shards)
+    - Without output_path returns the features, with output_path writes them there feature by feature
+      (like trajectory_io.concatenate_files, only one feature of one part is in memory at a time) and returns None
+    - No paths give the features of no episodes
+    """
+    empty = _empty_features()
+    if output_path is None:
+        parts = [empty]
+        for path in paths:
+            with np.load(path) as index:
+                parts.append({feature: index[feature] for feature in FEATURES})
+        return {feature: np.concatenate([part[feature] for part in parts]) for feature in FEATURES}
+
+    # episodes of every part, the dtypes are the ones of compute_features
+    num_episodes = 0
+    for path in paths:
+        with np.load(path) as index:
+            num_episodes += len(index['length'])
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for feature in FEATURES:
+            dtype = empty[feature].dtype
+            write_member(archive, f'{feature}.npy', dtype, (num_episodes,) + empty[feature].shape[1:],
+                         _feature_parts(paths, feature))
+
+
+def _feature_parts(paths, feature):
+    for path in paths:
+        with np.load(path) as index:
+            yield index[feature]
+
+
+def _empty_features():
+    # features of no episodes, with the dtypes of compute_features
+    return compute_features(np.zeros((0, 1, 2)), np.zeros((0, 1, 2)), np.zeros(0, dtype=np.int64), 0, [], [])
+
+
+def build_index(dataset_path, data=None, batch_size=100000):
+    """
+    - Computes the index of a dataset file from its trajectories, batch_size episodes at a time
+    """
+    dataset = load_trajectories(dataset_path, mmap=not dataset_path.endswith('.csv'))
+    num_episodes = len(dataset['collision_status'])
+
+    parts = [_empty_features()]
+    for start in range(0, num_episodes, batch_size):
+        ids = np.arange(start, min(start + batch_size, num_episodes))
+        object1_actions, object2_actions, lengths = to_padded(dataset, ids)
+        # grid sizes can differ between episodes, the side bands use the grid size of each episode
+        grid_size = np.asarray(dataset['grid_size'][ids])[:, None]
+        parts.append(compute_features(object1_actions, object2_actions, lengths, grid_size,
+                                      dataset['collision_status'][ids], episode_modes(data, ids[0], ids[-1] + 1)))
+    return {feature: np.concatenate([part[feature] for part in parts]) for feature in FEATURES}
+
+
+class EpisodeIndex:
+    """
+    - Per-episode features of a dataset, index['length'] is the array of a feature,
+      episode ids are the ids of the dataset (TrajectoryDataset, load_trajectories)
+    """
+    def __init__(self, features):
+        self.features = features
+
+    @classmethod
+    def load(cls, dataset_path):
+        """
+        - Loads the index of a dataset file, or of all the shards of a manifest (.json)
+        """
+        if dataset_path.endswith('.json'):
+            from dataset_shards import shard_paths
+            return cls(concatenate_indexes([index_path(path) for path in shard_paths(dataset_path)]))
+        with np.load(index_path(dataset_path)) as index:
+            return cls({feature: index[feature] for feature in FEATURES})
+
+    def __len__(self):
+        return len(self.features['length'])
+
+    def __getitem__(self, feature):
+        return self.features[feature]
+
+    def ids(self, where=None):
+        """
+        - Ids of the episodes where the (n,) boolean mask is True, all episodes by default
+        """
+        if where is None:
+            return np.arange(len(self))
+        return np.flatnonzero(where)
+
+    def stratified_sample(self, n, by='collision_status', where=None, weights=None, rng=None, replace=False):
+        """
+        - Samples n episode ids among the episodes of `where`, split between the values of `by`
+          (a feature name or an (n,) array, e.g. length bins) in proportion to `weights` (equal by default, e.g. 50/50)
+        - weights: dict {value: weight}, values without weight are not sampled
+        - Raises ValueError if a class has fewer episodes than requested and replace=False
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        values = self.features[by] if isinstance(by, str) else np.asarray(by)
+        candidates = self.ids(where)
+        values = values[candidates]
+
+        if weights is None:
+            weights = {value: 1 for value in np.unique(values).tolist()}
+        total = sum(weights.values())
+        classes = list(weights)
+        counts = [int(n * weights[value] / total) for value in classes]
+        # the rounding remainder goes to the first classes
+        for k in range(n - sum(counts)):
+            counts[k % len(counts)] += 1
+
+        ids = []
+        for value, count in zip(classes, counts):
+            pool = candidates[values == value]
+            if count > len(pool) and not replace:
+                raise ValueError(f'Only {len(pool)} episodes with {by} == {value}, {count} requested, use replace=True')
+            ids.append(rng.choice(pool, size=count, replace=replace))
+        return rng.permutation(np.concatenate(ids)) if ids else np.zeros(0, dtype=np.int64)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Build the per-episode feature index of a dataset')
+    parser.add_argument('--data_path', type=str, default='./data/grid_dataset/grid_dataset.npz', help='Path to the dataset (.npz or .csv)')
+    parser.add_argument('--data', type=str, default=None, help='--data of data_driver.py that generated the dataset, to record the mode of every episode')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+
+    features = build_index(args.data_path, args.data)
+    save_index(index_path(args.data_path), features)
+    print(f'Index of {len(features["length"])} episodes written to {index_path(args.data_path)}')
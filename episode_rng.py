@@ -0,0 +1,235 @@
+# Counter-based random streams, one per episode
+#
+# Every random number of an episode is addressed by (episode id, step, slot) instead of being the next number
+# of a shared generator. Episode i owns the outputs i * 2^32 .. i * 2^32 + 2^32 - 1 of the SplitMix64 stream of
+# the dataset (its state starts from the dataset SeedSequence): slots 2w and 2w + 1 of a step are the low and
+# high 32 bits of output i * 2^32 + step * WORDS + w. So
+#   - episode i only depends on the seed and i, it can be generated again on its own in O(1)
+#     without replaying episodes 0..i-1 (lazy re-materialization of a dataset from its seed)
+#   - batches, chunks and workers can split the episodes any way, the episodes are the same
+#   - the vectorized generators (GridMaker.generate_batch) and the one-episode-at-a-time methods draw
+#     the same numbers for an episode, so they return the same episodes
+#   - the key of an episode (its SplitMix64 state) is one multiply-add, a draw is one hash for two slots
+#
+#   rng = EpisodeRNG(seed, 1000)                  # episodes 0..999
+#   rng.random(index, step, SLOT)                 # one float in [0, 1) for each episode rng.episodes[index]
+#   rng.random(index, step, (SLOT_A, SLOT_B))     # (len(index), 2), several slots in one call
+#   rng.random_one(step, SLOT, row=7)             # the same number of episode 7, as a Python float
+#   rng.select([123456])                          # episode 123456 of the same seed, on its own
+#
+# The slots used by GridMaker are listed in grid_maker.py, the slots drawn together are pairs (2w, 2w + 1)
+# so that they cost one hash.
+
+import functools
+
+import numpy as np
+
+# counters of a step, every slot of grid_maker.py is below
+SLOTS = 32
+# 64-bit words of a step, each holds two slots
+WORDS = SLOTS // 2
+# bumped whenever the numbers drawn for an episode change, part of the cache keys and configs of data_driver.py
+VERSION = 2
+# episode ids are in [0, MAX_EPISODES), each episode owns 2^32 outputs of the 64-bit stream
+MAX_EPISODES = 2 ** 32
+# rows whose numbers random_one and table_one compute at once, and default steps of window
+TABLE_ROWS = 256
+STEP_WINDOW = 4
+
+_MASK = 2 ** 64 - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+# NumPy scalars, the ufuncs take them faster than Python ints or a dict lookup
+_SHIFT27, _SHIFT30, _SHIFT31, _SHIFT32 = np.uint64(27), np.uint64(30), np.uint64(31), np.uint64(32)
+_MIX1, _MIX2, _GOLDEN64 = np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB), np.uint64(_GOLDEN)
+
+
+def _mix(z):
+    # SplitMix64 finalizer on uint64 arrays (wraps around), in place
+    z ^= z >> _SHIFT30
+    z *= _MIX1
+    z ^= z >> _SHIFT27
+    z *= _MIX2
+    z ^= z >> _SHIFT31
+    return z
+
+
+def _counter(step, word):
+    # offset added to an episode key, the SplitMix64 state of the word of a step (below 2^32 outputs)
+    return ((int(step) * WORDS + int(word) + 1) * _GOLDEN) & _MASK
+
+
+@functools.lru_cache(maxsize=1024)
+def _layout(steps, slots):
+    """
+    - Counters to hash for the slots of the steps (tuples), and the columns of the slots among their words,
+      None when the words give the slots in order (consecutive slots from an even one, the usual case)
+    """
+    words = sorted({s // 2 for s in slots})
+    counters = np.array([_counter(step, w) for step in steps for w in words], dtype=np.uint64)
+    first = 2 * words[0]
+    if 2 * len(words) == len(slots) and slots == tuple(range(first, first + len(slots))):
+        return counters, None
+    return counters, [2 * (i * len(words) + words.index(s // 2)) + s % 2 for i in range(len(steps)) for s in slots]
+
+
+def _uniform(z):
+    # uint64 hashes (..., k) to floats in [0, 1) (..., 2 * k), the low then the high 32 bits of each hash
+    # (numpy only runs on little-endian machines, the uint32 view is in that order)
+    return z.view(np.uint32) * 2.0 ** -32
+
+
+class EpisodeRNG:
+    """
+    - Random streams of the episodes `episodes` (an array of episode ids in [0, 2^32), or n for episodes 0..n-1)
+      of the dataset seeded with `seed` (an int, a SeedSequence, or None for a random seed)
+    - rng[rows] is the EpisodeRNG of a subset of the episodes, rng.select(episodes) of other episodes of the seed
+    - random / integers draw one number per episode of `index` (rows of this EpisodeRNG), random_one is the
+      scalar version for the episode of one row, they return the same numbers
+    """
+    def __init__(self, seed=None, episodes=0):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.base = int(seed.generate_state(1, np.uint64)[0])
+        self._set(np.arange(episodes, dtype=np.int64) if np.ndim(episodes) == 0 else np.asarray(episodes, dtype=np.int64))
+
+    def _set(self, episodes, keys=None):
+        self.episodes = episodes
+        if keys is None:
+            # the key of episode i is the SplitMix64 state before its first output, base + i * 2^32 * golden
+            keys = episodes.astype(np.uint64)
+            if (keys >= MAX_EPISODES).any():
+                raise ValueError(f'Episode ids must be in [0, 2^32), got {episodes.min()}..{episodes.max()}')
+            keys <<= _SHIFT32
+            keys *= _GOLDEN64
+            keys += np.uint64(self.base)
+        self.keys = keys
+        # numbers of random_one, a block of TABLE_ROWS rows at a time
+        self._tables, self._table_start = {}, -TABLE_ROWS
+
+    def _copy(self, episodes, keys=None):
+        other = object.__new__(EpisodeRNG)
+        other.seed_sequence, other.base = self.seed_sequence, self.base
+        other._set(episodes, keys)
+        return other
+
+    def select(self, episodes):
+        """
+        - EpisodeRNG of the episodes `episodes` (ids, or n for 0..n-1) of the same seed
+        """
+        return self._copy(np.arange(episodes, dtype=np.int64) if np.ndim(episodes) == 0 else np.asarray(episodes, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def __getitem__(self, rows):
+        return self._copy(self.episodes[rows], self.keys[rows])
+
+    def __repr__(self):
+        return f'EpisodeRNG(entropy={self.seed_sequence.entropy}, episodes={len(self)})'
+
+    def _draw(self, keys, steps, slots):
+        """
+        - (len(keys), len(steps) * len(slots)) numbers of the episodes with these keys, step-major
+        - The two slots of a word are computed together, drawing (2w, 2w + 1) costs as much as one of them
+        """
+        counters, columns = _layout(tuple(steps), slots)
+        # the hash runs on contiguous (counter, episode) rows, the transposed copy of the uint64 hashes is
+        # cheaper than moving the floats around and gives the step-major slot order directly
+        u = _uniform(np.ascontiguousarray(_mix(counters[:, None] + keys).T))
+        return u if columns is None else u[:, columns]
+
+    def random(self, index, step, slot):
+        """
+        - Uniform numbers in [0, 1) (32 bits) for the episodes `index` (None for all of them), shape (len(index),),
+          or (len(index), len(slot)) for a sequence of slots
+        """
+        keys = self.keys if index is None else self.keys[index]
+        if isinstance(slot, (int, np.integer)):
+            return self._draw(keys, (step,), (slot,))[:, 0]
+        return self._draw(keys, (step,), tuple(slot))
+
+    def window(self, index, step, slots, steps=STEP_WINDOW):
+        """
+        - random(index, step, slots), random(index, step + 1, slots), ... for `steps` steps side by side,
+          shape (len(index), steps * len(slots)), for the vectorized loops that draw at every step
+        """
+        keys = self.keys if index is None else self.keys[index]
+        return self._draw(keys, range(step, step + steps), tuple(slots))
+
+    def integers(self, low, high, index, step, slot):
+        """
+        - Integers in [low, high) for the episodes `index`, low and high broadcast against them
+        """
+        return low + (self.random(index, step, slot) * (high - low)).astype(np.int64)
+
+    def _block(self, row):
+        # first row of the block of TABLE_ROWS rows holding `row`, the tables of another block are dropped
+        start = row - row % TABLE_ROWS
+        if start != self._table_start:
+            self._tables, self._table_start = {}, start
+        return start
+
+    def _table(self, key, row, steps, slot):
+        """
+        - Numbers of the TABLE_ROWS rows around `row`, computed once and kept with the other tables of the block:
+          a list per row of a tuple of slots, a float per row of one slot, see random_one
+        """
+        start = self._block(row)
+        keys = self.keys[start:start + TABLE_ROWS]
+        if isinstance(slot, tuple):
+            # a list per row, the numbers of every step one after the other
+            table = self._draw(keys, steps, slot).tolist()
+        else:
+            table = self._draw(keys, steps, (slot,))[:, 0].tolist()
+        self._tables[key] = table
+        return table
+
+    def random_one(self, step, slot, row=0):
+        """
+        - Same as random for the episode of one row, as a Python float (a list for a tuple of slots)
+        - The one-episode methods go through the rows one by one, so the numbers of a (step, slot) are computed
+          for the TABLE_ROWS rows around `row` at once and kept until a row of another block is drawn
+        """
+        # the common case inline, called for every episode
+        i = row - self._table_start
+        if 0 <= i < TABLE_ROWS:
+            table = self._tables.get((step, slot))
+            if table is not None:
+                return table[i]
+        return self._table((step, slot), row, (step,), slot)[row - self._table_start]
+
+    def table_one(self, key, row=0):
+        """
+        - Item of the row of fn(rng, *args) for key = (fn, *args), fn returns a sequence with an item per episode
+          of the EpisodeRNG rng: for the one-episode methods that only need the result of a vectorized function
+          of the numbers (e.g. the moves of every step instead of the numbers they are drawn from)
+        - Like random_one, fn runs once for the TABLE_ROWS rows around `row` and its result is kept with the tables
+        """
+        i = row - self._table_start
+        if 0 <= i < TABLE_ROWS:
+            table = self._tables.get(key)
+            if table is not None:
+                return table[i]
+        start = self._block(row)
+        table = self._tables[key] = key[0](self[start:start + TABLE_ROWS], *key[1:])
+        return table[row - start]
+
+    def integers_one(self, low, high, step, slot, row=0):
+        # same as integers for the episode of one row, as a Python int
+        return low + int(self.random_one(step, slot, row) * (high - low))
+
+
+def episode_rng(rng, n):
+    """
+    - EpisodeRNG of n episodes from whatever the generators accept as rng:
+      an EpisodeRNG of n episodes, a seed or SeedSequence (episodes 0..n-1), None (random seed),
+      or a numpy Generator (a seed is drawn from it, so a seeded Generator gives the same episodes)
+    """
+    if isinstance(rng, EpisodeRNG):
+        if len(rng) != n:
+            raise ValueError(f'The EpisodeRNG has {len(rng)} episodes, expected {n}')
+        return rng
+    if isinstance(rng, np.random.Generator):
+        rng = int(rng.integers(2 ** 63))
+    return EpisodeRNG(rng, n)
@@ -0,0 +1,96 @@
+# Infinite stream of freshly generated episodes, for training without any dataset on disk
+#
+# EpisodeStream yields whole batches of episodes generated on the fly with GridMaker, the same
+# samples as data_driver.py: with the same seed, batch b is samples [b * batch_size, (b + 1) * batch_size) of
+#   python data_driver.py --data <data> --seed <seed> --grid_size <grid_size>
+# It is a torch IterableDataset when torch is installed, give it to a DataLoader with batch_size=None
+# (the batches are already assembled), every worker then generates every num_workers-th batch.
+
+import numpy as np
+from episode_rng import MAX_EPISODES
+from generation import GRID_SIZE, generate_samples
+from grid_maker import PAD_VALUE
+from grid_renderer import RENDER_WINDOW, rasterize, window_origins
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    # torch is optional, without it EpisodeStream is a plain iterable
+    IterableDataset = object
+    get_worker_info = lambda: None
+
+
+class EpisodeStream(IterableDataset):
+    """
+    - data: 'grid_maker_random_directions' (collision and non-collision episodes alternate, like data_driver.py)
+      or 'grid_maker_fixed_direction'
+    - Every batch is a dict of NumPy arrays:
+        object1_action, object2_action: (batch_size, T, 2) positions, padded with PAD_VALUE
+        lengths, collision_status: (batch_size,)
+        mask: (batch_size, T) True for the recorded steps
+        frames: (batch_size, T, S, S) uint8 rasterized frames and frame_origins: (batch_size, 2) the cell of their
+            top-left corner, only with frames=True. S is grid_size, or render_window on larger grids: like
+            data_driver.py --render_window, the frames are cropped to the cells around the end of the episode
+    - T is the longest episode of the batch, or max_steps for all batches (longer episodes are cut)
+    - Every sample is drawn from its own random stream (the dataset seed and its id, see episode_rng.py), so the stream
+      does not depend on the number of workers. seed=None picks a random seed, stored in self.seed.
+    - num_batches=None runs until the sample ids reach MAX_EPISODES (2^32, the episode ids of episode_rng.py),
+      MAX_EPISODES // batch_size batches
+    - grid_size is the size of the grid of every episode (data_driver.py --grid_size)
+    """
+    def __init__(self, data='grid_maker_random_directions', batch_size=256, seed=None, frames=False, max_steps=None, num_batches=None,
+                 grid_size=GRID_SIZE, render_window=RENDER_WINDOW):
+        if data not in ('grid_maker_random_directions', 'grid_maker_fixed_direction'):
+            raise ValueError(f'Unknown data {data}')
+        self.data = data
+        self.batch_size = batch_size
+        # picked once, so that all workers share it
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.frames = frames
+        self.max_steps = max_steps
+        self.num_batches = num_batches
+        self.grid_size = grid_size
+        self.render_window = render_window
+
+    def batch(self, b):
+        """
+        - Generates batch b of the stream
+        """
+        start = b * self.batch_size
+        object1, object2, lengths, collisions = generate_samples(self.data, start, start + self.batch_size, self.seed, self.grid_size)
+
+        steps = object1.shape[1] if self.max_steps is None else self.max_steps
+        lengths = np.minimum(lengths, steps)
+
+        # the output arrays are allocated once at their final shape, episodes are copied in with one slice
+        batch = {
+            'object1_action': np.full((self.batch_size, steps, 2), PAD_VALUE, dtype=object1.dtype),
+            'object2_action': np.full((self.batch_size, steps, 2), PAD_VALUE, dtype=object2.dtype),
+            'lengths': lengths,
+            'collision_status': collisions,
+            'mask': np.arange(steps) < lengths[:, None],
+            }
+        copied = min(steps, object1.shape[1])
+        batch['object1_action'][:, :copied] = object1[:, :copied]
+        batch['object2_action'][:, :copied] = object2[:, :copied]
+
+        if self.frames:
+            window = None
+            batch['frame_origins'] = np.zeros((self.batch_size, 2), dtype=np.int64)
+            if self.grid_size > self.render_window:
+                # only a render_window x render_window crop of every frame, not the whole grid
+                rows, last = np.arange(self.batch_size), np.maximum(lengths - 1, 0)
+                batch['frame_origins'] = window_origins(batch['object1_action'][rows, last], batch['object2_action'][rows, last],
+                                                        self.grid_size, self.render_window)
+                window = (batch['frame_origins'], self.render_window)
+            batch['frames'] = rasterize(batch['object1_action'], batch['object2_action'], lengths, self.grid_size, window=window)
+        return batch
+
+    def __iter__(self):
+        # every worker of a DataLoader takes every num_workers-th batch
+        worker = get_worker_info()
+        b, step = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        num_batches = MAX_EPISODES // self.batch_size if self.num_batches is None else self.num_batches
+        while b < num_batches:
+            yield self.batch(b)
+            b += step
@@ -0,0 +1,70 @@
+# Samples of the datasets of data_driver.py, as a library
+#
+# A dataset is defined by its --data option and its seed: sample i only depends on them and i (see episode_rng.py),
+# so data_driver.py (chunks, workers, cache blocks), EpisodeStream and any other caller generating the same ids
+# get the same samples.
+#
+#   object1_actions, object2_actions, lengths, collisions = generate_samples('grid_maker_random_directions', 0, 1000, seed=0)
+#   generate_episodes('grid_maker_random_directions', [123456], seed=0)   # sample 123456 on its own
+
+import numpy as np
+from episode_rng import EpisodeRNG
+from grid_maker import GridMaker, PAD_VALUE, SLOT_MAX_LENGTH
+
+# Data contains 10x10 grid with two objects (1 and 2) by default, see data_driver.py --grid_size
+GRID_SIZE = 10
+MIN_DISTANCE = 3
+RANDOMNESS_FACTOR = 0.1
+
+
+def generate_samples(data, start, stop, seed, grid_size=GRID_SIZE):
+    """
+    - Generates samples [start, stop) of the dataset with the given seed (int or SeedSequence)
+    - Returns the padded arrays (object1_actions, object2_actions, lengths, collisions) of GridMaker.generate_batch
+    """
+    return generate_episodes(data, np.arange(start, stop), seed, grid_size)
+
+
+def generate_episodes(data, episodes, seed, grid_size=GRID_SIZE):
+    """
+    - Generates the samples `episodes` (an array of sample ids, in any order) of the dataset with the given seed
+    - Every sample is drawn from its own random stream (episode_rng.py), so sample i only depends on the seed and i:
+      it is the same whether it is generated alone, with its chunk or by EpisodeStream, and generating it again
+      does not replay the samples before it
+    """
+    # Create a grid
+    grid_maker = GridMaker(grid_size=grid_size, min_distance=MIN_DISTANCE)
+    rng = EpisodeRNG(seed, episodes)
+    n = len(rng)
+
+    if data == 'grid_maker_random_directions':
+        # even samples collide, odd samples do not collide
+        collision_ids = np.flatnonzero(rng.episodes % 2 == 0)
+        non_collision_ids = np.flatnonzero(rng.episodes % 2 == 1)
+
+        # Find the path for the objects to collide
+        coll_batch = grid_maker.generate_batch(len(collision_ids), mode='find_path', randomness_factor=RANDOMNESS_FACTOR, rng=rng[collision_ids])
+
+        # Find the path for the objects to not collide
+        # randomly generate max_length from 3 to 9
+        max_length = rng.integers(3, 10, non_collision_ids, 0, SLOT_MAX_LENGTH)
+        noncoll_batch = grid_maker.generate_batch(
+            len(non_collision_ids), mode='find_non_collision_path', randomness_factor=RANDOMNESS_FACTOR, max_length=max_length,
+            rng=rng[non_collision_ids])
+
+        # interleave both batches back in sample order
+        steps = max(coll_batch[0].shape[1], noncoll_batch[0].shape[1])
+        object1_actions = np.full((n, steps, 2), PAD_VALUE, dtype=coll_batch[0].dtype)
+        object2_actions = np.full((n, steps, 2), PAD_VALUE, dtype=coll_batch[0].dtype)
+        lengths = np.zeros(n, dtype=np.int64)
+        collisions = np.zeros(n, dtype=np.int8)
+        for ids, (object1, object2, batch_lengths, batch_collisions) in [(collision_ids, coll_batch), (non_collision_ids, noncoll_batch)]:
+            object1_actions[ids, :object1.shape[1]] = object1
+            object2_actions[ids, :object2.shape[1]] = object2
+            lengths[ids] = batch_lengths
+            collisions[ids] = batch_collisions
+
+        return object1_actions, object2_actions, lengths, collisions
+
+    elif data == 'grid_maker_fixed_direction':
+        return grid_maker.generate_batch(n, mode='fix_direction_action', rng=rng)
@@ -1,36 +1,155 @@
-import pandas as pd
 import argparse
-from grid_maker import plot_grid
+import os
+from multiprocessing import Pool
+from grid_renderer import CELL_SIZE, write_episodes
+from episode_cache import EpisodeCache
 import numpy as np
-from tqdm import tqdm
+from trajectory_dataset import TrajectoryDataset
+from trajectory_io import read_csv_rows, to_padded
 from utils.basic_functions import str2bool
 
+# Figures of the matplotlib renderer, one per grid size, created once in every process
+PLOTTERS = {}
+# Frame cache of the matplotlib renderer in every process
+CACHES = {}
+
 # Load the dataset
 def get_parser():
     parser = argparse.ArgumentParser(description='Visualize the grid dataset')
-    parser.add_argument('--data_path', type=str, default='./data/grid_dataset/grid_dataset_fixed_direction.csv', help='Path to the data file')
+    parser.add_argument('--data_path', type=str, default='./data/grid_dataset/grid_dataset_fixed_direction.npz', help='Path to the data file (.npz, .csv of the old format, or manifest.json of a sharded dataset)')
     parser.add_argument('--collision_only', type=str2bool, default=True, help='Visualize only the samples with collision')
+    parser.add_argument('--renderer', type=str, default='matplotlib', choices=['matplotlib', 'raster'], help='plot_grid figures, or the fast NumPy rasterizer of grid_renderer.py')
+    parser.add_argument('--cell_size', type=int, default=CELL_SIZE, help='Size of a grid cell in pixels (raster renderer)')
+    parser.add_argument('--format', type=str, default='png', choices=['png', 'gif', 'mp4', 'sheet'], help='png frames, one gif or mp4 animation per episode, or contact sheets of --sheet_size episodes (all but png use the raster renderer)')
+    parser.add_argument('--sheet_size', type=int, default=100, help='Number of episodes on every contact sheet (--format sheet)')
+    parser.add_argument('--fps', type=int, default=2, help='Frames per second of the animations (--format gif or mp4)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes rendering in parallel')
+    parser.add_argument('--limit', type=int, default=None, help='Visualize only the first LIMIT (selected) samples')
+    parser.add_argument('--sample_ids', type=int, nargs='+', default=None, help='Visualize only these samples, numbered as in the file names (sample1 is the first row)')
+    parser.add_argument('--output_dir', type=str, default='./data/grid_dataset_fixed_direction_images', help='Directory of the frames')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Cache of matplotlib frames shared by all runs (see episode_cache.py), disabled by default')
+    parser.add_argument('--cache_size', type=float, default=1024, help='Size cap of the cache in MB, least recently used entries are evicted')
     return parser
 
+
+def select_samples(data_path, collision_only, sample_ids=None, limit=None):
+    """
+    - Returns (data, ids, sample_ids): the columnar dataset, ids of the selected episodes in it,
+      and their sample numbers used in the file names
+    - .npz files are memory-mapped, so only the selected episodes are read
+    - .csv files are scanned in chunks, only the selected rows are parsed and the scan stops at limit
+    """
+    rows = None if sample_ids is None else np.asarray(sample_ids) - 1
+
+    if data_path.endswith('.csv'):
+        data, row_ids = read_csv_rows(data_path, rows=rows, limit=limit, collision_only=collision_only)
+        return data, np.arange(len(row_ids)), row_ids + 1
+
+    dataset = TrajectoryDataset(data_path, collision_only=collision_only)
+    if rows is not None:
+        dataset = dataset[np.isin(dataset.ids, rows)]
+    if limit is not None:
+        dataset = dataset[:limit]
+    return dataset.data, dataset.ids, dataset.ids + 1
+
+
+def init_worker():
+    # headless backend, the worker processes never open a window
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_batch(task):
+    """
+    - Renders a batch of episodes of the same grid size, frames are saved as output_dir/sample{id}_frame{j}.png,
+      or as animations or contact sheets (see write_episodes)
+    - With a cache, a matplotlib frame only depends on the grid size and the two positions, so every frame
+      already drawn (by this run or an earlier one) is copied from the cache instead of drawn again
+    - Returns (number of episodes, cache hits, cache misses)
+    """
+    renderer, grid_size, object1_actions, object2_actions, lengths, sample_ids, output_dir, cell_size, cache_dir, cache_size, fmt, sheet_size, fps = task
+
+    if renderer == 'raster' or fmt != 'png':
+        write_episodes(object1_actions, object2_actions, lengths, grid_size, output_dir, fmt=fmt, sample_ids=sample_ids, cell_size=cell_size,
+                       batch_size=sheet_size if fmt == 'sheet' else 64, fps=fps)
+        return len(lengths), 0, 0
+
+    cache = None
+    if cache_dir is not None:
+        if cache_dir not in CACHES:
+            CACHES[cache_dir] = EpisodeCache(cache_dir, int(cache_size * 2 ** 20))
+        cache = CACHES[cache_dir]
+        hits, misses = cache.hits, cache.misses
+
+    # the figure is reused for every frame of the process
+    if grid_size not in PLOTTERS:
+        from grid_plotting import GridPlotter
+        PLOTTERS[grid_size] = GridPlotter(grid_size)
+    plotter = PLOTTERS[grid_size]
+
+    for i, object1, object2, length in zip(sample_ids, object1_actions.tolist(), object2_actions.tolist(), lengths):
+        for j, (obj1_pos, obj2_pos) in enumerate(zip(object1[:length], object2[:length])):
+            path = f'{output_dir}/sample{i}_frame{j}'
+            if cache is None:
+                plotter.plot(tuple(obj1_pos), tuple(obj2_pos), path=path)
+                continue
+
+            key = EpisodeCache.key('plot_grid', grid_size, obj1_pos, obj2_pos)
+            if not cache.fetch(key, f'{path}.png'):
+                plotter.plot(tuple(obj1_pos), tuple(obj2_pos), path=path)
+                cache.store(key, f'{path}.png')
+
+    if cache is None:
+        return len(lengths), 0, 0
+    return len(lengths), cache.hits - hits, cache.misses - misses
+
+
+def make_tasks(args, data, ids, sample_ids, batch_size):
+    """
+    - Splits the selected episodes into batches of the same grid size, gathered as padded arrays
+    """
+    grid_sizes = np.asarray(data['grid_size'][ids])
+    for grid_size in np.unique(grid_sizes):
+        same_size = np.flatnonzero(grid_sizes == grid_size)
+        for start in range(0, len(same_size), batch_size):
+            batch = same_size[start:start + batch_size]
+            object1_actions, object2_actions, lengths = to_padded(data, ids[batch])
+            yield (args.renderer, int(grid_size), object1_actions, object2_actions, lengths, sample_ids[batch],
+                   args.output_dir, args.cell_size, args.cache_dir, args.cache_size, args.format, args.sheet_size, args.fps)
+
+
 if __name__ == '__main__':
     args = get_parser().parse_args()
-    data_path = args.data_path
 
-    df = pd.read_csv(data_path)
+    data, ids, sample_ids = select_samples(args.data_path, args.collision_only, args.sample_ids, args.limit)
+    os.makedirs(args.output_dir, exist_ok=True)
 
-    if args.collision_only:
-        df = df[df['collision_status'] == 1]
+    # matplotlib figures are slow, smaller batches spread the work between the workers
+    batch_size = 1024 if args.renderer == 'raster' or args.format != 'png' else 16
+    if args.format == 'sheet':
+        # a contact sheet is never split between two tasks
+        batch_size = args.sheet_size * max(1, batch_size // args.sheet_size)
+    tasks = make_tasks(args, data, ids, sample_ids, batch_size)
 
-    for i, row in tqdm(df.iterrows(), desc='Visualizing the dataset', total=len(df)):
-        grid_size = row['grid_size']
-        object1_actions = row['object1_action']
-        object2_actions = row['object2_action']
-        collision_status = row['collision_status']
+    from tqdm import tqdm
 
-        object1_actions = eval(object1_actions)
-        object2_actions = eval(object2_actions)
+    hits = misses = 0
+    with tqdm(desc='Visualizing the dataset', total=len(ids)) as progress:
+        if args.workers > 1:
+            with Pool(args.workers, initializer=init_worker) as pool:
+                results = pool.imap_unordered(render_batch, tasks)
+                for n, batch_hits, batch_misses in results:
+                    progress.update(n)
+                    hits, misses = hits + batch_hits, misses + batch_misses
+        else:
+            init_worker()
+            for task in tasks:
+                n, batch_hits, batch_misses = render_batch(task)
+                progress.update(n)
+                hits, misses = hits + batch_hits, misses + batch_misses
 
-        # create a grid
-        matrix = np.zeros((grid_size, grid_size))
-        for j, (obj1_pos, obj2_pos) in enumerate(zip(object1_actions, object2_actions)):
-            plot_grid(grid_size, obj1_pos, obj2_pos, path=f'./data/grid_dataset_fixed_direction_images/sample{i+1}_frame{j}')
+    if args.cache_dir is not None:
+        # hits and misses are counted in frames
+        cache = EpisodeCache(args.cache_dir, int(args.cache_size * 2 ** 20))
+        cache.evict()
+        print(cache.report(hits, misses))
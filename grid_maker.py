@@ -1,14 +1,29 @@
 import numpy as np
-import random
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from matplotlib.colors import ListedColormap
-from matplotlib.animation import PillowWriter
 import math 
+import functools
+import itertools
+from array import array
+from collections.abc import Sequence
+import profiling
+from episode_rng import STEP_WINDOW, EpisodeRNG, episode_rng
+
+# Every random number of an episode is drawn from its EpisodeRNG stream at a (step, slot), see episode_rng.py
+# placement (step = rejection round of RowPlacementIndex), moves, fix_direction_action starts, data_driver max_length
+# The slots (2w, 2w + 1) are drawn together (one hash), keep the pairs when adding slots
+(SLOT_OFFSET, SLOT_ALIAS, SLOT_BLUE_X, SLOT_BLUE_Y, SLOT_DY, SLOT_KEEP,
+ SLOT_MOVE_BLUE, SLOT_MOVE_RED,
+ SLOT_SIDE1, SLOT_SIDE2, SLOT_EDGE1, SLOT_FREE1, SLOT_EDGE2, SLOT_FREE2, SLOT_DIRECTION1, SLOT_DIRECTION2,
+ SLOT_MAX_LENGTH) = range(17)
+# numbers drawn together: place_rectangles, and every step of find_path and find_non_collision_path
+PLACEMENT_SLOTS = (SLOT_OFFSET, SLOT_ALIAS, SLOT_BLUE_X, SLOT_BLUE_Y)
+MOVE_SLOTS = (SLOT_MOVE_BLUE, SLOT_MOVE_RED)
+
+# GridMaker computes the episode keys of its own stream this many episodes at a time
+EPISODE_BLOCK = 1024
 
 # Wrap up all functoins below into a class
 class GridMaker:
-    def __init__ (self, grid_size, min_distance, flag=False):
+    def __init__ (self, grid_size, min_distance, flag=False, seed=None):
         # Parameters
         self.grid_size = grid_size # size of the grid (grid_size x grid_size)
         self.min_distance = min_distance # initial distance between the two objects on the grid
@@ -16,48 +31,118 @@ class GridMaker:
         # flag for debugging
         self.flag = flag # flag to check if the initial positions of the objects are set
 
-    def create_grid(self):
+        # episodes of the methods called without rng, each episode takes the next episode of this stream
+        # (seed: int or SeedSequence, None for a random one), so that they are the episodes of generate_batch
+        # on a GridMaker with the same seed: place_rectangles() starts an episode, find_path and
+        # find_non_collision_path called with the positions it returned continue it (see _continue)
+        self.rng = EpisodeRNG(seed)
+        self.episodes = 0
+        # EpisodeRNG of the block of episodes last used by _stream, and its first episode
+        self._block, self._block_start = None, -EPISODE_BLOCK
+        # (blue, red, rng, row) of the last place_rectangles() without rng
+        self._placed = None
+
+    def _stream(self, rng, row):
+        """
+        - (rng, row) the one-episode methods draw from, the next episode of self.rng if rng is None
+        - With the same (rng, row) as episode `row` of generate_batch(rng=rng), they return the same episode
+        """
+        if rng is not None:
+            return rng, row
+        # episode keys are computed a block at a time, not one NumPy call per episode
+        # (a batch call in between can move self.episodes past the block)
+        row = self.episodes - self._block_start
+        self.episodes += 1
+        if row < EPISODE_BLOCK:
+            return self._block, row
+        self._block_start = self.episodes - 1
+        self._block = self.rng.select(np.arange(self._block_start, self._block_start + EPISODE_BLOCK))
+        return self._block, 0
+
+    def _continue(self, start_pos_blue, start_pos_red, rng, row):
+        """
+        - _stream of find_path and find_non_collision_path: without rng, the episode of the last place_rectangles()
+          if the start positions are the ones it returned (the same objects), the next episode otherwise
+        - So find_path(*place_rectangles()) draws its start positions and its moves from one episode, like generate_batch
+        """
+        placed = self._placed
+        if rng is None and placed is not None and start_pos_blue is placed[0] and start_pos_red is placed[1]:
+            self._placed = None
+            return placed[2], placed[3]
+        return self._stream(rng, row)
+
+    def _batch_stream(self, rng, n):
+        # EpisodeRNG of a batch of n episodes, the next n episodes of self.rng if rng is None
+        if rng is not None:
+            return episode_rng(rng, n)
+        self.episodes += n
+        return self.rng.select(np.arange(self.episodes - n, self.episodes))
+
+    def _buffers(self, capacity):
+        """
+        - Two flat coordinate buffers (see Trajectory) for at least `capacity` positions, allocated once
+          and reused by every episode, the episodes copy their recorded part out of them
+        - The buffers are shared by the episodes of this GridMaker, use one GridMaker per thread
+        """
+        buffers = getattr(self, '_scratch', None)
+        if buffers is None or len(buffers[0]) < 2 * capacity or buffers[0].typecode != _typecode(self.grid_size):
+            buffers = self._scratch = (Trajectory.buffer(self.grid_size, capacity), Trajectory.buffer(self.grid_size, capacity))
+        return buffers
+
+    def create_grid(self, sparse=None):
         """
         - Create a grid filled with zeros
         - All non-zero values will represent the objects on the grid
+        - Grids larger than SPARSE_GRID_SIZE (or sparse=True) are a SparseGrid, which only stores the occupied cells
         """
-        self.grid = np.zeros((self.grid_size, self.grid_size))
+        if sparse is None:
+            sparse = self.grid_size > SPARSE_GRID_SIZE
+        self.grid = SparseGrid(self.grid_size) if sparse else np.zeros((self.grid_size, self.grid_size))
 
-    def place_rectangles(self):
+    def place_rectangles(self, rng=None, row=0):
         """
         - Places two rectangles (blue and red) on a grid such that their positions
           are at least `min_distance` units apart based on Euclidean distance.
+        - The pair is drawn directly among the valid pairs (see placement_index),
+          instead of drawing random pairs until one is far enough apart.
+        - Drawn from episode `row` of the EpisodeRNG rng (see _stream), like the other one-episode methods,
+          without rng find_path(*place_rectangles()) is one episode (see _continue)
         """
-        while True:
-            blue_position = (random.randint(0, self.grid_size - 1), random.randint(0, self.grid_size - 1))
-            red_position = (random.randint(0, self.grid_size - 1), random.randint(0, self.grid_size - 1))
-            
-            # Calculate Euclidean distance between the two positions
-            distance = math.dist(blue_position, red_position)
-            
-            # Ensure the distance is at least `min_distance`
-            if distance >= self.min_distance:
-                if self.flag: 
-                    print(f'Initial position: Blue {blue_position}, Red {red_position}')
-                    print(f'Initial distance: {distance}\n')
-                return blue_position, red_position
-
-    def side_selection(self, side):
+        index = placement_index(self.grid_size, self.min_distance)
+        if rng is None:
+            # a new episode of self.rng, continued by find_path / find_non_collision_path (see _continue)
+            rng, row = self._stream(None, row)
+            blue_position, red_position = index.sample_one(rng, row)
+            self._placed = blue_position, red_position, rng, row
+        else:
+            blue_position, red_position = index.sample_one(rng, row)
+        profiling.count('placements')
+
+        if self.flag:
+            print(f'Initial position: Blue {blue_position}, Red {red_position}')
+            print(f'Initial distance: {math.dist(blue_position, red_position)}\n')
+        return blue_position, red_position
+
+    def side_selection(self, side, rng=None, row=0, slots=(SLOT_EDGE1, SLOT_FREE1), step=0):
+        # the position in the 3 cells wide band along the edge, and along the edge
+        rng, row = self._stream(rng, row)
+        u_edge, u_free = rng.random_one(step, tuple(slots), row)
+        edge, free = int(u_edge * 3), int(u_free * self.grid_size)
         if side == 'left':
-            x = random.randint(0, 2)
-            y = random.randint(0, self.grid_size - 1) 
+            x = edge
+            y = free
         elif side == 'right':
-            x = random.randint(self.grid_size - 3, self.grid_size - 1)
-            y = random.randint(0, self.grid_size - 1)
+            x = self.grid_size - 3 + edge
+            y = free
         elif side == 'top':
-            x = random.randint(0, self.grid_size - 1)
-            y = random.randint(self.grid_size - 3, self.grid_size - 1)
+            x = free
+            y = self.grid_size - 3 + edge
         elif side == 'bottom':
-            x = random.randint(0, self.grid_size - 1)
-            y = random.randint(0, 2)
+            x = free
+            y = edge
         return (x, y)
 
-    def get_fixed_direction(self, obj_pos):
+    def get_fixed_direction(self, obj_pos, rng=None, row=0, slot=SLOT_DIRECTION1):
         # move objects up, down, left, right depending on the starting position
         # if obj_pos[0] == 0:
         #     obj_actions = "down"
@@ -69,11 +154,13 @@ class GridMaker:
         #     obj_actions = "right"
         
         # randomly select the direction of the object
-        obj_actions = random.choice(['up', 'down', 'left', 'right'])
+        rng, row = self._stream(rng, row)
+        obj_actions = DIRECTIONS[rng.integers_one(0, 4, 0, slot, row)]
 
         return obj_actions
 
-    def fix_direction_action(self):
+    @profiling.timed('fix_direction_action')
+    def fix_direction_action(self, rng=None, row=0):
         # randomly select the direction of the object
         # if the object is at the edge of the grid, it will move in the opposite direction
 
@@ -81,326 +168,964 @@ class GridMaker:
 
         # randomly select at what side of the grid the object will start
         # left or right, bottom or top
-        side1 = random.choice(['left', 'right', 'top', 'bottom'])
-        side2 = random.choice(['left', 'right', 'top', 'bottom'])
+        rng, row = self._stream(rng, row)
+        u1, u2 = rng.random_one(0, (SLOT_SIDE1, SLOT_SIDE2), row)
+        side1, side2 = SIDES[int(u1 * 4)], SIDES[int(u2 * 4)]
 
-        obj1_pos = self.side_selection(side1)
-        obj2_pos = self.side_selection(side2)
+        obj1_pos = self.side_selection(side1, rng, row)
+        obj2_pos = self.side_selection(side2, rng, row, slots=(SLOT_EDGE2, SLOT_FREE2))
 
         #TODO: I was too lazy to write a condition that doesn't allow for positions to be generated on the same coordinates
         # WILL DO IT LATER
         if obj1_pos == obj2_pos:
-            obj2_pos = self.side_selection(side2)
+            obj2_pos = self.side_selection(side2, rng, row, slots=(SLOT_EDGE2, SLOT_FREE2), step=1)
 
-        obj1_direction = self.get_fixed_direction(obj1_pos)
-        obj2_direction = self.get_fixed_direction(obj2_pos)
+        obj1_direction = self.get_fixed_direction(obj1_pos, rng, row)
+        obj2_direction = self.get_fixed_direction(obj2_pos, rng, row, slot=SLOT_DIRECTION2)
 
         # given the direction move the object to the opposite direction
         # record every move
         # if the objects end up on the same position, stop the movement, return the actions
         # if object reach the edge of the grid stop the movement for that object, keep recording his last action, but 
         # do not stop recording action of the other object
-        obj1_actions = []
-        obj2_actions = []
+        # positions are plain ints written into preallocated buffers, nothing is allocated per step
+        obj1_actions, obj2_actions = self._buffers(self.grid_size + 1)
+        (x1, y1), (x2, y2) = obj1_pos, obj2_pos
+        (dx1, dy1), (dx2, dy2) = DIRECTION_MOVES[obj1_direction], DIRECTION_MOVES[obj2_direction]
+        last = self.grid_size - 1
 
         # append initial positions
-        obj1_actions.append(obj1_pos)
-        obj2_actions.append(obj2_pos)
+        obj1_actions[0], obj1_actions[1] = x1, y1
+        obj2_actions[0], obj2_actions[1] = x2, y2
+        k = 2
 
-        collisions = []
+        collisions = [0]
         for i in range(self.grid_size):
-            if obj1_pos == obj2_pos:
-                collisions.append(1)
+            if x1 == x2 and y1 == y2:
+                collisions = [1]
                 break
 
-            if obj1_direction == 'up':
-                obj1_pos = (obj1_pos[0] - 1, obj1_pos[1])
-                if obj1_pos == (-1, obj1_pos[1]):
-                    obj1_pos = (0, obj1_pos[1]) # does not let the object go out of the grid
-            elif obj1_direction == 'down':
-                obj1_pos = (obj1_pos[0] + 1, obj1_pos[1])
-                if obj1_pos == (self.grid_size, obj1_pos[1]):
-                    obj1_pos = (self.grid_size - 1, obj1_pos[1])
-            elif obj1_direction == 'left':
-                obj1_pos = (obj1_pos[0], obj1_pos[1] - 1)
-                if obj1_pos == (obj1_pos[0], -1):
-                    obj1_pos = (obj1_pos[0], 0)
-            elif obj1_direction == 'right':
-                obj1_pos = (obj1_pos[0], obj1_pos[1] + 1)
-                if obj1_pos == (obj1_pos[0], self.grid_size):
-                    obj1_pos = (obj1_pos[0], self.grid_size - 1)
-
-            if obj2_direction == 'up':
-                obj2_pos = (obj2_pos[0] - 1, obj2_pos[1])
-                if obj2_pos == (-1, obj2_pos[1]):
-                    obj2_pos = (0, obj2_pos[1])
-            elif obj2_direction == 'down':
-                obj2_pos = (obj2_pos[0] + 1, obj2_pos[1])
-                if obj2_pos == (self.grid_size, obj2_pos[1]):
-                    obj2_pos = (self.grid_size - 1, obj2_pos[1])
-            elif obj2_direction == 'left':
-                obj2_pos = (obj2_pos[0], obj2_pos[1] - 1)
-                if obj2_pos == (obj2_pos[0], -1):
-                    obj2_pos = (obj2_pos[0], 0)
-            elif obj2_direction == 'right':
-                obj2_pos = (obj2_pos[0], obj2_pos[1] + 1)
-                if obj2_pos == (obj2_pos[0], self.grid_size):
-                    obj2_pos = (obj2_pos[0], self.grid_size - 1)
-
-            # if obje#_pos is the same as obj1_actions[-1] then break the loop
-            if obj1_pos == obj1_actions[-1] and obj2_pos == obj2_actions[-1]:
+            # does not let the objects go out of the grid, they stay at the edge
+            new_x1, new_y1, new_x2, new_y2 = x1 + dx1, y1 + dy1, x2 + dx2, y2 + dy2
+            moved1 = 0 <= new_x1 <= last and 0 <= new_y1 <= last
+            moved2 = 0 <= new_x2 <= last and 0 <= new_y2 <= last
+
+            # if both objects stay where they were then break the loop
+            if not (moved1 or moved2):
                 break
+            if moved1:
+                x1, y1 = new_x1, new_y1
+            if moved2:
+                x2, y2 = new_x2, new_y2
 
-            obj1_actions.append(obj1_pos)
-            obj2_actions.append(obj2_pos)
+            obj1_actions[k], obj1_actions[k + 1] = x1, y1
+            obj2_actions[k], obj2_actions[k + 1] = x2, y2
+            k += 2
 
-        if collisions == []:
-            collisions.append(0)
-        return obj1_actions, obj2_actions, collisions
+        return *Trajectory.pair(obj1_actions, obj2_actions, k // 2), collisions
 
 
-    def find_path(self, start_pos_blue, start_pos_red, randomness_factor=0.2):
+    @profiling.timed('find_path')
+    def find_path(self, start_pos_blue, start_pos_red, randomness_factor=0.2, rng=None, row=0):
         """
         - Creates movement patterns for both blue and red rectangles with some randomness added.
         - The patterns stop when both objects collide at the same coordinates.
           randomness_factor controls the likelihood of random movement at each step.
         """
-        blue_pattern = []
-        red_pattern = []
-
-        blue_pattern.append(start_pos_blue)
-        red_pattern.append(start_pos_red)
+        rng, row = self._continue(start_pos_blue, start_pos_red, rng, row)
+        # positions are written into preallocated buffers, nothing is allocated per step
+        blue_pattern, red_pattern = self._buffers(2 * self.grid_size)
+        last = self.grid_size - 1
+
+        # positions are plain ints (bx, by) and (rx, ry), like fix_direction_action
+        bx, by = start_pos_blue
+        rx, ry = start_pos_red
+
+        blue_pattern[0], blue_pattern[1] = bx, by
+        red_pattern[0], red_pattern[1] = rx, ry
+        k, capacity = 2, len(blue_pattern)
+        # moves of blue and red at every step (see _move_codes), a window of steps at a time
+        moves, j = rng.table_one((_move_code_table, 1, STEP_WINDOW, randomness_factor), row), 0
+        end = len(moves)
         
-        current_blue = list(start_pos_blue)
-        current_red = list(start_pos_red)
-        
-        while current_blue != current_red:
+        while bx != rx or by != ry:
             # Randomize movement with a probability controlled by randomness_factor
-            if random.random() < randomness_factor:
+            if j == end:
+                moves, j = rng.table_one((_move_code_table, k // 2, STEP_WINDOW, randomness_factor), row), 0
+            move, move_red = moves[j], moves[j + 1]
+            j += 2
+            if move != PLANNED:
                 # Move blue randomly
-                direction = random.choice(['up', 'down', 'left', 'right'])
-                if direction == 'up' and current_blue[0] > 0:
-                    current_blue[0] -= 1
-                elif direction == 'down' and current_blue[0] < self.grid_size - 1:
-                    current_blue[0] += 1
-                elif direction == 'left' and current_blue[1] > 0:
-                    current_blue[1] -= 1
-                elif direction == 'right' and current_blue[1] < self.grid_size - 1:
-                    current_blue[1] += 1
+                direction = DIRECTIONS[move]
+                if direction == 'up' and bx > 0:
+                    bx -= 1
+                elif direction == 'down' and bx < last:
+                    bx += 1
+                elif direction == 'left' and by > 0:
+                    by -= 1
+                elif direction == 'right' and by < last:
+                    by += 1
             else:
                 # Move blue towards red (efficient movement)
-                if current_blue[0] < current_red[0]:
-                    current_blue[0] += 1
-                elif current_blue[0] > current_red[0]:
-                    current_blue[0] -= 1
+                if bx < rx:
+                    bx += 1
+                elif bx > rx:
+                    bx -= 1
 
-                if current_blue[1] < current_red[1]:
-                    current_blue[1] += 1
-                elif current_blue[1] > current_red[1]:
-                    current_blue[1] -= 1
+                if by < ry:
+                    by += 1
+                elif by > ry:
+                    by -= 1
 
             # Randomize movement with a probability controlled by randomness_factor for red
-            if random.random() < randomness_factor:
+            if move_red != PLANNED:
                 # Move red randomly
-                direction = random.choice(['up', 'down', 'left', 'right'])
-                if direction == 'up' and current_red[0] > 0:
-                    current_red[0] -= 1
-                elif direction == 'down' and current_red[0] < self.grid_size - 1:
-                    current_red[0] += 1
-                elif direction == 'left' and current_red[1] > 0:
-                    current_red[1] -= 1
-                elif direction == 'right' and current_red[1] < self.grid_size - 1:
-                    current_red[1] += 1
+                direction = DIRECTIONS[move_red]
+                if direction == 'up' and rx > 0:
+                    rx -= 1
+                elif direction == 'down' and rx < last:
+                    rx += 1
+                elif direction == 'left' and ry > 0:
+                    ry -= 1
+                elif direction == 'right' and ry < last:
+                    ry += 1
             else:
                 # Move red towards blue (efficient movement)
-                if current_red[0] < current_blue[0]:
-                    current_red[0] += 1
-                elif current_red[0] > current_blue[0]:
-                    current_red[0] -= 1
+                if rx < bx:
+                    rx += 1
+                elif rx > bx:
+                    rx -= 1
 
-                if current_red[1] < current_blue[1]:
-                    current_red[1] += 1
-                elif current_red[1] > current_blue[1]:
-                    current_red[1] -= 1
+                if ry < by:
+                    ry += 1
+                elif ry > by:
+                    ry -= 1
 
             # Append current positions to the movement patterns
-            blue_pattern.append(tuple(current_blue))
-            red_pattern.append(tuple(current_red))
+            if k == capacity:
+                # the episode has no fixed length, double the buffers when they are full
+                blue_pattern.extend(blue_pattern)
+                red_pattern.extend(red_pattern)
+                capacity *= 2
+            blue_pattern[k], blue_pattern[k + 1] = bx, by
+            red_pattern[k], red_pattern[k + 1] = rx, ry
+            k += 2
 
             # Stop if they collide
-            if current_blue == current_red:
+            if bx == rx and by == ry:
                 break
 
+        blue_pattern, red_pattern = Trajectory.pair(blue_pattern, red_pattern, k // 2)
         if self.flag:
             print(f'BLUE pattern:\n{blue_pattern}')
             print(f'RED pattern:\n{red_pattern}\n')
         return blue_pattern, red_pattern
 
-    def find_non_collision_path(self, start_pos_blue, start_pos_red, max_length=10, randomness_factor=0.2):
+    @profiling.timed('find_non_collision_path')
+    def find_non_collision_path(self, start_pos_blue, start_pos_red, max_length=10, randomness_factor=0.2, rng=None, row=0):
         """
         - Creates movement patterns for both blue and red rectangles with some randomness added.
         - The patterns will not allow the objects to collide with each other.
         - The max_length parameter defines the maximum length of the movement patterns.
         randomness_factor controls the likelihood of random movement at each step.
         """
-        blue_pattern = []
-        red_pattern = []
-
-        blue_pattern.append(start_pos_blue)
-        red_pattern.append(start_pos_red)
-
-        current_blue = list(start_pos_blue)
-        current_red = list(start_pos_red)
-
-        for _ in range(max_length):
+        rng, row = self._continue(start_pos_blue, start_pos_red, rng, row)
+        # positions are written into preallocated buffers, nothing is allocated per step
+        blue_pattern, red_pattern = self._buffers(max(max_length, 2))
+        last = self.grid_size - 1
+
+        # positions are plain ints (bx, by) and (rx, ry), like fix_direction_action
+        bx, by = start_pos_blue
+        rx, ry = start_pos_red
+
+        blue_pattern[0], blue_pattern[1] = bx, by
+        red_pattern[0], red_pattern[1] = rx, ry
+        k = 2
+        # moves of blue and red at every step (see _move_codes), the loop stops after max(max_length - 1, 1) steps
+        moves, j = rng.table_one((_move_code_table, 1, max(max_length - 1, 1), randomness_factor), row), 0
+
+        for step in range(1, max_length + 1):
             # Randomize movement for blue
-            if random.random() < randomness_factor:
-                direction = random.choice(['up', 'down', 'left', 'right'])
-                if direction == 'up' and current_blue[0] > 0:
-                    current_blue[0] -= 1
-                elif direction == 'down' and current_blue[0] < self.grid_size - 1:
-                    current_blue[0] += 1
-                elif direction == 'left' and current_blue[1] > 0:
-                    current_blue[1] -= 1
-                elif direction == 'right' and current_blue[1] < self.grid_size - 1:
-                    current_blue[1] += 1
+            move, move_red = moves[j], moves[j + 1]
+            j += 2
+            if move != PLANNED:
+                direction = DIRECTIONS[move]
+                if direction == 'up' and bx > 0:
+                    bx -= 1
+                elif direction == 'down' and bx < last:
+                    bx += 1
+                elif direction == 'left' and by > 0:
+                    by -= 1
+                elif direction == 'right' and by < last:
+                    by += 1
             else:
                 # Move blue in a random direction avoiding the red object
-                if current_blue[0] < self.grid_size - 1 and current_blue[0] + 1 != current_red[0]:
-                    current_blue[0] += 1
-                elif current_blue[0] > 0 and current_blue[0] - 1 != current_red[0]:
-                    current_blue[0] -= 1
+                if bx < last and bx + 1 != rx:
+                    bx += 1
+                elif bx > 0 and bx - 1 != rx:
+                    bx -= 1
 
-                if current_blue[1] < self.grid_size - 1 and current_blue[1] + 1 != current_red[1]:
-                    current_blue[1] += 1
-                elif current_blue[1] > 0 and current_blue[1] - 1 != current_red[1]:
-                    current_blue[1] -= 1
+                if by < last and by + 1 != ry:
+                    by += 1
+                elif by > 0 and by - 1 != ry:
+                    by -= 1
 
             # Randomize movement for red
-            if random.random() < randomness_factor:
-                direction = random.choice(['up', 'down', 'left', 'right'])
-                if direction == 'up' and current_red[0] > 0:
-                    current_red[0] -= 1
-                elif direction == 'down' and current_red[0] < self.grid_size - 1:
-                    current_red[0] += 1
-                elif direction == 'left' and current_red[1] > 0:
-                    current_red[1] -= 1
-                elif direction == 'right' and current_red[1] < self.grid_size - 1:
-                    current_red[1] += 1
+            if move_red != PLANNED:
+                direction = DIRECTIONS[move_red]
+                if direction == 'up' and rx > 0:
+                    rx -= 1
+                elif direction == 'down' and rx < last:
+                    rx += 1
+                elif direction == 'left' and ry > 0:
+                    ry -= 1
+                elif direction == 'right' and ry < last:
+                    ry += 1
             else:
                 # Move red in a random direction avoiding the blue object
-                if current_red[0] < self.grid_size - 1 and current_red[0] + 1 != current_blue[0]:
-                    current_red[0] += 1
-                elif current_red[0] > 0 and current_red[0] - 1 != current_blue[0]:
-                    current_red[0] -= 1
+                if rx < last and rx + 1 != bx:
+                    rx += 1
+                elif rx > 0 and rx - 1 != bx:
+                    rx -= 1
 
-                if current_red[1] < self.grid_size - 1 and current_red[1] + 1 != current_blue[1]:
-                    current_red[1] += 1
-                elif current_red[1] > 0 and current_red[1] - 1 != current_blue[1]:
-                    current_red[1] -= 1
+                if ry < last and ry + 1 != by:
+                    ry += 1
+                elif ry > 0 and ry - 1 != by:
+                    ry -= 1
 
             # Append current positions to the movement patterns
-            blue_pattern.append(tuple(current_blue))
-            red_pattern.append(tuple(current_red))
+            blue_pattern[k], blue_pattern[k + 1] = bx, by
+            red_pattern[k], red_pattern[k + 1] = rx, ry
+            k += 2
 
             # Stop if the maximum length is reached
-            if len(blue_pattern) >= max_length or len(red_pattern) >= max_length:
+            if k // 2 >= max_length:
                 break
 
+        blue_pattern, red_pattern = Trajectory.pair(blue_pattern, red_pattern, k // 2)
         if self.flag:
             print(f'BLUE pattern:\n{blue_pattern}')
             print(f'RED pattern:\n{red_pattern}\n')
 
         return blue_pattern, red_pattern
 
-#TODO: move to grid_dataset_visualizer.py
-# write a function that plot matrix with two objects
-def plot_grid(grid_size, object1_loc, object2_loc, path):
-    matrix = np.zeros((grid_size, grid_size))
+    def generate_batch(self, n, mode='find_path', randomness_factor=0.2, max_length=10, rng=None, analytic=True):
+        """
+        - Vectorized version of `find_path`, `find_non_collision_path` and `fix_direction_action`.
+        - Simulates `n` episodes at once. Positions are stored as (k, 2) arrays of the k episodes
+          that are still running, finished episodes are dropped from them after every step,
+          so the cost of a step is a handful of NumPy calls instead of k Python iterations.
+        - `max_length` is only used by `find_non_collision_path`, it can be an int or an array of shape (n,).
+        - `fix_direction_action` episodes are straight lines, with analytic=True they are computed in closed form
+          (collision step and clamp points) instead of step by step, the episodes are the same.
+        - rng: EpisodeRNG of the n episodes, a seed, a SeedSequence or a numpy Generator (see episode_rng.episode_rng),
+          the next n episodes of self.rng if None. Episode i is drawn from its own stream, it is the same episode as
+          the one-episode methods return with (rng, row=i), and the same whatever the other episodes of the batch.
+        - Returns (object1_actions, object2_actions, lengths, collisions):
+            object#_actions: (n, T, 2) arrays, padded with PAD_VALUE after lengths[i] positions
+            lengths: (n,) number of recorded positions of each episode
+            collisions: (n,) collision flag of each episode (same labels as data_driver.py uses)
+        """
+        rng = self._batch_stream(rng, n)
+
+        with profiling.stage(f'generate_batch/{mode}'):
+            if mode == 'find_path':
+                object1_pos, object2_pos = self.place_rectangles_batch(n, rng)
+                recorder = _find_path_batch(self.grid_size, object1_pos, object2_pos, randomness_factor, rng)
+                result = recorder.result() + (np.ones(n, dtype=np.int8),)
+            elif mode == 'find_non_collision_path':
+                object1_pos, object2_pos = self.place_rectangles_batch(n, rng)
+                recorder = _find_non_collision_path_batch(self.grid_size, object1_pos, object2_pos, max_length, randomness_factor, rng)
+                result = recorder.result() + (np.zeros(n, dtype=np.int8),)
+            elif mode == 'fix_direction_action':
+                if analytic:
+                    result = _fix_direction_action_closed_form(self.grid_size, n, rng)
+                else:
+                    result = _fix_direction_action_batch(self.grid_size, n, rng)
+            else:
+                raise ValueError(f'Unknown mode {mode}, expected one of {BATCH_MODES}')
+
+        if profiling.enabled:
+            lengths = result[2]
+            profiling.count(f'episodes/{mode}', n)
+            profiling.count('steps_simulated', (lengths - 1).clip(0).sum())
+            profiling.count('collisions', result[3].sum())
+        return result
+
+    def place_rectangles_batch(self, n, rng=None):
+        """
+        - Vectorized `place_rectangles`, returns two (n, 2) arrays of initial positions.
+        - Every pair is drawn directly among the valid pairs, there is no rejection.
+        """
+        rng = self._batch_stream(rng, n)
+        with profiling.stage('place_rectangles_batch'):
+            profiling.count('placements', n)
+            return placement_index(self.grid_size, self.min_distance).sample(n, rng)
+
+
+# Modes supported by GridMaker.generate_batch
+BATCH_MODES = ('find_path', 'find_non_collision_path', 'fix_direction_action')
+
+# Value used to pad trajectories after the end of an episode
+PAD_VALUE = -1
+
+# Larger grids are SparseGrid objects (create_grid) and draw their initial positions with a RowPlacementIndex
+SPARSE_GRID_SIZE = 256
+
+# Moves in the same order as DIRECTIONS
+DIRECTIONS = ['up', 'down', 'left', 'right']
+MOVES = np.array([[-1, 0], [1, 0], [0, -1], [0, 1]], dtype=np.int32)
+DIRECTION_MOVES = dict(zip(DIRECTIONS, map(tuple, MOVES.tolist())))
+# move code of a step that follows the plan of find_path / find_non_collision_path, see _move_codes
+PLANNED = len(DIRECTIONS)
+# Sides of side_selection, indexed the same way by the batch version
+SIDES = ['left', 'right', 'top', 'bottom']
+
+
+def coordinate_dtype(grid_size):
     """
-    - Plot the matrix with two objects
+    - Smallest integer dtype that can hold a coordinate (and PAD_VALUE) of the grid
     """
-    if object1_loc == object2_loc:
-        cmap = ListedColormap(['white', 'green', 'green'])
-    else:
-        cmap = ListedColormap(['white', 'red', 'blue'])
-
-    # place the objects on the grid
-    matrix[object1_loc[0], object1_loc[1]] = 2
-    matrix[object2_loc[0], object2_loc[1]] = 1
-    
-    plt.matshow(matrix.T, cmap=cmap,  origin='upper', extent=[0, grid_size, 0, grid_size])
-    plt.grid(True)
-    ticks = np.arange(grid_size)
-    plt.xlabel('X-axis')
+    if grid_size <= np.iinfo(np.int8).max:
+        return np.int8
+    if grid_size <= np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
 
-    # Set the xlabel at the top
-    plt.gca().set_xlabel('X-axis', labelpad=10)  # Adjust labelpad for spacing
-    # Move xlabel to the top
-    plt.gca().xaxis.set_label_position('top')
-    plt.gca().xaxis.tick_top()  # Move ticks to the top if needed
 
-    plt.ylabel('Y-axis')
-    plt.xticks(ticks)
-    plt.yticks(ticks)
-    plt.gca().set_yticklabels(ticks[::-1])
+@functools.lru_cache(maxsize=None)
+def _typecode(grid_size):
+    # array typecode of coordinate_dtype, looked up once per grid size
+    return np.dtype(coordinate_dtype(grid_size)).char
 
-    save_path = f'{path}.png'
-    plt.savefig(save_path)
-    plt.close()
 
+class Trajectory(Sequence):
+    """
+    - Positions of one object during an episode, what find_path, find_non_collision_path and
+      fix_direction_action return instead of a list of tuples.
+    - The coordinates are stored flat (x0, y0, x1, y1, ...) in an array of int8 (int16 for grids over 127, int32 over 32767),
+      2 bytes per position instead of a tuple and a list slot. The generators write into preallocated
+      buffers (GridMaker._buffers) and copy the recorded positions of both objects into one array at the end
+      (see pair), the two Trajectories of the episode are coordinates[start:stop] of it.
+    - Reads like the old list of tuples: trajectory[i] and iteration give (x, y) tuples, built on access,
+      len(), slicing and + (lists), ==, and print. tolist() gives the list of tuples (e.g. for json.dumps,
+      which only takes lists), to_numpy() the (n, 2) array.
+    - Memory (tracemalloc, episodes of find_path kept as the (blue, red) tuple): at grid 10 (4.3 positions)
+      about 280 B per episode instead of 790 B for two lists of tuples, at grid 50 (14.4 positions) 310 B
+      instead of 2070 B, at grid 100 (27.3 positions) 370 B instead of 3730 B. Each position of the episode
+      takes 4 bytes instead of about 130 B, the rest is the fixed cost of the Python objects (the array, the two
+      Trajectories and the tuple, about 260 B), so short episodes cannot get much smaller as Python objects,
+      the columnar arrays of generate_batch (trajectory_io.py) take 4 bytes per position and nothing per episode.
+    """
+    __slots__ = ('coordinates', 'start', 'stop')
 
-class GridAnimator:
-    def __init__(self, grid, blue_pattern, red_pattern, cmap):
-        self.grid = grid
-        self.blue_pattern = blue_pattern
-        self.red_pattern = red_pattern
+    def __init__(self, coordinates, start=0, stop=None):
+        self.coordinates = coordinates
+        self.start = start
+        self.stop = len(coordinates) if stop is None else stop
 
-        # Create the figure and axis for plotting
-        self.fig, self.ax = plt.subplots()
-        self.mat = self.ax.matshow(self.grid, cmap=cmap)  # Create the matshow object
+    @staticmethod
+    def buffer(grid_size, capacity):
+        """
+        - Zeroed flat array for `capacity` positions
+        """
+        return array(_typecode(grid_size), [0]) * (2 * capacity)
 
-        # Create a text element for the frame number
-        self.text = self.ax.text(0.05, 0.95, '', transform=self.ax.transAxes, fontsize=12, color='black',
-                                 verticalalignment='top')
+    @staticmethod
+    def pair(buffer1, buffer2, length):
+        """
+        - Trajectories of the first `length` positions of the buffers of both objects of an episode,
+          copied into one array that they share (one array object per episode instead of two)
+        """
+        k = 2 * length
+        coordinates = buffer1[:k] + buffer2[:k]
+        return Trajectory(coordinates, 0, k), Trajectory(coordinates, k, 2 * k)
+
+    def append(self, x, y):
+        if self.start or self.stop != len(self.coordinates):
+            # stop sharing the array of the episode before growing it
+            self.coordinates, self.start, self.stop = self.coordinates[self.start:self.stop], 0, self.stop - self.start
+        self.coordinates.append(x)
+        self.coordinates.append(y)
+        self.stop += 2
+
+    def __len__(self):
+        return (self.stop - self.start) // 2
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('trajectory index out of range')
+        return self.coordinates[self.start + 2 * i], self.coordinates[self.start + 2 * i + 1]
+
+    def __iter__(self):
+        coordinates = itertools.islice(self.coordinates, self.start, self.stop)
+        return zip(coordinates, coordinates)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __add__(self, other):
+        # list + list like the old return values, a Trajectory + a Trajectory or a list gives a list
+        if not isinstance(other, (list, Trajectory)):
+            return NotImplemented
+        return self.tolist() + list(other)
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return other + self.tolist()
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        return list(self)
+
+    def to_numpy(self):
+        return np.array(self.coordinates[self.start:self.stop], dtype=self.coordinates.typecode).reshape(-1, 2)
+
+
+class PlacementIndex:
+    """
+    - Every (blue, red) pair of positions at least min_distance apart, indexed by the offset red - blue.
+    - An offset (dx, dy) is valid if dx^2 + dy^2 >= min_distance^2, and (grid_size - |dx|) * (grid_size - |dy|)
+      blue positions keep red on the grid. Drawing an offset with that weight (alias method, O(1) per draw),
+      then a blue position uniformly among them, draws a pair uniformly among all the valid pairs.
+    """
+    def __init__(self, grid_size, min_distance):
+        self.grid_size = grid_size
+        self.min_distance = min_distance
+
+        d = np.arange(-(grid_size - 1), grid_size)
+        dx, dy = np.meshgrid(d, d, indexing='ij')
+        valid = dx ** 2 + dy ** 2 >= min_distance ** 2
+        if not valid.any():
+            raise ValueError(f'No two positions of a {grid_size}x{grid_size} grid are {min_distance} apart, '
+                             f'min_distance must be at most {math.dist((0, 0), (grid_size - 1, grid_size - 1)):.3f}')
+
+        self.offsets = np.stack([dx[valid], dy[valid]], axis=1).astype(np.int32)
+        self.weights = (grid_size - np.abs(self.offsets)).prod(axis=1)
+        self.probability, self.alias = _alias_table(self.weights)
+        # lowest blue position and number of blue positions of each offset, for sample
+        self._low = np.maximum(-self.offsets, 0)
+        self._span = (grid_size - np.abs(self.offsets)).astype(np.float64)
+        # table of sample_one, built once
+        self._sample_key = (self._sample_table,)
+
+    def __len__(self):
+        # number of valid pairs
+        return int(self.weights.sum())
+
+    def sample(self, n, rng):
+        """
+        - Returns (blue_positions, red_positions), two (n, 2) int32 arrays, pair i drawn from episode i of the EpisodeRNG rng
+        """
+        u = rng.random(None, 0, PLACEMENT_SLOTS)
+        k = (u[:, 0] * len(self.offsets)).astype(np.intp)
+        k = np.where(u[:, 1] < self.probability[k], k, self.alias[k])
+
+        # blue positions that keep red = blue + offset on the grid
+        # (take gathers rows much faster than fancy indexing)
+        blue_positions = self._low.take(k, axis=0) + (u[:, 2:] * self._span.take(k, axis=0)).astype(np.int32)
+        return blue_positions, blue_positions + self.offsets.take(k, axis=0)
+
+    def sample_one(self, rng, row=0):
+        """
+        - Same as sample, for the pair of episode `row` of rng, returns two (x, y) tuples
+        - The pairs of the TABLE_ROWS episodes around `row` are drawn together by sample (EpisodeRNG.table_one)
+        """
+        return rng.table_one(self._sample_key, row)
 
-    def update_grid(self, frame):
+    def _sample_table(self, rng):
+        # ((blue x, blue y), (red x, red y)) of every episode of rng
+        blue_positions, red_positions = self.sample(len(rng), rng)
+        return list(zip(map(tuple, blue_positions.tolist()), map(tuple, red_positions.tolist())))
+
+
+class RowPlacementIndex:
+    """
+    - Same draws as PlacementIndex (uniformly among the valid pairs) without enumerating the (2 * grid_size - 1)^2
+      offsets, for large grids: memory and setup grow with grid_size instead of the area of the grid.
+    - The offsets are grouped by dx: the valid dy of a row are t(dx) <= |dy| < grid_size, with t(dx) the smallest
+      integer such that dx^2 + t^2 >= min_distance^2, so the weight of a row has a closed form.
+      dx is drawn from the rows (alias method), then dy uniformly in the row and kept with probability
+      (grid_size - |dy|) / (grid_size - t), redrawn otherwise (about half of the draws are kept).
+    """
+    def __init__(self, grid_size, min_distance):
+        self.grid_size = grid_size
+        self.min_distance = min_distance
+
+        g = grid_size
+        self.dx = np.arange(-(g - 1), g)
+        rest = min_distance ** 2 - self.dx.astype(np.float64) ** 2
+        t = np.ceil(np.sqrt(np.maximum(rest, 0)))
+        # exact integer bound, the float square root can be off by one
+        t = np.where((t > 0) & ((t - 1) ** 2 >= rest), t - 1, t)
+        t = np.where(t ** 2 < rest, t + 1, t)
+        # only the rows with at least one valid dy
+        valid = t <= g - 1
+        if not valid.any():
+            raise ValueError(f'No two positions of a {grid_size}x{grid_size} grid are {min_distance} apart, '
+                             f'min_distance must be at most {math.dist((0, 0), (grid_size - 1, grid_size - 1)):.3f}')
+        self.dx, self.t = self.dx[valid], t[valid].astype(np.int64)
+
+        # sum of (g - |dy|) over the valid dy of a row, dy = 0 is counted once
+        free = g - self.t
+        row_sums = free * (free + 1) - np.where(self.t == 0, g, 0)
+        self.weights = (g - np.abs(self.dx)) * row_sums
+        self.probability, self.alias = _alias_table(self.weights)
+
+    def __len__(self):
+        # number of valid pairs
+        return int(self.weights.sum())
+
+    def _row_offsets(self, rows, u):
+        # dy of the u-th valid value of every row, counted from -(g - 1) up
+        g, t = self.grid_size, self.t[rows]
+        return np.where(t == 0, u - (g - 1), np.where(u < g - t, u - (g - 1), t + u - (g - t)))
+
+    def sample(self, n, rng):
+        """
+        - Returns (blue_positions, red_positions), two (n, 2) int32 arrays, pair i drawn from episode i of the EpisodeRNG rng
         """
-        - Update the grid for each frame of the animation
+        g = self.grid_size
+        index = np.arange(n)
+        u = rng.random(None, 0, PLACEMENT_SLOTS)
+        k = (u[:, 0] * len(self.dx)).astype(np.intp)
+        rows = np.where(u[:, 1] < self.probability[k], k, self.alias[k])
+        u_blue = u[:, 2:]
+
+        # the draws of rejection round r are at step r
+        dy = np.zeros(n, dtype=np.int64)
+        pending = index
+        draws = 0
+        while len(pending):
+            t = self.t[rows[pending]]
+            u = rng.random(pending, draws, (SLOT_DY, SLOT_KEEP))
+            draw = self._row_offsets(rows[pending], (u[:, 0] * (2 * (g - t) - (t == 0))).astype(np.int64))
+            kept = u[:, 1] * (g - t) < g - np.abs(draw)
+            dy[pending[kept]] = draw[kept]
+            pending = pending[~kept]
+            draws += 1
+            profiling.count('placement_retries', len(pending))
+        offsets = np.stack([self.dx[rows], dy], axis=1)
+
+        low = np.maximum(-offsets, 0)
+        blue_positions = (low + (u_blue * (g - np.abs(offsets))).astype(np.int64)).astype(np.int32)
+        return blue_positions, (blue_positions + offsets).astype(np.int32)
+
+    def sample_one(self, rng, row=0):
         """
-        self.grid.fill(0)  # Clear the grid at each step
+        - Same as sample, for the pair of episode `row` of rng, returns two (x, y) tuples
+        """
+        g = self.grid_size
+        u_offset, u_alias, u_x, u_y = rng.random_one(0, PLACEMENT_SLOTS, row)
+        k = int(u_offset * len(self.dx))
+        k = k if u_alias < self.probability[k] else int(self.alias[k])
+        dx, t = int(self.dx[k]), int(self.t[k])
+        draws = 0
+        while True:
+            u_dy, u_keep = rng.random_one(draws, (SLOT_DY, SLOT_KEEP), row)
+            dy = int(self._row_offsets(k, int(u_dy * (2 * (g - t) - (t == 0)))))
+            if u_keep * (g - t) < g - abs(dy):
+                break
+            draws += 1
+        if draws:
+            # rejected dy draws, like sample
+            profiling.count('placement_retries', draws)
+
+        x = max(-dx, 0) + int(u_x * (g - abs(dx)))
+        y = max(-dy, 0) + int(u_y * (g - abs(dy)))
+        return (x, y), (x + dx, y + dy)
 
-        if frame < len(self.blue_pattern):
-            # Update blue position
-            blue_pos = self.blue_pattern[frame]
-            self.grid[blue_pos] = 2  # Set blue rectangle
 
-        if frame < len(self.red_pattern):
-            # Update red position
-            red_pos = self.red_pattern[frame]
-            self.grid[red_pos] = 1  # Set red rectangle
+@functools.lru_cache(maxsize=64)
+def placement_index(grid_size, min_distance):
+    """
+    - PlacementIndex of a configuration, built once and cached, a RowPlacementIndex for grids over SPARSE_GRID_SIZE
+    - Raises ValueError if no pair of positions is min_distance apart
+    """
+    if grid_size > SPARSE_GRID_SIZE:
+        return RowPlacementIndex(grid_size, min_distance)
+    return PlacementIndex(grid_size, min_distance)
+
+
+class SparseGrid:
+    """
+    - Grid of create_grid for large grids: a dict {(x, y): value} of its non-zero cells, so its memory grows
+      with the number of objects on it instead of the area of the grid
+    - Used like the dense grid: grid[x, y] = 2, grid[pos], grid.fill(0), grid.shape
+    - window() gives a dense uint8 crop for rendering, np.asarray(grid) the whole dense grid (small grids only)
+    """
+    __slots__ = ('shape', 'cells')
+
+    def __init__(self, grid_size):
+        self.shape = (grid_size, grid_size)
+        self.cells = {}
+
+    def _key(self, index):
+        x, y = index
+        if not (0 <= x < self.shape[0] and 0 <= y < self.shape[1]):
+            raise IndexError(f'cell {(x, y)} is outside of the {self.shape[0]}x{self.shape[1]} grid')
+        return int(x), int(y)
+
+    def __getitem__(self, index):
+        return self.cells.get(self._key(index), 0)
+
+    def __setitem__(self, index, value):
+        if value:
+            self.cells[self._key(index)] = value
+        else:
+            self.cells.pop(self._key(index), None)
+
+    def __len__(self):
+        # number of occupied cells
+        return len(self.cells)
+
+    def fill(self, value):
+        if value != 0:
+            raise ValueError('A SparseGrid can only be filled with 0, it only stores the occupied cells')
+        self.cells.clear()
+
+    def nonzero(self):
+        cells = np.array(list(self.cells), dtype=np.int64).reshape(-1, 2)
+        return cells[:, 0], cells[:, 1]
+
+    def window(self, x0, y0, height, width=None):
+        """
+        - Dense uint8 (height, width) array of the cells [x0, x0 + height) x [y0, y0 + width)
+        """
+        width = height if width is None else width
+        crop = np.zeros((height, width), dtype=np.uint8)
+        for (x, y), value in self.cells.items():
+            if x0 <= x < x0 + height and y0 <= y < y0 + width:
+                crop[x - x0, y - y0] = value
+        return crop
+
+    def __array__(self, dtype=None, copy=None):
+        return self.window(0, 0, *self.shape).astype(dtype or np.uint8, copy=False)
+
+
+def shared_cells(positions, grid_size):
+    """
+    - Collision check of many objects at once: (k, 2) positions -> (k,) bool, True for the objects
+      that share their cell with another one
+    - Cells are hashed to x * grid_size + y, so the cost grows with the number of objects, not with the area of the grid
+    """
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+    _, inverse, counts = np.unique(positions[:, 0] * grid_size + positions[:, 1], return_inverse=True, return_counts=True)
+    return counts[inverse.reshape(-1)] > 1
+
+
+def _alias_table(weights):
+    # Vose's alias method: draw k uniformly, keep it with probability[k], otherwise take alias[k]
+    n = len(weights)
+    scaled = (weights * n / weights.sum()).tolist()
+    probability = np.ones(n)
+    alias = np.arange(n)
+
+    small = [k for k in range(n) if scaled[k] < 1]
+    large = [k for k in range(n) if scaled[k] >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        probability[s], alias[s] = scaled[s], l
+        scaled[l] += scaled[s] - 1
+        (small if scaled[l] < 1 else large).append(l)
+    return probability, alias
+
+
+class _StepRecorder:
+    """
+    - Collects the positions of a batch of episodes step by step into a padded (n, T, 2, 2) array
+      (episode, step, object, coordinate).
+    - Only the episodes listed in `index` are written, the others keep PAD_VALUE.
+    - `pos` is given object-major (2, k, 2) so that pos[0] and pos[1] stay contiguous while simulating.
+    - With `order`, the rows are the episodes order[0], order[1], ... (`index` may then be a slice of them,
+      cheaper to write than a fancy index), result() puts them back in episode order.
+    """
+    def __init__(self, n, capacity, grid_size, order=None):
+        self.positions = np.full((n, capacity, 2, 2), PAD_VALUE, dtype=coordinate_dtype(grid_size))
+        self.lengths = np.zeros(n, dtype=np.int64)
+        self.order = order
+
+    def record(self, step, index, pos):
+        if step >= self.positions.shape[1]:
+            # episodes of find_path have no fixed length, double the capacity when it runs out
+            padding = np.full_like(self.positions, PAD_VALUE)
+            self.positions = np.concatenate([self.positions, padding], axis=1)
+
+        self.positions[index, step] = pos.transpose(1, 0, 2)
+        self.lengths[index] = step + 1
+
+    def result(self):
+        positions, lengths = self.positions[:, :self.lengths.max(initial=0)], self.lengths
+        if self.order is not None and np.any(self.order != np.arange(len(self.order))):
+            inverse = np.argsort(self.order)
+            positions, lengths = positions[inverse], lengths[inverse]
+        return positions[:, :, 0], positions[:, :, 1], lengths
+
+
+def _same(a, b):
+    # row-wise a == b for (k, 2) positions, faster than np.all(a == b, axis=1)
+    return (a[:, 0] == b[:, 0]) & (a[:, 1] == b[:, 1])
+
+
+def _move_codes(u, randomness_factor):
+    """
+    - Moves decided by the uniform numbers u of the steps of find_path and find_non_collision_path, as int8:
+      the index in DIRECTIONS of a random move (u < randomness_factor), PLANNED for the planned move otherwise
+    """
+    # a single uniform number decides both, u / randomness_factor is uniform again when u < randomness_factor,
+    # so 4 * u / randomness_factor is the direction below 4 and the planned move (PLANNED == 4) from there
+    if randomness_factor <= 0:
+        return np.full(u.shape, PLANNED, dtype=np.int8)
+    scaled = u * (len(DIRECTIONS) / randomness_factor)
+    return np.minimum(scaled, PLANNED, out=scaled).astype(np.int8)
+
+
+def _move_code_table(rng, step, steps, randomness_factor):
+    # _move_codes of `steps` steps from `step` for every episode of rng, one bytes object per episode
+    # (reading a move gives a cached small int, the one-episode loops allocate nothing per step)
+    width = 2 * steps
+    codes = _move_codes(rng.window(None, step, MOVE_SLOTS, steps), randomness_factor).tobytes()
+    return [codes[i:i + width] for i in range(0, len(codes), width)]
+
+
+def _random_moves(grid_size, pos, new_pos, codes):
+    """
+    - Random part of a step, same as the one-episode methods: the move code of an episode (see _move_codes)
+      decides whether it moves randomly and in which direction, a move outside of the grid is ignored.
+    - Overwrites `new_pos` (the planned moves) of the episodes that move randomly instead.
+    """
+    is_random = np.flatnonzero(codes != PLANNED)
+    moved = pos.take(is_random, axis=0) + MOVES.take(codes.take(is_random), axis=0)
+    np.clip(moved, 0, grid_size - 1, out=moved)
+    new_pos[is_random] = moved
+    return new_pos
+
+
+def _find_path_batch(grid_size, blue, red, randomness_factor, rng):
+    # the recorder doubles its capacity when needed, episodes of large grids rarely cross the whole grid
+    recorder = _StepRecorder(len(blue), min(2 * grid_size, 2 * SPARSE_GRID_SIZE), grid_size)
+
+    # positions of the running episodes, pos[0] is blue and pos[1] is red
+    index = np.arange(len(blue))
+    pos = np.stack([blue, red])
+    recorder.record(0, index, pos)
+
+    # drop the episodes that already start on the same coordinates
+    running = np.flatnonzero(~_same(pos[0], pos[1]))
+    index, pos = index[running], pos[:, running]
+
+    step = 0
+    while len(index) > 0:
+        step += 1
+        blue, red = pos
+        # moves of the running episodes for a window of steps at a time, they are dropped with the episodes
+        j = 2 * ((step - 1) % STEP_WINDOW)
+        if j == 0:
+            moves = _move_codes(rng.window(index, step, MOVE_SLOTS), randomness_factor)
+
+        # Move blue towards red, or randomly
+        blue[:] = _random_moves(grid_size, blue, blue + np.sign(red - blue), moves[:, j])
+
+        # Move red towards (the new) blue, or randomly
+        red[:] = _random_moves(grid_size, red, red + np.sign(blue - red), moves[:, j + 1])
+
+        recorder.record(step, index, pos)
+
+        # Stop if they collide
+        with profiling.stage('collision_check'):
+            running = np.flatnonzero(~_same(blue, red))
+        index, pos, moves = index[running], pos[:, running], moves.take(running, axis=0)
+
+    return recorder
+
+
+def _avoid(grid_size, pos, other):
+    # step +1 on each axis unless it lands on the other object's row/column, otherwise try -1
+    up = (pos < grid_size - 1) & (pos + 1 != other)
+    down = (pos > 0) & (pos - 1 != other)
+    return pos + up - (down & ~up)
+
+
+def _find_non_collision_path_batch(grid_size, blue, red, max_length, randomness_factor, rng):
+    # find_non_collision_path records max_length positions, but at least 1 for max_length 0 and 2 for max_length 1
+    max_length = np.broadcast_to(np.asarray(max_length), (len(blue),))
+    lengths = np.where(max_length <= 0, 1, np.maximum(max_length, 2))
+    # episodes sorted by length, the running episodes of a step are always a prefix of them (and of the rows
+    # of the recorder)
+    index = np.argsort(-lengths, kind='stable')
+    recorder = _StepRecorder(len(blue), lengths.max(initial=1), grid_size, order=index)
+    pos = np.stack([blue[index], red[index]])
+    running = np.searchsorted(-lengths[index], -np.arange(lengths.max(initial=1)), side='left')
+    recorder.record(0, slice(None), pos)
+    # moves of every step at once, the running episodes of a step are a prefix of the rows
+    moves = _move_codes(rng.window(index, 1, MOVE_SLOTS, steps=lengths.max(initial=1) - 1), randomness_factor)
+
+    for step in range(1, lengths.max(initial=1)):
+        pos = pos[:, :running[step]]
+        blue, red = pos
+        u = moves[:running[step], 2 * step - 2:2 * step]
+
+        # Move blue away from red, or randomly
+        blue[:] = _random_moves(grid_size, blue, _avoid(grid_size, blue, red), u[:, 0])
+
+        # Move red away from (the new) blue, or randomly
+        red[:] = _random_moves(grid_size, red, _avoid(grid_size, red, blue), u[:, 1])
+
+        recorder.record(step, slice(running[step]), pos)
+
+    return recorder
+
+
+def _side_selection_batch(grid_size, sides, u):
+    # same as GridMaker.side_selection for sides indexed as SIDES, u: (k, 2) numbers of its (edge, free) slots
+    edge, free = (u * np.array([3, grid_size])).astype(np.int32).T
+
+    x = np.where(sides == 0, edge, np.where(sides == 1, grid_size - 3 + edge, free))
+    y = np.where(sides == 2, grid_size - 3 + edge, np.where(sides == 3, edge, free))
+    return np.stack([x, y], axis=1)
+
+
+def _fix_direction_starts(grid_size, n, rng):
+    # random part of fix_direction_action: start positions (2, n, 2) and moves (2, n, 2) of both objects
+    # every number of the starts in one call, slots SIDE1 to DIRECTION2 follow each other
+    u = rng.random(None, 0, range(SLOT_SIDE1, SLOT_DIRECTION2 + 1))
+    sides = (u[:, 0:2] * 4).astype(np.intp)
+    obj1 = _side_selection_batch(grid_size, sides[:, 0], u[:, SLOT_EDGE1 - SLOT_SIDE1:SLOT_FREE1 - SLOT_SIDE1 + 1])
+    obj2 = _side_selection_batch(grid_size, sides[:, 1], u[:, SLOT_EDGE2 - SLOT_SIDE1:SLOT_FREE2 - SLOT_SIDE1 + 1])
+
+    # same as fix_direction_action, positions on the same coordinates are redrawn once
+    same = np.flatnonzero(_same(obj1, obj2))
+    obj2[same] = _side_selection_batch(grid_size, sides[same, 1], rng.random(same, 1, (SLOT_EDGE2, SLOT_FREE2)))
+
+    # each object keeps moving in one direction for the whole episode
+    directions = (u[:, SLOT_DIRECTION1 - SLOT_SIDE1:] * 4).astype(np.intp).T
+    return np.stack([obj1, obj2]), MOVES[directions]
+
+
+def _fix_direction_action_batch(grid_size, n, rng):
+    """
+    - Step by step version of fix_direction_action, one iteration per step like the original loop
+    """
+    pos, moves = _fix_direction_starts(grid_size, n, rng)
+
+    recorder = _StepRecorder(n, grid_size + 1, grid_size)
+    collisions = np.zeros(n, dtype=np.int8)
+
+    index = np.arange(n)
+    recorder.record(0, index, pos)
+
+    for step in range(1, grid_size + 1):
+        with profiling.stage('collision_check'):
+            collided = _same(pos[0], pos[1])
+        collisions[index[collided]] = 1
+
+        # objects do not leave the grid, they stay at the edge
+        new_pos = pos + moves
+        np.clip(new_pos, 0, grid_size - 1, out=new_pos)
+
+        # stop on a collision or when both objects do not move anymore
+        stationary = _same(new_pos[0], pos[0]) & _same(new_pos[1], pos[1])
+        running = np.flatnonzero(~(collided | stationary))
+        index, pos, moves = index[running], new_pos[:, running], moves[:, running]
+        if len(index) == 0:
+            break
+
+        recorder.record(step, index, pos)
+
+    return recorder.result() + (collisions,)
+
+
+def _fix_direction_action_closed_form(grid_size, n, rng):
+    """
+    - Same episodes as _fix_direction_action_batch (for the same rng), computed without stepping:
+      object i is at start_i + min(t, stop_i) * move_i at step t, where stop_i is the number of steps
+      before it reaches the edge of the grid (its clamp point). The episode ends at the first step
+      where both objects are on the same cell, or at max(stop_1, stop_2) when both have stopped.
+    - Only a fixed number of NumPy calls, whatever the grid size
+    """
+    pos, moves = _fix_direction_starts(grid_size, n, rng)
+
+    # steps before each object reaches the edge it moves towards, (2, n)
+    stops = np.where(moves > 0, grid_size - 1 - pos, np.where(moves < 0, pos, 0)).sum(axis=2)
+    first_stop, last_stop = stops.min(axis=0), stops.max(axis=0)
+
+    # the difference of the positions is linear while both objects move (steps 0..first_stop),
+    # and while only one of them moves (steps first_stop..last_stop)
+    with profiling.stage('collision_check'):
+        velocity = moves[0] - moves[1]
+        meeting = _first_meeting(pos[0] - pos[1], velocity, first_stop)
+
+        at_first_stop = pos + np.minimum(first_stop[:, None], stops[..., None]) * moves
+        velocity = np.where(stops[0, :, None] > first_stop[:, None], moves[0], 0) - np.where(stops[1, :, None] > first_stop[:, None], moves[1], 0)
+        later = _first_meeting(at_first_stop[0] - at_first_stop[1], velocity, last_stop - first_stop)
+        meeting = np.where(meeting >= 0, meeting, np.where(later >= 0, first_stop + later, -1))
+
+    collisions = (meeting >= 0).astype(np.int8)
+    lengths = np.where(meeting >= 0, meeting, last_stop) + 1
+
+    # positions of every recorded step, padded after lengths[i] steps, built one coordinate at a time
+    # with small integers since the (2, n, T, 2) array is the bulk of the work
+    dtype = coordinate_dtype(grid_size)
+    t = np.arange(lengths.max(initial=0), dtype=np.int32)
+    steps = np.minimum(t, stops[..., None].astype(np.int32))
+    recorded = t < lengths[:, None]
+    positions = np.full(steps.shape + (2,), PAD_VALUE, dtype=dtype)
+    for axis in range(2):
+        np.copyto(positions[..., axis], pos[..., axis, None] + steps * moves[..., axis, None], where=recorded, casting='unsafe')
+    return positions[0], positions[1], lengths.astype(np.int64), collisions
+
+
+def _first_meeting(difference, velocity, duration):
+    """
+    - Smallest t in [0, duration] with difference + t * velocity == 0 on both coordinates, -1 if there is none
+    - difference, velocity: (n, 2) integer arrays, duration: (n,)
+    """
+    met = np.ones(len(duration), dtype=bool)
+    t = np.zeros(len(duration), dtype=difference.dtype)
+    constrained = np.zeros(len(duration), dtype=bool)
+    for axis in range(2):
+        d, v = difference[:, axis], velocity[:, axis]
+        moving = v != 0
+        # a coordinate that does not change has to be equal already, a moving one meets at -d / v
+        safe = np.where(moving, v, 1)
+        t_axis = -d // safe
+        met &= np.where(moving, t_axis * safe == -d, d == 0)
+        # both moving coordinates have to meet at the same step
+        met &= ~(moving & constrained) | (t_axis == t)
+        t = np.where(moving, t_axis, t)
+        constrained |= moving
+
+    met &= (t >= 0) & (t <= duration)
+    return np.where(met, t, -1)
 
-        # Update the plot
-        self.mat.set_data(self.grid)
 
-        # Update the frame number text
-        self.text.set_text(f'Frame: {frame}')
+# Plotting lives in grid_plotting.py (matplotlib), loaded only when one of these is used
+_PLOTTING = ('plot_grid', 'GridPlotter', 'GridAnimator')
 
-        return [self.mat, self.text]
 
-    def animate(self):
-        # Create the animation
-        ani = animation.FuncAnimation(
-            self.fig, self.update_grid, frames=max(len(self.blue_pattern), len(self.red_pattern)),
-            interval=500, blit=True
-        )
-        plt.show()
+def __getattr__(name):
+    if name in _PLOTTING:
+        import grid_plotting
+        return getattr(grid_plotting, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 if __name__ == '__main__':
     """
     - Example usage of the GridMaker class
     """
+    from matplotlib.colors import ListedColormap
 
     # Create an instance of the GridMaker class
     my_grid = GridMaker(grid_size=10, min_distance=3, flag=True)
@@ -439,4 +1164,5 @@ if __name__ == '__main__':
         # my_animation = GridAnimator(my_grid.grid, blue_actions, red_actions, cmap)
 
         # my_animation.animate()
+        # or my_animation.save(f'sample{i + 1}.gif') to write it without opening a window
      
\ No newline at end of file
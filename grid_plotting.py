@@ -0,0 +1,154 @@
+# Plotting of grid episodes with matplotlib, kept out of grid_maker.py so that the simulation
+# only needs NumPy: importing grid_maker does not load matplotlib.
+# plot_grid, GridPlotter and GridAnimator can still be imported from grid_maker, they are loaded from here on first use.
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+from matplotlib.colors import ListedColormap
+from grid_renderer import BLUE, CELL_SIZE, RED, render, save_video, upscale
+
+
+#TODO: move to grid_dataset_visualizer.py
+# write a function that plot matrix with two objects
+def plot_grid(grid_size, object1_loc, object2_loc, path):
+    matrix = np.zeros((grid_size, grid_size))
+    """
+    - Plot the matrix with two objects
+    """
+    if object1_loc == object2_loc:
+        cmap = ListedColormap(['white', 'green', 'green'])
+    else:
+        cmap = ListedColormap(['white', 'red', 'blue'])
+
+    # place the objects on the grid
+    matrix[object1_loc[0], object1_loc[1]] = 2
+    matrix[object2_loc[0], object2_loc[1]] = 1
+    
+    plt.matshow(matrix.T, cmap=cmap,  origin='upper', extent=[0, grid_size, 0, grid_size])
+    plt.grid(True)
+    ticks = np.arange(grid_size)
+    plt.xlabel('X-axis')
+
+    # Set the xlabel at the top
+    plt.gca().set_xlabel('X-axis', labelpad=10)  # Adjust labelpad for spacing
+    # Move xlabel to the top
+    plt.gca().xaxis.set_label_position('top')
+    plt.gca().xaxis.tick_top()  # Move ticks to the top if needed
+
+    plt.ylabel('Y-axis')
+    plt.xticks(ticks)
+    plt.yticks(ticks)
+    plt.gca().set_yticklabels(ticks[::-1])
+
+    save_path = f'{path}.png'
+    plt.savefig(save_path)
+    plt.close()
+
+
+class GridPlotter:
+    """
+    - Same figure as plot_grid, but the figure, axes and image are created once and reused,
+      every frame only updates the image data and saves the figure.
+    - Uses the object-oriented matplotlib API, so it does not touch pyplot's global figures
+      and can be used in worker processes with a headless backend.
+    """
+    def __init__(self, grid_size):
+        from matplotlib.figure import Figure
+
+        self.grid_size = grid_size
+        self.matrix = np.zeros((grid_size, grid_size))
+
+        # same layout as plt.matshow
+        self.fig = Figure(figsize=plt.figaspect(self.matrix))
+        self.ax = self.fig.add_axes((0.15, 0.09, 0.775, 0.775))
+
+        # 0: empty, 1: red (object 2), 2: blue (object 1), 3: green (both objects on the same cell)
+        cmap = ListedColormap(['white', 'red', 'blue', 'green'])
+        self.image = self.ax.matshow(self.matrix.T, cmap=cmap, vmin=0, vmax=3, origin='upper', extent=[0, grid_size, 0, grid_size])
+
+        self.ax.grid(True)
+        ticks = np.arange(grid_size)
+        self.ax.set_xlabel('X-axis', labelpad=10)
+        self.ax.xaxis.set_label_position('top')
+        self.ax.xaxis.tick_top()
+        self.ax.set_ylabel('Y-axis')
+        self.ax.set_xticks(ticks)
+        self.ax.set_yticks(ticks)
+        self.ax.set_yticklabels(ticks[::-1])
+
+    def plot(self, object1_loc, object2_loc, path):
+        """
+        - Same as plot_grid(grid_size, object1_loc, object2_loc, path)
+        """
+        self.matrix.fill(0)
+        if object1_loc == object2_loc:
+            self.matrix[object1_loc[0], object1_loc[1]] = 3
+        else:
+            self.matrix[object1_loc[0], object1_loc[1]] = 2
+            self.matrix[object2_loc[0], object2_loc[1]] = 1
+
+        self.image.set_data(self.matrix.T)
+        self.fig.savefig(f'{path}.png')
+
+
+class GridAnimator:
+    def __init__(self, grid, blue_pattern, red_pattern, cmap):
+        self.grid = grid
+        self.blue_pattern = blue_pattern
+        self.red_pattern = red_pattern
+
+        # Create the figure and axis for plotting
+        self.fig, self.ax = plt.subplots()
+        self.mat = self.ax.matshow(self.grid, cmap=cmap)  # Create the matshow object
+
+        # Create a text element for the frame number
+        self.text = self.ax.text(0.05, 0.95, '', transform=self.ax.transAxes, fontsize=12, color='black',
+                                 verticalalignment='top')
+
+    def update_grid(self, frame):
+        """
+        - Update the grid for each frame of the animation
+        """
+        self.grid.fill(0)  # Clear the grid at each step
+
+        if frame < len(self.blue_pattern):
+            # Update blue position
+            blue_pos = self.blue_pattern[frame]
+            self.grid[blue_pos] = 2  # Set blue rectangle
+
+        if frame < len(self.red_pattern):
+            # Update red position
+            red_pos = self.red_pattern[frame]
+            self.grid[red_pos] = 1  # Set red rectangle
+
+        # Update the plot
+        self.mat.set_data(self.grid)
+
+        # Update the frame number text
+        self.text.set_text(f'Frame: {frame}')
+
+        return [self.mat, self.text]
+
+    def animate(self):
+        # Create the animation
+        ani = animation.FuncAnimation(
+            self.fig, self.update_grid, frames=max(len(self.blue_pattern), len(self.red_pattern)),
+            interval=500, blit=True
+        )
+        plt.show()
+
+    def save(self, path, fps=2, cell_size=CELL_SIZE):
+        """
+        - Writes the frames of animate as a gif (or mp4) file without opening a window, with the colors of
+          grid_renderer (blue, red on top) and without the frame number
+        - The frames are rasterized with NumPy instead of drawn by matplotlib, so many episodes can be exported quickly
+        """
+        steps = max(len(self.blue_pattern), len(self.red_pattern))
+        frames = np.zeros((steps,) + self.grid.shape, dtype=np.uint8)
+        for pattern, color in ((self.blue_pattern, BLUE), (self.red_pattern, RED)):
+            positions = np.asarray(pattern, dtype=np.int64).reshape(-1, 2)
+            # positions index the grid like update_grid does
+            frames[np.arange(len(positions)), positions[:, 0], positions[:, 1]] = color
+        images = render(frames, cell_size) if path.endswith('.mp4') else upscale(frames, cell_size)
+        save_video(images, path, fps)
@@ -0,0 +1,316 @@
+# Pure NumPy rasterizer of grid episodes
+#
+# Renders whole batches of episodes into uint8 tensors of shape (episodes, frames, H, W, C)
+# with the palette of plot_grid: white background, blue object 1, red object 2 and both
+# green when they are on the same cell. The tensors can be fed to a model directly,
+# or written to disk in bulk as png images, a single .npy file, one gif/mp4 per episode or contact sheets
+# (one image showing the frames of many episodes, for a quick look at a dataset).
+#
+# Like plot_grid, x (the first coordinate) is the column and y is the row, with y = 0 on top.
+# Large grids are rendered through a window: only a size x size crop of the grid is ever materialized.
+
+import io
+import os
+import numpy as np
+
+# Palette indices of the rasterized frames
+BACKGROUND, RED, BLUE, GREEN, GRID_LINE = 0, 1, 2, 3, 4
+PALETTE = np.array([
+    [255, 255, 255],  # white
+    [255, 0, 0],      # red
+    [0, 0, 255],      # blue
+    [0, 128, 0],      # green
+    [200, 200, 200],  # light gray grid lines
+    ], dtype=np.uint8)
+
+# Default size of a grid cell in pixels
+CELL_SIZE = 32
+
+# Pixels upscaled at once by the png paths, the long episodes of large grids are rendered a block of frames at a time
+MAX_BLOCK_PIXELS = 2 ** 26
+
+# Frames of grids larger than this are cropped to a window of this many cells (data_driver.py --render_window)
+RENDER_WINDOW = 64
+
+
+def rasterize(object1_actions, object2_actions, lengths, grid_size, window=None):
+    """
+    - Converts padded (n, T, 2) positions (as returned by GridMaker.generate_batch) to palette indices
+    - Returns a (n, T, grid_size, grid_size) uint8 array, frames after lengths[i] are empty grids
+    - window: (origins, size) renders only the size x size cells from origins = (x, y) on instead of the whole
+      grid, one origin for all episodes or (n, 2) origins, one per episode. Objects outside of it are not drawn.
+      Returns (n, T, size, size) frames.
+    """
+    object1_actions = np.asarray(object1_actions)
+    object2_actions = np.asarray(object2_actions)
+    n, steps = object1_actions.shape[:2]
+    size = grid_size if window is None else window[1]
+    frames = np.full((n, steps, size, size), BACKGROUND, dtype=np.uint8)
+
+    # (episode, frame) of every recorded position
+    episode, frame = np.nonzero(np.arange(steps) < np.asarray(lengths)[:, None])
+    x1, y1 = object1_actions[episode, frame].T
+    x2, y2 = object2_actions[episode, frame].T
+    same = (x1 == x2) & (y1 == y2)
+
+    if window is None:
+        frames[episode, frame, y1, x1] = np.where(same, GREEN, BLUE)
+        frames[episode, frame, y2, x2] = np.where(same, GREEN, RED)
+        return frames
+
+    origins = np.broadcast_to(np.asarray(window[0], dtype=np.int64), (n, 2))[episode]
+    for x, y, color in ((x1, y1, np.where(same, GREEN, BLUE)), (x2, y2, np.where(same, GREEN, RED))):
+        x, y = x - origins[:, 0], y - origins[:, 1]
+        inside = (x >= 0) & (x < size) & (y >= 0) & (y < size)
+        frames[episode[inside], frame[inside], y[inside], x[inside]] = color[inside]
+    return frames
+
+
+def window_origins(end1, end2, grid_size, size):
+    """
+    - (n, 2) origins of size x size windows around the ends of n episodes, end#: (n, 2) last position of each object
+    - The window is centered on the collision cell of the episodes that collide (the middle of the last positions
+      otherwise) and kept inside the grid, episodes of grids of up to size cells get the origin (0, 0)
+    - grid_size: int, or (n,) grid size of every episode
+    """
+    end = (np.asarray(end1, dtype=np.int64) + np.asarray(end2, dtype=np.int64)) // 2
+    upper = np.maximum(np.broadcast_to(np.asarray(grid_size, dtype=np.int64), (len(end),)) - size, 0)
+    return np.clip(end - size // 2, 0, upper[:, None])
+
+
+def _window_batch(window, start, stop):
+    # window of the episodes [start, stop) of a batch, the origins can be given per episode
+    if window is None or np.ndim(window[0]) < 2:
+        return window
+    return window[0][start:stop], window[1]
+
+
+def upscale(frames, cell_size=CELL_SIZE, grid_lines=False):
+    """
+    - Converts palette indices (..., grid_size, grid_size) to palette-indexed images (..., H, W),
+      every cell is a cell_size x cell_size square
+    - Only the occupied cells are painted on an empty image, which is much faster than repeating every cell
+    """
+    lead, grid_size = frames.shape[:-2], frames.shape[-1]
+    size = grid_size * cell_size
+    images = np.zeros(lead + (size, size), dtype=np.uint8)  # BACKGROUND is 0
+
+    # view of the images as (..., row, y in cell, column, x in cell)
+    cells = images.reshape(lead + (grid_size, cell_size, grid_size, cell_size))
+    *index, y, x = np.nonzero(frames)
+    cells[(*index, y, slice(None), x)] = frames[(*index, y, x)][:, None, None]
+
+    if grid_lines:
+        images[..., ::cell_size, :] = GRID_LINE
+        images[..., :, ::cell_size] = GRID_LINE
+    return images
+
+
+def render(frames, cell_size=CELL_SIZE, grid_lines=False):
+    """
+    - Converts palette indices (..., grid_size, grid_size) to RGB images (..., H, W, 3),
+      every cell is a cell_size x cell_size square
+    """
+    lead, grid_size = frames.shape[:-2], frames.shape[-1]
+    size = grid_size * cell_size
+    images = np.empty(lead + (size, size, 3), dtype=np.uint8)
+    _fill(images, PALETTE[BACKGROUND])
+
+    cells = images.reshape(lead + (grid_size, cell_size, grid_size, cell_size, 3))
+    *index, y, x = np.nonzero(frames)
+    cells[(*index, y, slice(None), x)] = PALETTE[frames[(*index, y, x)]][:, None, None]
+
+    if grid_lines:
+        images[..., ::cell_size, :, :] = PALETTE[GRID_LINE]
+        images[..., :, ::cell_size, :] = PALETTE[GRID_LINE]
+    return images
+
+
+def _fill(images, color):
+    # a gray color is a plain memset, much faster than broadcasting the 3 channels
+    if (color == color[0]).all():
+        images.fill(color[0])
+    else:
+        images[...] = color
+
+
+def render_episodes(object1_actions, object2_actions, lengths, grid_size, cell_size=CELL_SIZE, grid_lines=False):
+    """
+    - Renders a batch of episodes into a (n, T, H, W, 3) uint8 tensor, H = W = grid_size * cell_size
+    """
+    return render(rasterize(object1_actions, object2_actions, lengths, grid_size), cell_size, grid_lines)
+
+
+def contact_sheet(object1_actions, object2_actions, lengths, grid_size, cell_size=CELL_SIZE, grid_lines=False, max_frames=None, columns=None,
+                  window=None):
+    """
+    - Palette-indexed (H, W) image of a batch of episodes: every episode is a strip of its frames from left
+      to right (the first max_frames), the strips are laid out in `columns` columns (about a square image by default)
+    - Tiles are separated by gray lines, a strip ends in gray after the last frame of its episode
+    - window: crop of the frames, see rasterize
+    """
+    lengths = np.asarray(lengths)
+    n, steps = len(lengths), np.shape(object1_actions)[1]
+    if max_frames is not None:
+        steps = min(steps, max_frames)
+        lengths = np.minimum(lengths, steps)
+    images = upscale(rasterize(object1_actions[:, :steps], object2_actions[:, :steps], lengths, grid_size, window), cell_size, grid_lines)
+
+    if columns is None:
+        columns = max(1, round(np.sqrt(n / steps)))
+    rows = -(-n // columns)
+    size = images.shape[-1]
+    tile = size + max(1, cell_size // 4)
+
+    # (episode, frame, tile y, tile x), the strips of the last row are padded with gray tiles
+    tiles = np.full((rows * columns, steps, tile, tile), GRID_LINE, dtype=np.uint8)
+    recorded = np.arange(steps) < lengths[:, None]
+    tiles[:n, :, :size, :size][recorded] = images[recorded]
+    return tiles.reshape(rows, columns, steps, tile, tile).transpose(0, 3, 1, 2, 4).reshape(rows * tile, columns * steps * tile)
+
+
+def write_episodes(object1_actions, object2_actions, lengths, grid_size, path, fmt='png', sample_ids=None,
+                   cell_size=CELL_SIZE, grid_lines=False, batch_size=64, fps=2, window=None):
+    """
+    - Renders episodes in batches of batch_size and writes them to disk, so the whole tensor is never in memory
+    - fmt:
+        'png': path/sample{id}_frame{j}.png for every frame, the names used by plot_grid
+        'npy': a single (n, T, H, W, 3) array at path, frames after lengths[i] are empty grids
+        'gif', 'mp4': path/sample{id}.gif (or .mp4) for every episode, mp4 needs the imageio package
+        'sheet': path/sheet{first id}-{last id}.png, a contact sheet of every batch of batch_size episodes
+    - sample_ids are the numbers used in the file names, 1..n by default
+    - window: renders a crop of the grid instead of the whole grid, see rasterize
+    """
+    if fmt not in ('png', 'npy', 'gif', 'mp4', 'sheet'):
+        raise ValueError(f'Unknown format {fmt}, expected png, npy, gif, mp4 or sheet')
+
+    lengths = np.asarray(lengths)
+    n, steps = np.shape(object1_actions)[:2]
+    if sample_ids is None:
+        sample_ids = np.arange(1, n + 1)
+
+    if fmt == 'png':
+        os.makedirs(path, exist_ok=True)
+        for images in _frame_images(object1_actions, object2_actions, lengths, grid_size, sample_ids, cell_size, grid_lines, batch_size, window):
+            for sample_id, j, image in images:
+                _save_png(image, os.path.join(path, f'sample{sample_id}_frame{j}.png'))
+        return
+
+    if fmt == 'npy':
+        size = (grid_size if window is None else window[1]) * cell_size
+        output = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(n, steps, size, size, 3))
+    else:
+        os.makedirs(path, exist_ok=True)
+
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+        if fmt == 'sheet':
+            sheet = contact_sheet(object1_actions[start:stop], object2_actions[start:stop], lengths[start:stop], grid_size, cell_size, grid_lines,
+                                  window=_window_batch(window, start, stop))
+            _save_png(sheet, os.path.join(path, f'sheet{sample_ids[start]}-{sample_ids[stop - 1]}.png'))
+            continue
+
+        frames = rasterize(object1_actions[start:stop], object2_actions[start:stop], lengths[start:stop], grid_size, _window_batch(window, start, stop))
+
+        if fmt == 'npy':
+            output[start:stop] = render(frames, cell_size, grid_lines)
+            continue
+
+        # gif files are palette-indexed, so the RGB images are never built for them
+        images = render(frames, cell_size, grid_lines) if fmt == 'mp4' else upscale(frames, cell_size, grid_lines)
+        for k, sample_id in enumerate(sample_ids[start:stop]):
+            save_video(images[k, :lengths[start + k]], os.path.join(path, f'sample{sample_id}.{fmt}'), fps)
+
+    if fmt == 'npy':
+        output.flush()
+
+
+def encode_episodes(object1_actions, object2_actions, lengths, grid_size, sample_ids=None, cell_size=CELL_SIZE,
+                    grid_lines=False, batch_size=64, window=None):
+    """
+    - Same png frames as write_episodes(fmt='png'), encoded in memory instead of written:
+      yields one list of (file name, png bytes) per batch of batch_size episodes (or block of their frames, see _frame_images),
+      so that the files can be written by another thread while the next batch is encoded
+    """
+    lengths = np.asarray(lengths)
+    n = len(lengths)
+    if sample_ids is None:
+        sample_ids = np.arange(1, n + 1)
+
+    for images in _frame_images(object1_actions, object2_actions, lengths, grid_size, sample_ids, cell_size, grid_lines, batch_size, window):
+        yield [(f'sample{sample_id}_frame{j}.png', encode_png(image)) for sample_id, j, image in images]
+
+
+def _frame_images(object1_actions, object2_actions, lengths, grid_size, sample_ids, cell_size, grid_lines, batch_size, window):
+    # (sample id, frame number, palette-indexed image) of every recorded frame, one list per batch of episodes,
+    # or per block of their frames when the batch has more than MAX_BLOCK_PIXELS pixels
+    lengths = np.asarray(lengths)
+    n = len(lengths)
+    size = (grid_size if window is None else window[1]) * cell_size
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+        batch_lengths = lengths[start:stop]
+        block = max(1, MAX_BLOCK_PIXELS // ((stop - start) * size * size))
+        for first in range(0, batch_lengths.max(initial=0), block):
+            last = first + block
+            frames = rasterize(object1_actions[start:stop, first:last], object2_actions[start:stop, first:last],
+                               np.clip(batch_lengths - first, 0, block), grid_size, _window_batch(window, start, stop))
+            images = upscale(frames, cell_size, grid_lines)
+            yield [(sample_id, first + j, image) for k, sample_id in enumerate(sample_ids[start:stop])
+                   for j, image in enumerate(images[k, :max(0, batch_lengths[k] - first)])]
+
+
+def write_files(directory, files):
+    """
+    - Writes the (file name, bytes) pairs of encode_episodes into directory (created if needed), returns the paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, data in files:
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def _to_image(image):
+    from PIL import Image
+
+    if image.ndim == 3:
+        return Image.fromarray(image)
+
+    # palette-indexed image, putpalette turns the 'L' image into a 'P' image
+    indexed = Image.fromarray(image)
+    indexed.putpalette(PALETTE.ravel().tolist())
+    return indexed
+
+
+def _save_png(image, path):
+    # fast compression, the images are mostly flat colors
+    _to_image(image).save(path, compress_level=1)
+
+
+def encode_png(image):
+    # the bytes _save_png writes
+    buffer = io.BytesIO()
+    _to_image(image).save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def save_video(images, path, fps=2):
+    """
+    - Writes (T, H, W, 3) RGB images or (T, H, W) palette-indexed images as an animated gif,
+      or RGB images as an mp4 video (needs imageio and ffmpeg)
+    """
+    if path.endswith('.gif'):
+        frames = [_to_image(image) for image in images]
+        # the palette is already minimal, optimizing it remaps every frame and is ~10x slower than the encoding
+        frames[0].save(path, save_all=True, append_images=frames[1:], duration=int(1000 / fps), loop=0, optimize=False)
+    else:
+        try:
+            import imageio.v2 as imageio
+        except ImportError:
+            raise ImportError('Writing mp4 files needs imageio, install it with `pip install imageio imageio-ffmpeg`')
+
+        imageio.mimwrite(path, list(images), fps=fps)
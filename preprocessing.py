@@ -0,0 +1,251 @@
+# Model-ready tensors of a whole dataset, computed in one vectorized pass and cached on disk
+#
+# preprocess(path) converts a dataset written by data_driver.py (.npz, .csv or a shard manifest) into
+#   positions: (n, T, 2, 2) coordinates of object 1 and object 2 at every step, padded with PAD_VALUE
+#   features: (n, T, len(FEATURES)) float32 per-step features, 0 after the end of an episode
+#       dx1, dy1, dx2, dy2: displacement of each object since the previous step (0 at the first step)
+#       rel_x, rel_y: position of object 2 relative to object 1
+#       distance: Euclidean distance between the objects
+#   mask: (n, T) True for the recorded steps
+#   frames: (n, T, 2, S, S) uint8 one-hot occupancy, channel 0 is object 1 and channel 1 object 2,
+#       frames[i, t, c, y, x] like grid_renderer.rasterize (x is the column). S is the largest grid size, or
+#       render_window on larger grids: like data_driver.py --render_window the frames of an episode are then
+#       the S x S cells around its end (the collision cell of the episodes that collide)
+#   frame_origins: (n, 2) cell (x, y) of the top-left corner of the frames of every episode, (0, 0) when not cropped
+#   lengths, collision_status, grid_size: (n,) per-episode columns
+# With layout='packed' the per-step arrays are time-major instead, without padding, in the order of
+# torch.nn.utils.rnn.PackedSequence: (total_steps, ...) arrays with batch_sizes, sorted_indices and unsorted_indices.
+#
+# The arrays are written as .npy files in a directory named by the fingerprint of the dataset files and the
+# parameters, and memory-mapped on load: a training job only opens the files, there is no per-sample work.
+#
+#   arrays = preprocess('./data/grid_dataset/grid_dataset.npz', frames=True)
+#   python preprocessing.py --data_path ./data/grid_dataset/grid_dataset.npz
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from grid_maker import PAD_VALUE, coordinate_dtype
+from grid_renderer import RENDER_WINDOW, window_origins
+from trajectory_io import load_trajectories
+from utils.basic_functions import str2bool
+
+# Columns of the features array
+FEATURES = ('dx1', 'dy1', 'dx2', 'dy2', 'rel_x', 'rel_y', 'distance')
+LAYOUTS = ('padded', 'packed')
+
+# Bump when the arrays change, so that old preprocessed directories are not reused
+PREPROCESS_VERSION = 2
+
+# Cells of one-hot frames filled at once, the frames of large datasets are written a block of steps at a time
+MAX_BLOCK_CELLS = 2 ** 26
+
+
+def dataset_files(path):
+    """
+    - Files a dataset is read from: the file itself, or a manifest and its shards
+    """
+    if path.endswith('.json'):
+        from dataset_shards import shard_paths
+        return [path] + shard_paths(path)
+    return [path]
+
+
+def fingerprint(path, **parameters):
+    """
+    - Hash of the files of the dataset (path, size and modification time) and of the preprocessing parameters,
+      a file that is written again gets a new fingerprint without reading the data
+    """
+    files = []
+    for file in dataset_files(path):
+        stat = os.stat(file)
+        files.append([os.path.abspath(file), stat.st_size, stat.st_mtime_ns])
+    text = json.dumps([PREPROCESS_VERSION, files, parameters], sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def preprocessed_dir(path, cache_dir=None):
+    # preprocessed directories of a dataset, next to it by default
+    if cache_dir is None:
+        return os.path.splitext(path)[0] + '_preprocessed'
+    return cache_dir
+
+
+def _steps(dataset, max_steps):
+    # (episode, step) of every kept position of the columnar dataset, and the position rows they come from
+    offsets = np.asarray(dataset['offsets'], dtype=np.int64)
+    lengths = np.diff(offsets)
+    if max_steps is not None:
+        lengths = np.minimum(lengths, max_steps)
+
+    episode = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=starts[1:])
+    step = np.arange(len(episode)) - starts[episode]
+    return lengths, episode, step, offsets[episode] + step
+
+
+def step_features(object1, object2, step):
+    """
+    - (k, len(FEATURES)) float32 features of k positions, step: (k,) step of each position in its episode,
+      the positions of an episode follow each other
+    """
+    object1, object2 = object1.astype(np.float32), object2.astype(np.float32)
+    features = np.zeros((len(step), len(FEATURES)), dtype=np.float32)
+
+    # displacement since the previous position of the same episode, 0 at the first step
+    moved = np.flatnonzero(step > 0)
+    features[moved, 0:2] = object1[moved] - object1[moved - 1]
+    features[moved, 2:4] = object2[moved] - object2[moved - 1]
+
+    features[:, 4:6] = object2 - object1
+    features[:, 6] = np.hypot(features[:, 4], features[:, 5])
+    return features
+
+
+def _write_frames(path, shape, rows, object1, object2):
+    """
+    - One-hot occupancy frames of shape (..., 2, S, S) written to a .npy file, the frame of position k is
+      rows[k] of the frames flattened to (-1, 2, S, S), object# are the positions in the frames
+      (objects outside of them are not drawn)
+    - The file starts zero-filled, only the occupied cells are written, a block of positions at a time
+    """
+    if np.prod(shape) == 0:
+        # np.memmap cannot map an empty array
+        np.save(path, np.zeros(shape, dtype=np.uint8))
+        return
+    frames = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+    flat = frames.reshape(-1, *shape[-3:])
+    # positions sorted by row, so that each block touches a contiguous part of the file
+    by_row = np.argsort(rows, kind='stable')
+    block = max(1, MAX_BLOCK_CELLS // (2 * shape[-1] * shape[-1]))
+    size = shape[-1]
+    for start in range(0, len(rows), block):
+        k = by_row[start:start + block]
+        for channel, positions in enumerate((object1[k], object2[k])):
+            inside = ((positions >= 0) & (positions < size)).all(axis=1)
+            flat[rows[k][inside], channel, positions[inside, 1], positions[inside, 0]] = 1
+    frames.flush()
+
+
+def build(dataset, directory, frames=True, layout='padded', max_steps=None, render_window=RENDER_WINDOW):
+    """
+    - Computes the arrays of a dataset (the columnar dict of trajectory_io.load_trajectories) and writes them
+      to directory as .npy files, see the top of the file
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f'Unknown layout {layout}, expected one of {LAYOUTS}')
+    os.makedirs(directory, exist_ok=True)
+
+    lengths, episode, step, source = _steps(dataset, max_steps)
+    grid_size = np.asarray(dataset['grid_size'])
+    object1 = np.asarray(dataset['object1_action'][source])
+    object2 = np.asarray(dataset['object2_action'][source])
+    features = step_features(object1, object2, step)
+    dtype = coordinate_dtype(grid_size.max(initial=0))
+    n, steps = len(lengths), int(lengths.max(initial=0))
+
+    arrays = {
+        'lengths': lengths,
+        'collision_status': np.asarray(dataset['collision_status']),
+        'grid_size': grid_size,
+        }
+    if layout == 'padded':
+        # every position is scattered to its (episode, step) cell, rows are episode * steps + step
+        rows = episode * steps + step
+        positions = np.full((n * steps, 2, 2), PAD_VALUE, dtype=dtype)
+        positions[rows, 0], positions[rows, 1] = object1, object2
+        padded_features = np.zeros((n * steps, len(FEATURES)), dtype=np.float32)
+        padded_features[rows] = features
+        arrays['positions'] = positions.reshape(n, steps, 2, 2)
+        arrays['features'] = padded_features.reshape(n, steps, len(FEATURES))
+        arrays['mask'] = np.arange(steps) < lengths[:, None]
+        frame_shape = (n, steps)
+    else:
+        # time-major: all first steps (longest episodes first), then all second steps, ...
+        sorted_indices = np.argsort(-lengths, kind='stable')
+        unsorted_indices = np.empty_like(sorted_indices)
+        unsorted_indices[sorted_indices] = np.arange(n)
+        order = np.lexsort((unsorted_indices[episode], step))
+        rows = np.empty_like(order)
+        rows[order] = np.arange(len(order))
+        arrays['positions'] = np.stack([object1, object2], axis=1)[order].astype(dtype)
+        arrays['features'] = features[order]
+        arrays['batch_sizes'] = np.bincount(step, minlength=steps).astype(np.int64)
+        arrays['sorted_indices'] = sorted_indices
+        arrays['unsorted_indices'] = unsorted_indices
+        frame_shape = (len(order),)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), array)
+
+    if frames:
+        size = int(grid_size.max(initial=0))
+        origins = np.zeros((n, 2), dtype=np.int64)
+        if size > render_window and len(object1):
+            # frames of render_window cells around the end of every episode, its last kept position
+            size, ends = render_window, np.maximum(np.cumsum(lengths) - 1, 0)
+            origins = window_origins(object1[ends], object2[ends], grid_size, size)
+        np.save(os.path.join(directory, 'frame_origins.npy'), origins)
+        _write_frames(os.path.join(directory, 'frames.npy'), frame_shape + (2, size, size), rows,
+                      object1.astype(np.intp) - origins[episode], object2.astype(np.intp) - origins[episode])
+
+
+def load_preprocessed(directory, mmap=True):
+    """
+    - Arrays written by build, memory-mapped (read-only) unless mmap=False
+    """
+    names = sorted(name[:-len('.npy')] for name in os.listdir(directory) if name.endswith('.npy'))
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None) for name in names}
+
+
+def preprocess(path, frames=True, layout='padded', max_steps=None, cache_dir=None, mmap=True, render_window=RENDER_WINDOW):
+    """
+    - Preprocessed arrays of the dataset at path, built on the first call and loaded from the cache afterwards
+    - The directory of the arrays is cache_dir/<fingerprint>, cache_dir is <dataset>_preprocessed next to the
+      dataset by default. It is written under a temporary name and renamed once complete, so an interrupted
+      build is never loaded
+    - Returns (arrays, directory, built), built is False when the arrays were already on disk
+    """
+    parameters = {'frames': frames, 'layout': layout, 'max_steps': max_steps, 'render_window': render_window}
+    directory = os.path.join(preprocessed_dir(path, cache_dir), fingerprint(path, **parameters))
+
+    built = not os.path.isdir(directory)
+    if built:
+        tmp_dir = f'{directory}.tmp{os.getpid()}'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        build(load_trajectories(path, mmap=True), tmp_dir, **parameters)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'version': PREPROCESS_VERSION, 'source': path, 'features': FEATURES, **parameters}, f, indent=2)
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # built by another process in the meantime
+            shutil.rmtree(tmp_dir)
+    return load_preprocessed(directory, mmap=mmap), directory, built
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Convert a dataset into model-ready arrays, cached on disk')
+    parser.add_argument('--data_path', type=str, default='./data/grid_dataset/grid_dataset.npz', help='Dataset (.npz, .csv or shard manifest .json)')
+    parser.add_argument('--frames', type=str2bool, default=True, help='Also write the one-hot occupancy frames')
+    parser.add_argument('--layout', type=str, default='padded', choices=LAYOUTS, help='Padded (n, T, ...) or packed time-major arrays')
+    parser.add_argument('--max_steps', type=int, default=None, help='Cut the episodes after this many steps')
+    parser.add_argument('--render_window', type=int, default=RENDER_WINDOW, help='Frames of grids larger than this are cropped to a window of this many cells around the end of the episode')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Where the arrays are written, <dataset>_preprocessed by default')
+    return parser
+
+
+if __name__ == '__main__':
+    import time
+    args = get_parser().parse_args()
+
+    start = time.perf_counter()
+    arrays, directory, built = preprocess(args.data_path, args.frames, args.layout, args.max_steps, args.cache_dir,
+                                          render_window=args.render_window)
+    print(f'{"Built" if built else "Loaded"} {directory} in {time.perf_counter() - start:.2f} s')
+    for name, array in arrays.items():
+        print(f'  {name:<20} {str(array.shape):<28} {array.dtype}')
@@ -0,0 +1,191 @@
+# Opt-in timers and counters around the main stages of GridMaker and data_driver.py
+#
+# Disabled by default, the hooks then cost one global check. Enable it with
+#   python data_driver.py ... --profile True
+# or by setting the TRAFFIC_PROFILE environment variable (TRAFFIC_PROFILE=1, or the path of the report)
+# for any script, e.g. TRAFFIC_PROFILE=profile.json python benchmark.py
+# At exit the per-stage summary is written as JSON (profile.json by default) and printed as a table:
+#   stage: number of calls, total and mean time, share of the wall time (nested stages are included in their parent)
+#   counters: steps simulated, placements (and the rejected draws of RowPlacementIndex), frames rendered, ...
+# Worker processes inherit the environment variable, their timers are sent back with their results (collect/merge),
+# so with several workers the stage times add up over the processes and can exceed the wall time.
+#
+#   with profiling.stage('serialize'):
+#       write_chunk(...)
+#   profiling.count('frames_rendered', len(frame_paths))
+#
+# run_cprofile / cprofile_report give a function-level profile of a sample of the work (data_driver.py --cprofile_chunks K).
+
+import atexit
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import time
+
+ENV_VAR = 'TRAFFIC_PROFILE'
+DEFAULT_OUTPUT = 'profile.json'
+
+enabled = False
+output_path = DEFAULT_OUTPUT
+_start = time.perf_counter()
+# name -> [calls, seconds]
+_stages = {}
+# name -> value
+_counters = {}
+_null = contextlib.nullcontext()
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        entry = _stages.setdefault(self.name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.perf_counter() - self.start
+
+
+def stage(name):
+    """
+    - Context manager timing a stage, does nothing when profiling is disabled
+    """
+    return _Stage(name) if enabled else _null
+
+
+def timed(name):
+    """
+    - Decorator timing every call of a function as the stage `name`
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    if enabled:
+        # NumPy integers are converted, the counters are written as JSON
+        _counters[name] = _counters.get(name, 0) + int(value)
+
+
+def enable(path=None):
+    """
+    - Enables profiling in this process and in the processes it starts, the report is written to path at exit
+    """
+    global enabled, output_path
+    output_path = path or output_path
+    os.environ[ENV_VAR] = output_path
+    # worker processes send their timers back with collect() instead of writing a report
+    if not enabled and multiprocessing.parent_process() is None:
+        atexit.register(_report_at_exit)
+    enabled = True
+
+
+def collect():
+    """
+    - Timers and counters of this process since the last collect, reset (to send them from a worker process)
+    """
+    stats = {'stages': dict(_stages), 'counters': dict(_counters)}
+    _reset()
+    return stats
+
+
+def merge(stats):
+    """
+    - Adds the timers and counters returned by collect() in another process
+    """
+    for name, (calls, seconds) in stats['stages'].items():
+        entry = _stages.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+    for name, value in stats['counters'].items():
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def summary():
+    wall_time = time.perf_counter() - _start
+    return {
+        'wall_time': wall_time,
+        'stages': {name: {'calls': calls, 'seconds': seconds, 'mean_ms': 1000 * seconds / calls, 'share': seconds / wall_time}
+                   for name, (calls, seconds) in sorted(_stages.items(), key=lambda item: -item[1][1])},
+        'counters': dict(sorted(_counters.items())),
+        }
+
+
+def format_table(report):
+    lines = [f'{"stage":<40} {"calls":>10} {"total s":>10} {"mean ms":>10} {"% wall":>7}']
+    for name, entry in report['stages'].items():
+        lines.append(f'{name:<40} {entry["calls"]:>10} {entry["seconds"]:>10.3f} {entry["mean_ms"]:>10.3f} {entry["share"]:>7.1%}')
+    lines.append(f'{"wall time":<40} {"":>10} {report["wall_time"]:>10.3f}')
+    if report['counters']:
+        lines.append('')
+        lines.append(f'{"counter":<40} {"value":>10}')
+        for name, value in report['counters'].items():
+            lines.append(f'{name:<40} {value:>10}')
+    return '\n'.join(lines)
+
+
+def write_report(path=None):
+    """
+    - Writes the summary as JSON and returns it as a table
+    """
+    report = summary()
+    with open(path or output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return format_table(report)
+
+
+def run_cprofile(path, fn, *args):
+    """
+    - Calls fn(*args) under cProfile and dumps the statistics to path, returns the result of fn
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args)
+    finally:
+        profiler.dump_stats(path)
+
+
+def cprofile_report(paths, output_path, limit=20):
+    """
+    - Combines the statistics dumped by run_cprofile into output_path, returns the functions
+      with the largest cumulative time as text
+    """
+    import io
+    import pstats
+    stats = pstats.Stats(*paths, stream=io.StringIO())
+    stats.dump_stats(output_path)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return stats.stream.getvalue()
+
+
+def _reset():
+    _stages.clear()
+    _counters.clear()
+
+
+def _report_at_exit():
+    print(f'\nProfile written to {output_path}')
+    print(write_report())
+
+
+# forked worker processes start with empty timers, not with a copy of the parent's
+os.register_at_fork(after_in_child=_reset)
+
+# TRAFFIC_PROFILE=1 (or a path) enables profiling of any script, processes started by it inherit the variable
+if os.environ.get(ENV_VAR, '0').lower() not in ('', '0', 'false', 'no'):
+    _value = os.environ[ENV_VAR]
+    enable(_value if _value.endswith('.json') else None)
@@ -0,0 +1,123 @@
+import glob
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+import data_driver
+from episode_index import index_path
+from trajectory_io import COLUMNS, load_trajectories
+
+
+def run(directory, num_samples, chunk_size, cache_dir=None, data='grid_maker_random_directions', fmt='npz'):
+    # generate_chunk for every chunk, then the merged dataset, its index and its frames
+    os.makedirs(os.path.join(directory, 'chunks'))
+    tasks = [(data, chunk_id, start, min(start + chunk_size, num_samples), 7, os.path.join(directory, 'chunks', f'chunk_{chunk_id:05d}.{fmt}'),
+              4, cache_dir, 64, 10, 64) for chunk_id, start in enumerate(range(0, num_samples, chunk_size))]
+    results = [data_driver.generate_chunk(task) for task in tasks]
+
+    output_path = os.path.join(directory, f'dataset.{fmt}')
+    data_driver.merge_chunks([task[5] for task in tasks], output_path)
+    data_driver.concatenate_indexes([index_path(task[5]) for task in tasks], index_path(output_path))
+    with np.load(index_path(output_path)) as index:
+        features = dict(index)
+    frames = {}
+    for name in os.listdir(data_driver.FRAMES_DIR):
+        with open(os.path.join(data_driver.FRAMES_DIR, name), 'rb') as f:
+            frames[name] = f.read()
+    return load_trajectories(output_path), features, frames, results
+
+
+@pytest.mark.parametrize('data', ['grid_maker_random_directions', 'grid_maker_fixed_direction'])
+def test_cache_blocks_do_not_depend_on_chunk_size(tmp_path, monkeypatch, data):
+    # blocks smaller than the chunks of the first run and larger than those of the second one
+    monkeypatch.setattr(data_driver, 'CACHE_BLOCK', 40)
+    cache_dir = str(tmp_path / 'cache')
+
+    outputs = []
+    for run_id, chunk_size, cache in [(0, 25, None), (1, 30, cache_dir), (2, 70, cache_dir)]:
+        monkeypatch.setattr(data_driver, 'FRAMES_DIR', str(tmp_path / f'frames{run_id}'))
+        os.makedirs(data_driver.FRAMES_DIR)
+        outputs.append(run(str(tmp_path / f'run{run_id}'), 110, chunk_size, cache, data))
+
+    (dataset, features, frames, _), *cached_runs = outputs
+    assert len(dataset['collision_status']) == 110 and (len(frames) > 0) == (data == 'grid_maker_random_directions')
+    for cached_dataset, cached_features, cached_frames, results in cached_runs:
+        for column in COLUMNS:
+            np.testing.assert_array_equal(cached_dataset[column], dataset[column])
+        for feature, values in features.items():
+            np.testing.assert_array_equal(cached_features[feature], values)
+        assert cached_frames == frames
+    # the second run only reads the blocks stored by the first one
+    assert [hit for _, hit, _ in cached_runs[1][3]] == [1, 1]
+    # and the scratch directories of the blocks are removed
+    assert not [name for run_id in (1, 2) for name in os.listdir(tmp_path / f'run{run_id}' / 'chunks') if name.endswith('.blocks')]
+
+
+DATA_DRIVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data_driver.py')
+
+
+def script(directory, *args, wait=True):
+    # data_driver.py run from `directory`, its ./data paths are under it
+    os.makedirs(directory, exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(DATA_DRIVER))
+    command = [sys.executable, DATA_DRIVER, '--data', 'grid_maker_random_directions', '--seed', '5', *args]
+    if not wait:
+        return subprocess.Popen(command, cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    subprocess.run(command, cwd=directory, env=env, check=True, capture_output=True)
+
+
+def outputs(directory):
+    # bytes of the dataset, its index and every frame
+    files = {}
+    for path in sorted(glob.glob(os.path.join(directory, 'data', '**', '*.*'), recursive=True)):
+        with open(path, 'rb') as f:
+            files[os.path.relpath(path, directory)] = f.read()
+    return files
+
+
+def test_output_does_not_depend_on_workers_and_chunk_size(tmp_path):
+    expected = None
+    for run_id, (workers, chunk_size) in enumerate([(1, 1000), (2, 70), (1, 45)]):
+        directory = str(tmp_path / f'run{run_id}')
+        script(directory, '--num_samples', '300', '--workers', str(workers), '--chunk_size', str(chunk_size))
+        files = outputs(directory)
+        assert 'data/grid_dataset/grid_dataset.npz' in files and any(name.endswith('.png') for name in files)
+        if expected is None:
+            expected = files
+        assert files == expected
+
+
+def test_resumed_run_gives_the_same_output(tmp_path):
+    script(str(tmp_path / 'whole'), '--num_samples', '3000', '--chunk_size', '100', '--pipeline', 'False')
+
+    # killed once a few chunks are complete
+    directory = str(tmp_path / 'killed')
+    chunks = os.path.join(directory, 'data', 'grid_dataset', 'grid_dataset_chunks')
+    process = script(directory, '--num_samples', '3000', '--chunk_size', '100', '--pipeline', 'False', wait=False)
+    deadline = time.time() + 60
+    while len(glob.glob(os.path.join(chunks, '*.index.npz'))) < 3 and process.poll() is None and time.time() < deadline:
+        time.sleep(0.01)
+    if process.poll() is not None:
+        pytest.skip('the run completed before it could be killed')
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    completed = len(glob.glob(os.path.join(chunks, '*.index.npz')))
+    assert 3 <= completed < 30 and not os.path.exists(os.path.join(directory, 'data', 'grid_dataset', 'grid_dataset.npz'))
+
+    # the completed chunks are kept, the others generated again
+    script(directory, '--num_samples', '3000', '--chunk_size', '100', '--pipeline', 'False', '--resume', 'True')
+    assert outputs(directory) == outputs(str(tmp_path / 'whole'))
+
+
+def test_pipeline_gives_the_same_output(tmp_path):
+    # run_pipeline (the default with one worker) against the chunks run one after another, with a small queue
+    script(str(tmp_path / 'sequential'), '--num_samples', '500', '--chunk_size', '60', '--pipeline', 'False')
+    script(str(tmp_path / 'pipeline'), '--num_samples', '500', '--chunk_size', '60', '--pipeline', 'True', '--queue_size', '1')
+    files = outputs(str(tmp_path / 'pipeline'))
+    assert any(name.endswith('.png') for name in files)
+    assert files == outputs(str(tmp_path / 'sequential'))
@@ -0,0 +1,65 @@
+import json
+import os
+
+import numpy as np
+
+from dataset_shards import MANIFEST_NAME, add_shard, compact, merge, read_manifest
+from episode_index import EpisodeIndex, build_index, compute_features, episode_modes, index_path, save_index
+from grid_maker import GridMaker
+from trajectory_io import COLUMNS, concatenate_files, from_padded, load_trajectories, save_trajectories
+
+DATA = 'grid_maker_random_directions'
+
+
+def write_dataset(path, n, seed, index=True):
+    # n episodes of both modes, like a data_driver.py run, with or without its index
+    object1, object2, lengths, collisions = GridMaker(10, 3).generate_batch(n, max_length=6, rng=seed)
+    save_trajectories(path, from_padded(object1, object2, lengths, 10, collisions))
+    if index:
+        save_index(index_path(path), compute_features(object1, object2, lengths, 10, collisions, episode_modes(DATA, 0, n)))
+    return path
+
+
+def test_append_merge_compact_round_trip(tmp_path):
+    shards_dir, other_dir = tmp_path / 'shards', tmp_path / 'other'
+    os.makedirs(shards_dir), os.makedirs(other_dir)
+    manifest, other_manifest = str(shards_dir / MANIFEST_NAME), str(other_dir / MANIFEST_NAME)
+
+    # a shard written by data_driver.py --append, a file without index and the shard of another manifest
+    add_shard(manifest, write_dataset(str(shards_dir / 'shard_00000.npz'), 30, 1), data=DATA, seed=1)
+    loose = write_dataset(str(tmp_path / 'loose.npz'), 20, 2, index=False)
+    add_shard(other_manifest, write_dataset(str(other_dir / 'shard_00000.npz'), 25, 3), data=DATA, seed=3)
+    merge(manifest, [loose, other_manifest])
+
+    shards = read_manifest(manifest)['shards']
+    assert [shard['num_samples'] for shard in shards] == [30, 20, 25]
+    assert [shard.get('seed') for shard in shards] == [1, None, 3]
+    # episode ids follow the shard order
+    paths = [str(shards_dir / 'shard_00000.npz'), loose, str(other_dir / 'shard_00000.npz')]
+    concatenate_files(paths, str(tmp_path / 'expected.npz'))
+    expected = load_trajectories(str(tmp_path / 'expected.npz'))
+    union = load_trajectories(manifest)
+    for column in COLUMNS:
+        np.testing.assert_array_equal(np.asarray(union[column]), expected[column])
+
+    entry = compact(manifest)
+    assert entry['num_samples'] == 75 and len(entry['compacted_from']) == 3
+    assert len(read_manifest(manifest)['shards']) == 1
+    compacted = load_trajectories(manifest)
+    for column in COLUMNS:
+        np.testing.assert_array_equal(compacted[column], expected[column])
+
+    # the index of the loose file is built, the others are copied
+    index = EpisodeIndex.load(manifest)
+    loose_features = build_index(loose)
+    assert len(index) == 75
+    for feature, values in loose_features.items():
+        np.testing.assert_array_equal(index[feature][30:50], values)
+    with np.load(index_path(paths[2])) as other_index:
+        np.testing.assert_array_equal(index['mode'][50:], other_index['mode'])
+
+    # only the shards next to the manifest are removed, with their indexes
+    assert sorted(os.listdir(shards_dir)) == sorted([MANIFEST_NAME, entry['path'], os.path.basename(index_path(entry['path']))])
+    assert os.path.exists(loose) and os.path.exists(paths[2])
+    with open(manifest) as f:
+        assert json.load(f)['shards'][0]['compacted_from'][0]['seed'] == 1
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from episode_index import FEATURES, EpisodeIndex, compute_features, concatenate_indexes, save_index
+
+
+def test_concatenate_indexes_streams_the_same_features(tmp_path):
+    rng = np.random.default_rng(3)
+    paths = []
+    for part, n in enumerate([5, 0, 7]):
+        positions = rng.integers(0, 10, (2, n, 4, 2))
+        features = compute_features(positions[0], positions[1], rng.integers(1, 5, n), 10, rng.integers(0, 2, n), np.zeros(n))
+        paths.append(str(tmp_path / f'part{part}.index.npz'))
+        save_index(paths[-1], features)
+
+    features = concatenate_indexes(paths)
+    assert len(features['length']) == 12
+    concatenate_indexes(paths, str(tmp_path / 'all.index.npz'))
+    with np.load(tmp_path / 'all.index.npz') as index:
+        assert sorted(index.files) == sorted(FEATURES)
+        for feature, values in features.items():
+            assert index[feature].dtype == values.dtype
+            np.testing.assert_array_equal(index[feature], values)
+
+
+def test_compute_features_of_known_episodes():
+    # grid 10, (row, column) positions padded to 5 steps
+    object1 = [
+        [(5, 0), (5, 1), (5, 2), (5, 3), (5, 4)],  # right along row 5
+        [(0, 4), (1, 4), (2, 4), (3, 4), (4, 4)],  # down along column 4
+        [(9, 9), (0, 0), (0, 0), (0, 0), (0, 0)],  # one step, then the same padding as object2
+        ]
+    object2 = [
+        [(5, 7), (5, 6), (5, 5), (5, 4), (5, 3)],  # left, they cross between steps 3 and 4
+        [(8, 4), (7, 4), (6, 4), (5, 4), (4, 4)],  # up, they meet at step 4
+        [(0, 0), (0, 0), (0, 0), (0, 0), (0, 0)],
+        ]
+    features = compute_features(object1, object2, [5, 5, 1], 10, [0, 1, 0], [1, 0, 2])
+
+    assert sorted(features) == sorted(FEATURES)
+    np.testing.assert_array_equal(features['length'], [5, 5, 1])
+    np.testing.assert_array_equal(features['collision_step'], [-1, 4, -1])
+    np.testing.assert_allclose(features['min_distance'], [1, 0, np.sqrt(162)], rtol=1e-6)
+    # left, right, top, bottom = 0, 1, 2, 3
+    np.testing.assert_array_equal(features['start_side'], [[3, 2], [0, 1], [1, 0]])
+    # up, down, left, right = 0, 1, 2, 3, -1 without a first move
+    np.testing.assert_array_equal(features['direction'], [[3, 2], [1, 0], [-1, -1]])
+    np.testing.assert_array_equal(features['mode'], [1, 0, 2])
+    np.testing.assert_array_equal(features['collision_status'], [0, 1, 0])
+
+
+def class_counts(index, ids):
+    values, counts = np.unique(index['collision_status'][ids], return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+
+def test_stratified_sample_balances_the_classes():
+    # 80 episodes without collision, 20 with one
+    status = np.repeat([0, 1], [80, 20])
+    index = EpisodeIndex({'collision_status': status, 'length': np.arange(100) % 10})
+    rng = np.random.default_rng(0)
+
+    ids = index.stratified_sample(30, rng=rng)
+    assert len(np.unique(ids)) == 30 and class_counts(index, ids) == {0: 15, 1: 15}
+    # the rounding remainder goes to the first class
+    assert class_counts(index, index.stratified_sample(7, rng=rng)) == {0: 4, 1: 3}
+    assert class_counts(index, index.stratified_sample(20, weights={0: 3, 1: 1}, rng=rng)) == {0: 15, 1: 5}
+    assert class_counts(index, index.stratified_sample(10, weights={1: 1}, rng=rng)) == {1: 10}
+
+    # only among the episodes of `where`, by an array of bins
+    short = index['length'] < 5
+    ids = index.stratified_sample(10, by=index['length'] < 2, where=short, rng=rng)
+    assert short[ids].all()
+    assert (index['length'][ids] < 2).sum() == 5
+
+    with pytest.raises(ValueError):
+        index.stratified_sample(50, rng=rng)
+    ids = index.stratified_sample(50, rng=rng, replace=True)
+    assert class_counts(index, ids) == {0: 25, 1: 25}
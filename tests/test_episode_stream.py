@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from episode_stream import EpisodeStream
+from generation import generate_samples
+from grid_renderer import rasterize
+
+
+@pytest.mark.parametrize('grid_size', [10, 30])
+def test_batch_uses_grid_size(grid_size):
+    # batch b is samples [b * batch_size, (b + 1) * batch_size) of the dataset of the same grid size
+    stream = EpisodeStream(batch_size=16, seed=4, frames=True, grid_size=grid_size)
+    batch = stream.batch(2)
+    object1, object2, lengths, collisions = generate_samples('grid_maker_random_directions', 32, 48, stream.seed, grid_size)
+    np.testing.assert_array_equal(batch['object1_action'], object1)
+    np.testing.assert_array_equal(batch['object2_action'], object2)
+    np.testing.assert_array_equal(batch['lengths'], lengths)
+    assert batch['frames'].shape[-2:] == (grid_size, grid_size)
+
+
+def test_frames_of_large_grids_are_cropped():
+    stream = EpisodeStream(batch_size=8, seed=4, frames=True, grid_size=100, render_window=16)
+    batch = stream.batch(0)
+    assert batch['frames'].shape == batch['mask'].shape + (16, 16)
+    # the crops of the whole frames, around the collision cell of the colliding episodes
+    full = rasterize(batch['object1_action'], batch['object2_action'], batch['lengths'], 100)
+    for i, (x, y) in enumerate(batch['frame_origins']):
+        np.testing.assert_array_equal(batch['frames'][i], full[i, :, y:y + 16, x:x + 16])
+        if batch['collision_status'][i]:
+            last = batch['object1_action'][i, batch['lengths'][i] - 1]
+            assert np.all((last >= (x, y)) & (last < (x + 16, y + 16)))
+
+
+def test_unbounded_stream_stops_at_the_last_episode_ids():
+    # the ids of a third batch would be over 2^32
+    stream = EpisodeStream(batch_size=2 ** 31, seed=0)
+    stream.batch = lambda b: b
+    assert list(stream) == [0, 1]
@@ -0,0 +1,144 @@
+import json
+from array import array
+
+import numpy as np
+import pytest
+
+import profiling
+from episode_rng import EpisodeRNG
+from grid_maker import (BATCH_MODES, SPARSE_GRID_SIZE, GridMaker, SparseGrid, Trajectory, coordinate_dtype, placement_index,
+                        shared_cells)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2, 12345])
+def test_fix_direction_closed_form_matches_step_loop(seed):
+    # the closed form of fix_direction_action has to return the episodes of the step by step version
+    for grid_size in range(3, 201):
+        grid_maker = GridMaker(grid_size=grid_size, min_distance=min(3, grid_size - 1))
+        analytic = grid_maker.generate_batch(200, mode='fix_direction_action', rng=seed, analytic=True)
+        steps = grid_maker.generate_batch(200, mode='fix_direction_action', rng=seed, analytic=False)
+        for expected, actual in zip(steps, analytic):
+            np.testing.assert_array_equal(actual, expected, err_msg=f'grid_size={grid_size}')
+            assert actual.dtype == expected.dtype
+
+
+@pytest.mark.parametrize('mode', BATCH_MODES)
+@pytest.mark.parametrize('grid_size', [3, 10, 50, SPARSE_GRID_SIZE + 44])
+def test_one_episode_methods_match_generate_batch(mode, grid_size):
+    # episode i of generate_batch(rng=rng) is the episode the one-episode methods return with (rng, row=i)
+    grid_maker = GridMaker(grid_size=grid_size, min_distance=min(3, grid_size - 1))
+    n = 300
+    rng = EpisodeRNG(7, n)
+    max_length = np.arange(n) % 12
+    object1, object2, lengths, collisions = grid_maker.generate_batch(n, mode=mode, randomness_factor=0.3, max_length=max_length, rng=rng)
+
+    for i in range(n):
+        if mode == 'fix_direction_action':
+            blue, red, collision = grid_maker.fix_direction_action(rng=rng, row=i)
+            collision = collision[0]
+        else:
+            start = grid_maker.place_rectangles(rng=rng, row=i)
+            if mode == 'find_path':
+                blue, red = grid_maker.find_path(*start, randomness_factor=0.3, rng=rng, row=i)
+                collision = 1
+            else:
+                blue, red = grid_maker.find_non_collision_path(*start, max_length=int(max_length[i]), randomness_factor=0.3, rng=rng, row=i)
+                collision = 0
+        np.testing.assert_array_equal(blue.to_numpy(), object1[i, :lengths[i]], err_msg=f'episode {i}')
+        np.testing.assert_array_equal(red.to_numpy(), object2[i, :lengths[i]], err_msg=f'episode {i}')
+        assert collision == collisions[i]
+
+
+def test_stream_continues_after_batch_calls():
+    # the one-episode methods draw the next episode of the GridMaker stream, also after a batch moved past its block
+    grid_maker = GridMaker(grid_size=10, min_distance=3, seed=5)
+    grid_maker.place_rectangles()
+    grid_maker.generate_batch(2000)
+    expected = GridMaker(grid_size=10, min_distance=3).place_rectangles(rng=EpisodeRNG(5, [2001]), row=0)
+    assert grid_maker.place_rectangles() == expected
+
+
+@pytest.mark.parametrize('mode', ['find_path', 'find_non_collision_path'])
+def test_calls_without_rng_match_generate_batch(mode):
+    # without rng, find_path(*place_rectangles()) is one episode of the GridMaker stream: the episodes of generate_batch
+    n = 600
+    grid_maker = GridMaker(grid_size=10, min_distance=3, seed=9)
+    object1, object2, lengths, _ = GridMaker(grid_size=10, min_distance=3, seed=9).generate_batch(n, mode=mode, randomness_factor=0.3, max_length=7)
+    for i in range(n):
+        if mode == 'find_path':
+            blue, red = grid_maker.find_path(*grid_maker.place_rectangles(), randomness_factor=0.3)
+        else:
+            blue, red = grid_maker.find_non_collision_path(*grid_maker.place_rectangles(), max_length=7, randomness_factor=0.3)
+        np.testing.assert_array_equal(blue.to_numpy(), object1[i, :lengths[i]], err_msg=f'episode {i}')
+        np.testing.assert_array_equal(red.to_numpy(), object2[i, :lengths[i]], err_msg=f'episode {i}')
+    assert grid_maker.episodes == n
+
+    # start positions that place_rectangles() did not return start a new episode
+    grid_maker.find_path((0, 0), (5, 5))
+    assert grid_maker.episodes == n + 1
+
+
+def test_coordinate_dtype_holds_large_grids():
+    assert [coordinate_dtype(size) for size in (127, 128, 32767, 32768, 100000)] == [np.int8, np.int16, np.int16, np.int32, np.int32]
+    # coordinates over the int16 range, in the Trajectory buffers and the batch arrays
+    grid_maker = GridMaker(grid_size=40000, min_distance=3)
+    object1, object2, _ = grid_maker.fix_direction_action(rng=EpisodeRNG(3, 1))
+    object1_actions, object2_actions, lengths, _ = grid_maker.generate_batch(1, mode='fix_direction_action', rng=EpisodeRNG(3, 1))
+    assert object1_actions.dtype == np.int32
+    np.testing.assert_array_equal(object1.to_numpy(), object1_actions[0, :lengths[0]])
+    np.testing.assert_array_equal(object2.to_numpy(), object2_actions[0, :lengths[0]])
+
+
+def test_trajectory_pair_shares_one_array():
+    blue, red = Trajectory.pair(array('b', [1, 2, 3, 4, 9, 9]), array('b', [5, 6, 7, 8, 9, 9]), 2)
+    assert blue.coordinates is red.coordinates and len(blue.coordinates) == 8
+    assert blue == [(1, 2), (3, 4)] and red == [(5, 6), (7, 8)]
+    assert list(red) == [(5, 6), (7, 8)] and red[-1] == (7, 8) and red[:1] == [(5, 6)]
+    np.testing.assert_array_equal(red.to_numpy(), [[5, 6], [7, 8]])
+    # + and tolist() give lists like the old return values
+    assert blue + red == [(1, 2), (3, 4), (5, 6), (7, 8)] and [(0, 0)] + red == [(0, 0), (5, 6), (7, 8)]
+    assert red + [(0, 0)] == [(5, 6), (7, 8), (0, 0)] and json.dumps(red.tolist()) == '[[5, 6], [7, 8]]'
+    # growing one of them does not touch the other one
+    blue.append(0, 1)
+    assert blue == [(1, 2), (3, 4), (0, 1)] and red == [(5, 6), (7, 8)]
+
+
+def test_placement_retries_are_counted(monkeypatch):
+    # the rejected dy draws of RowPlacementIndex, the same for sample and sample_one
+    monkeypatch.setattr(profiling, 'enabled', True)
+    profiling.collect()
+    index = placement_index(SPARSE_GRID_SIZE + 44, 3)
+    rng = EpisodeRNG(11, 500)
+    index.sample(len(rng), rng)
+    batch_retries = profiling.collect()['counters']['placement_retries']
+    for row in range(len(rng)):
+        index.sample_one(rng, row)
+    assert profiling.collect()['counters']['placement_retries'] == batch_retries > 0
+
+
+def test_sparse_grid_reads_like_the_dense_grid():
+    grid_maker = GridMaker(grid_size=SPARSE_GRID_SIZE + 44, min_distance=3)
+    grid_maker.create_grid()
+    grid = grid_maker.grid
+    assert isinstance(grid, SparseGrid) and grid.shape == (300, 300)
+    grid[3, 4], grid[(299, 0)] = 2, 1
+    grid[5, 5] = 0
+    assert grid[3, 4] == 2 and grid[0, 0] == 0 and len(grid) == 2
+    assert sorted(zip(*grid.nonzero())) == [(3, 4), (299, 0)]
+    np.testing.assert_array_equal(grid.window(2, 3, 3), [[0, 0, 0], [0, 2, 0], [0, 0, 0]])
+    dense = np.asarray(grid)
+    assert dense.shape == (300, 300) and dense[3, 4] == 2 and dense[299, 0] == 1 and dense.sum() == 3
+    with pytest.raises(IndexError):
+        grid[300, 0] = 1
+    grid.fill(0)
+    assert len(grid) == 0
+    # small grids stay dense
+    grid_maker = GridMaker(grid_size=10, min_distance=3)
+    grid_maker.create_grid()
+    assert isinstance(grid_maker.grid, np.ndarray) and grid_maker.grid.shape == (10, 10)
+
+
+def test_shared_cells():
+    positions = np.array([[0, 1], [5, 5], [0, 1], [1, 0], [5, 5], [5, 5], [9999, 9999]])
+    np.testing.assert_array_equal(shared_cells(positions, 10000), [True, True, True, False, True, True, False])
+    assert shared_cells(np.zeros((0, 2)), 10).shape == (0,)
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from grid_renderer import GRID_LINE, PALETTE, contact_sheet, rasterize, render, upscale, write_episodes, write_files
+
+
+def episodes(n=5, steps=4, grid_size=4):
+    rng = np.random.default_rng(1)
+    positions = rng.integers(0, grid_size, (2, n, steps, 2))
+    return positions[0], positions[1], np.arange(n) % steps + 1
+
+
+def test_write_files_creates_the_directory(tmp_path):
+    paths = write_files(str(tmp_path / 'frames'), [('a.png', b'1'), ('b.png', b'22')])
+    assert [os.path.basename(path) for path in paths] == ['a.png', 'b.png']
+    assert open(paths[1], 'rb').read() == b'22'
+
+
+def test_contact_sheet_lays_out_the_frames():
+    object1, object2, lengths = episodes()
+    images = upscale(rasterize(object1, object2, lengths, 4), 8)
+    # 32 pixel frames and 2 pixel gray separators
+    tile = 34
+
+    # about square by default: one 4-frame strip per row
+    sheet = contact_sheet(object1, object2, lengths, 4, cell_size=8)
+    assert sheet.shape == (5 * tile, 4 * tile)
+    tiles = sheet.reshape(5, tile, 4, tile).transpose(0, 2, 1, 3)
+    for k, length in enumerate(lengths):
+        for j in range(4):
+            if j < length:
+                np.testing.assert_array_equal(tiles[k, j, :32, :32], images[k, j])
+                assert (tiles[k, j, 32:] == GRID_LINE).all() and (tiles[k, j, :, 32:] == GRID_LINE).all()
+            else:
+                assert (tiles[k, j] == GRID_LINE).all()
+
+    # two strips per row, the last one padded, and only the first 2 frames
+    sheet = contact_sheet(object1, object2, lengths, 4, cell_size=8, max_frames=2, columns=2)
+    assert sheet.shape == (3 * tile, 2 * 2 * tile)
+    tiles = sheet.reshape(3, tile, 2, 2, tile).transpose(0, 2, 3, 1, 4).reshape(6, 2, tile, tile)
+    np.testing.assert_array_equal(tiles[3, 1, :32, :32], images[3, 1])
+    assert (tiles[5] == GRID_LINE).all()
+
+
+def test_write_episodes_gifs_and_sheets(tmp_path):
+    object1, object2, lengths = episodes()
+    write_episodes(object1, object2, lengths, 4, str(tmp_path / 'gif'), fmt='gif', sample_ids=np.arange(10, 15), cell_size=8, batch_size=2)
+    assert sorted(os.listdir(tmp_path / 'gif')) == [f'sample{sample_id}.gif' for sample_id in range(10, 15)]
+
+    expected = render(rasterize(object1, object2, lengths, 4), 8)
+    for k, length in enumerate(lengths):
+        with Image.open(tmp_path / 'gif' / f'sample{10 + k}.gif') as gif:
+            # one frame per recorded step
+            assert gif.size == (32, 32) and gif.n_frames == length
+            for j in range(length):
+                gif.seek(j)
+                np.testing.assert_array_equal(np.asarray(gif.convert('RGB')), expected[k, j])
+
+    write_episodes(object1, object2, lengths, 4, str(tmp_path / 'sheet'), fmt='sheet', cell_size=8, batch_size=3)
+    assert sorted(os.listdir(tmp_path / 'sheet')) == ['sheet1-3.png', 'sheet4-5.png']
+    with Image.open(tmp_path / 'sheet' / 'sheet1-3.png') as image:
+        sheet = contact_sheet(object1[:3], object2[:3], lengths[:3], 4, cell_size=8)
+        np.testing.assert_array_equal(np.asarray(image.convert('RGB')), PALETTE[sheet])
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+
+from grid_renderer import rasterize
+from preprocessing import build, load_preprocessed, preprocess
+from trajectory_io import COLUMNS, from_padded, load_trajectories, save_trajectories, to_padded
+
+
+def random_dataset(n, steps=6, grid_size=10, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = rng.integers(0, grid_size, (2, n, steps, 2))
+    # lengths with ties, and a full-length episode
+    lengths = rng.integers(1, steps + 1, n)
+    lengths[0] = steps
+    return from_padded(positions[0], positions[1], lengths, grid_size, rng.integers(0, 2, n))
+
+
+def test_frames_of_large_grids_are_cropped(tmp_path):
+    # one colliding episode far from the origin, one that does not collide
+    object1 = np.array([[[90, 40], [91, 40], [92, 40]], [[3, 4], [3, 5], [0, 0]]])
+    object2 = np.array([[[94, 40], [93, 40], [92, 40]], [[60, 70], [61, 70], [0, 0]]])
+    dataset = from_padded(object1, object2, [3, 2], 100, [1, 0])
+    build(dataset, str(tmp_path), layout='padded', render_window=16)
+    arrays = load_preprocessed(str(tmp_path))
+
+    assert arrays['frames'].shape == (2, 3, 2, 16, 16)
+    # centered on the collision cell, and on the middle of the last positions
+    np.testing.assert_array_equal(arrays['frame_origins'], [[84, 32], [24, 29]])
+    full = rasterize(object1, object2, [3, 2], 100)
+    for i, (x, y) in enumerate(arrays['frame_origins']):
+        crop = full[i, :, y:y + 16, x:x + 16]
+        # channel 0 is object 1 (blue, green on the collision cell), channel 1 object 2
+        np.testing.assert_array_equal(arrays['frames'][i, :, 0] == 1, (crop == 2) | (crop == 3))
+        np.testing.assert_array_equal(arrays['frames'][i, :, 1] == 1, (crop == 1) | (crop == 3))
+
+
+def test_layouts_round_trip(tmp_path):
+    dataset = random_dataset(20)
+    path = str(tmp_path / 'dataset.npz')
+    save_trajectories(path, dataset)
+    padded, _, _ = preprocess(path, layout='padded')
+    packed, _, _ = preprocess(path, layout='packed')
+    object1, object2, lengths = to_padded(dataset, np.arange(20))
+
+    # padded: the episodes of the dataset, padded like to_padded
+    np.testing.assert_array_equal(padded['lengths'], lengths)
+    np.testing.assert_array_equal(padded['mask'], np.arange(6) < lengths[:, None])
+    np.testing.assert_array_equal(padded['positions'][:, :, 0], object1)
+    np.testing.assert_array_equal(padded['positions'][:, :, 1], object2)
+    back = from_padded(padded['positions'][:, :, 0], padded['positions'][:, :, 1], padded['lengths'], padded['grid_size'], padded['collision_status'])
+    for column in COLUMNS:
+        np.testing.assert_array_equal(back[column], dataset[column])
+    # channel 0 is object 1 (blue, green on a shared cell), channel 1 object 2
+    full = rasterize(object1, object2, lengths, 10)
+    np.testing.assert_array_equal(padded['frames'][:, :, 0] == 1, (full == 2) | (full == 3))
+    np.testing.assert_array_equal(padded['frames'][:, :, 1] == 1, (full == 1) | (full == 3))
+
+    # packed: step t holds the first batch_sizes[t] episodes of sorted_indices, longest first
+    sorted_indices = packed['sorted_indices']
+    assert (np.diff(lengths[sorted_indices]) <= 0).all()
+    np.testing.assert_array_equal(sorted_indices[packed['unsorted_indices']], np.arange(20))
+    np.testing.assert_array_equal(packed['batch_sizes'], [(lengths > t).sum() for t in range(6)])
+    starts = np.concatenate([[0], np.cumsum(packed['batch_sizes'])])
+    for t in range(6):
+        episodes = sorted_indices[:packed['batch_sizes'][t]]
+        rows = slice(starts[t], starts[t + 1])
+        for name in ('positions', 'features', 'frames'):
+            np.testing.assert_array_equal(packed[name][rows], padded[name][episodes, t])
+    for name in ('lengths', 'collision_status', 'grid_size'):
+        np.testing.assert_array_equal(packed[name], padded[name])
+
+
+def test_preprocess_reuses_the_cached_arrays(tmp_path):
+    path = str(tmp_path / 'dataset.npz')
+    save_trajectories(path, random_dataset(20))
+    cache_dir = str(tmp_path / 'cache')
+
+    arrays, directory, built = preprocess(path, cache_dir=cache_dir)
+    assert built and os.path.dirname(directory) == cache_dir
+    cached, cached_directory, built = preprocess(path, cache_dir=cache_dir)
+    assert not built and cached_directory == directory
+    for name, array in arrays.items():
+        np.testing.assert_array_equal(cached[name], array)
+
+    # other parameters are another entry of the cache
+    _, packed_directory, built = preprocess(path, layout='packed', cache_dir=cache_dir)
+    assert built and packed_directory != directory
+    assert not preprocess(path, layout='packed', cache_dir=cache_dir)[2]
+
+    # a dataset written again is preprocessed again
+    save_trajectories(path, random_dataset(7, seed=1))
+    arrays, new_directory, built = preprocess(path, cache_dir=cache_dir)
+    assert built and new_directory != directory and len(arrays['lengths']) == 7
+    np.testing.assert_array_equal(arrays['lengths'], np.diff(load_trajectories(path)['offsets']))
+    assert sorted(os.listdir(cache_dir)) == sorted(os.path.basename(d) for d in (directory, packed_directory, new_directory))
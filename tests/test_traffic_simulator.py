@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from traffic_simulator import OBSTACLE, PEDESTRIAN, VEHICLE, TrafficSimulator, _pairwise_collisions
+
+
+def test_sparse_detect_collisions_matches_dense():
+    # few cells, so that many entities share one
+    rng = np.random.default_rng(0)
+    dense, sparse = TrafficSimulator(8, 30, 0, 0, sparse=False), TrafficSimulator(8, 30, 0, 0, sparse=True)
+    for _ in range(20):
+        positions = rng.integers(0, 8, (30, 2))
+        pairs = dense.detect_collisions(positions)
+        assert len(pairs) > 0
+        np.testing.assert_array_equal(sparse.detect_collisions(positions), pairs)
+
+
+def manhattan(a, b):
+    return np.abs(a[:, None, :] - b[None, :, :]).sum(axis=2)
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_simulation_follows_the_traffic_rules(sparse):
+    simulator = TrafficSimulator(20, num_vehicles=40, num_pedestrians=30, num_obstacles=20, sparse=sparse)
+    trajectory, collisions = simulator.simulate(30, rng=np.random.default_rng(1))
+    trajectory = trajectory.astype(np.int64)
+    obstacles, vehicles, pedestrians = (np.flatnonzero(simulator.types == kind) for kind in (OBSTACLE, VEHICLE, PEDESTRIAN))
+    assert trajectory.shape == (30, 90, 2) and ((trajectory >= 0) & (trajectory < 20)).all()
+
+    # placement: one entity per cell, pedestrians away from the obstacles and the other pedestrians
+    start = trajectory[0]
+    assert len(np.unique(start[:, 0] * 20 + start[:, 1])) == len(start)
+    assert (manhattan(start[pedestrians], start[obstacles]) > 1).all()
+    assert (manhattan(start[pedestrians], start[pedestrians]) + 2 * np.eye(len(pedestrians), dtype=int) > 1).all()
+
+    # obstacles never move, vehicles and pedestrians move in their 3x3 neighborhood
+    assert (trajectory[:, obstacles] == trajectory[0, obstacles]).all()
+    assert (np.abs(np.diff(trajectory, axis=0)) <= 1).all()
+    moved = False
+    for t in range(1, len(trajectory)):
+        before, after = trajectory[t - 1], trajectory[t]
+        moved |= bool((before[vehicles] != after[vehicles]).any())
+        # pedestrians never step on an obstacle or on the next cell of another pedestrian
+        assert (manhattan(after[pedestrians], after[obstacles]) > 0).all()
+        assert len(np.unique(after[pedestrians, 0] * 20 + after[pedestrians, 1])) == len(pedestrians)
+        # nor next to the current cell of another pedestrian, unless they stay
+        stayed = (before[pedestrians] == after[pedestrians]).all(axis=1)
+        near = manhattan(after[pedestrians], before[pedestrians]) <= 1
+        np.fill_diagonal(near, False)
+        assert not near[~stayed].any()
+        # collisions are the pairs on the same cell
+        assert sorted(map(tuple, collisions[t].tolist())) == _pairwise_collisions(after)
+    assert moved
+
+
+def test_detect_collisions_matches_pairwise():
+    rng = np.random.default_rng(2)
+    for sparse in (False, True):
+        simulator = TrafficSimulator(6, 25, 0, 5, sparse=sparse)
+        for _ in range(20):
+            positions = rng.integers(0, 6, (30, 2))
+            assert sorted(map(tuple, simulator.detect_collisions(positions).tolist())) == _pairwise_collisions(positions)
+
+
+def test_sparse_simulation_matches_dense():
+    trajectories = [TrafficSimulator(30, 50, 50, 20, sparse=sparse).simulate(15, rng=np.random.default_rng(3))[0] for sparse in (False, True)]
+    np.testing.assert_array_equal(trajectories[0], trajectories[1])
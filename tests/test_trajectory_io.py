@@ -0,0 +1,34 @@
+import numpy as np
+
+from episode_index import FEATURES, concatenate_indexes
+from trajectory_io import COLUMNS, concatenate_files, from_padded, load_trajectories, save_trajectories
+
+
+def test_concatenate_no_files(tmp_path):
+    # a dataset and an index without episodes, with the columns of non-empty ones
+    path = str(tmp_path / 'empty.npz')
+    concatenate_files([], path)
+    for mmap in (False, True):
+        dataset = load_trajectories(path, mmap=mmap)
+        assert sorted(dataset) == sorted(COLUMNS)
+        assert dataset['object1_action'].shape == (0, 2) and dataset['object1_action'].dtype == np.int8
+        np.testing.assert_array_equal(dataset['offsets'], [0])
+        assert len(dataset['collision_status']) == 0
+
+    features = concatenate_indexes([])
+    assert sorted(features) == sorted(FEATURES)
+    assert all(len(values) == 0 for values in features.values())
+    concatenate_indexes([], str(tmp_path / 'empty.index.npz'))
+    with np.load(tmp_path / 'empty.index.npz') as index:
+        assert sorted(index.files) == sorted(FEATURES)
+        assert all(index[feature].dtype == values.dtype and index[feature].shape == values.shape for feature, values in features.items())
+
+
+def test_large_grid_coordinates(tmp_path):
+    # coordinates and grid sizes over the int16 range are kept
+    object1_actions = np.array([[[0, 40000 - 1], [1, 40000 - 1]]])
+    path = str(tmp_path / 'large.npz')
+    save_trajectories(path, from_padded(object1_actions, object1_actions[:, ::-1], [2], 40000, [0]))
+    dataset = load_trajectories(path)
+    np.testing.assert_array_equal(dataset['object1_action'], object1_actions[0])
+    np.testing.assert_array_equal(dataset['grid_size'], [40000])
@@ -0,0 +1,334 @@
+# Multi-agent traffic simulator
+#
+# Vehicles, pedestrians and fixed obstacles moving on a grid, the rules of the SyntheticDataGenerator
+# notebooks in shubham/ ("grid-obstacle fixed-no collision"):
+#   - obstacles never move
+#   - vehicles take a random move of the 3x3 neighborhood (staying included), they may collide with anything
+#   - pedestrians take a random move that does not end on an obstacle, on the next cell of another pedestrian,
+#     or next to (Manhattan distance <= 1) the current cell of another pedestrian, and stay if there is none
+#
+# Positions and types of all entities are NumPy arrays and a step is a few array operations,
+# neighborhood and collision checks go through occupancy grids allocated once, so a step is O(n)
+# instead of the O(n^2) pairwise loops of the notebooks. Runs with hundreds or thousands of
+# entities on grids of 100x100 and larger, see `python traffic_simulator.py --help` for the benchmark.
+# Grids larger than SPARSE_GRID_SIZE (e.g. 10000x10000) are sparse: the occupied cells are kept as sorted
+# arrays of cell keys instead of dense grids, so memory grows with the number of entities, not with the area.
+
+import argparse
+import time
+import numpy as np
+from grid_maker import SPARSE_GRID_SIZE, GridMaker, coordinate_dtype, shared_cells
+
+# Entity types, in the order the entities are placed (and stored)
+OBSTACLE, VEHICLE, PEDESTRIAN = 0, 1, 2
+ENTITY_TYPES = ('obstacle', 'vehicle', 'pedestrian')
+
+# Moves of the 3x3 neighborhood, (dx, dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1]
+NEIGHBORHOOD = np.array([(dx, dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1]], dtype=np.int64)
+STAY = 4
+
+# Cells at Manhattan distance <= 1 of a cell
+CROSS = np.array([(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int64)
+
+
+class TrafficSimulator(GridMaker):
+    """
+    - GridMaker with any number of vehicles, pedestrians and obstacles instead of two objects
+    - Entities are stored by type: obstacles first, then vehicles, then pedestrians,
+      `types` gives the type of every entity
+    - sparse: cell lookups through sorted arrays of the occupied cells instead of dense occupancy grids,
+      by default for grids over SPARSE_GRID_SIZE. Both give the same simulations.
+    """
+    def __init__(self, grid_size=100, num_vehicles=100, num_pedestrians=100, num_obstacles=50, flag=False, sparse=None):
+        super().__init__(grid_size, min_distance=0, flag=flag)
+        self.num_vehicles = num_vehicles
+        self.num_pedestrians = num_pedestrians
+        self.num_obstacles = num_obstacles
+
+        self.types = np.repeat(np.array([OBSTACLE, VEHICLE, PEDESTRIAN], dtype=np.int8), [num_obstacles, num_vehicles, num_pedestrians])
+        self.vehicles = np.flatnonzero(self.types == VEHICLE)
+        self.pedestrians = np.flatnonzero(self.types == PEDESTRIAN)
+
+        # occupancy grids (flattened, cell x * grid_size + y), allocated once and cleared after every use
+        self.sparse = grid_size > SPARSE_GRID_SIZE if sparse is None else sparse
+        if not self.sparse:
+            cells = grid_size * grid_size
+            self._obstacles = np.zeros(cells, dtype=bool)
+            self._counts = np.zeros(cells, dtype=np.int32)
+            self._taken = np.zeros(cells, dtype=bool)
+            self._owners = np.full(cells, np.iinfo(np.int64).max, dtype=np.int64)
+        # sorted cells of the obstacles, for sparse grids
+        self._obstacle_cells = np.zeros(0, dtype=np.int64)
+
+    def _flat(self, positions):
+        return positions[..., 0] * self.grid_size + positions[..., 1]
+
+    def _inside(self, positions):
+        return ((positions >= 0) & (positions < self.grid_size)).all(axis=-1)
+
+    def _count(self, marked, cells):
+        # number of times every cell of `cells` appears in `marked`
+        if not self.sparse:
+            np.add.at(self._counts, marked, 1)
+            counts = self._counts[cells]
+            self._counts[marked] = 0
+            return counts
+
+        keys, counts = np.unique(marked, return_counts=True)
+        if not len(keys):
+            return np.zeros(np.shape(cells), dtype=np.int64)
+        k = np.minimum(np.searchsorted(keys, cells), len(keys) - 1)
+        return np.where(keys[k] == cells, counts[k], 0)
+
+    def _is_obstacle(self, cells):
+        if not self.sparse:
+            return self._obstacles[cells]
+        return np.isin(cells, self._obstacle_cells)
+
+    def _cross_cells(self, positions):
+        # cells at Manhattan distance <= 1 of the positions
+        cells = positions[:, None, :] + CROSS
+        return self._flat(cells[self._inside(cells)])
+
+    def place_entities(self, rng):
+        """
+        - Random initial positions of all entities, returned as a (n, 2) array
+        - No two entities share a cell, and pedestrians are at Manhattan distance > 1
+          of the obstacles and of the other pedestrians
+        """
+        g = self.grid_size
+        num_fixed = self.num_obstacles + self.num_vehicles
+        if len(self.types) > g * g:
+            raise ValueError(f'{len(self.types)} entities do not fit on a {g}x{g} grid')
+
+        positions = np.empty((len(self.types), 2), dtype=np.int64)
+        cells = rng.choice(g * g, size=num_fixed, replace=False)
+        positions[:num_fixed] = np.stack(np.divmod(cells, g), axis=1)
+
+        # cells taken by an entity, and cells too close to an obstacle or a pedestrian
+        taken = set(cells.tolist())
+        blocked = set(self._cross_cells(positions[:self.num_obstacles]).tolist())
+
+        max_attempts = 100
+        for i in self.pedestrians:
+            for _ in range(max_attempts):
+                x, y = rng.integers(0, g, size=2)
+                cell = x * g + y
+                if cell not in taken and cell not in blocked:
+                    break
+            else:
+                raise ValueError(f'Could not place pedestrian {i - num_fixed + 1} of {self.num_pedestrians} '
+                                 f'after {max_attempts} attempts, the {g}x{g} grid is too crowded')
+            positions[i] = x, y
+            taken.add(cell)
+            blocked.update(self._cross_cells(positions[i:i + 1]).tolist())
+
+        if self.flag:
+            print(f'Initial positions: {len(positions)} entities on a {g}x{g} grid')
+        return positions
+
+    def step(self, positions, rng):
+        """
+        - Moves every entity once, returns the new (n, 2) positions
+        """
+        new_positions = positions.copy()
+
+        # vehicles: any move that stays on the grid
+        candidates = positions[self.vehicles, None, :] + NEIGHBORHOOD
+        choice = _pick(self._inside(candidates), rng)
+        new_positions[self.vehicles] = candidates[np.arange(len(self.vehicles)), choice]
+
+        self._move_pedestrians(positions, new_positions, rng)
+        return new_positions
+
+    def _move_pedestrians(self, positions, new_positions, rng):
+        k = len(self.pedestrians)
+        current = positions[self.pedestrians]
+        candidates = current[:, None, :] + NEIGHBORHOOD
+        valid = self._inside(candidates)
+        cells = np.where(valid, self._flat(candidates), 0)
+
+        valid &= ~self._is_obstacle(cells)
+
+        # number of pedestrians at Manhattan distance <= 1 of every cell, the pedestrian itself
+        # counts for its cell and the 4 cells next to it (not for the diagonal ones)
+        itself = np.abs(NEIGHBORHOOD).sum(axis=1) <= 1
+        valid &= self._count(self._cross_cells(current), cells) == itself
+
+        # pedestrians that cannot move stay, their cell cannot be the next cell of another pedestrian
+        valid[~valid.any(axis=1), STAY] = True
+
+        # the notebook moves pedestrians one after the other, and a pedestrian cannot take the next cell
+        # of an earlier one: every round, the pending pedestrians pick a move, the first pedestrian
+        # picking a cell gets it and the others pick again among the cells that are still free.
+        # Conflicts are rare, so there are only a few rounds.
+        pending = np.arange(k)
+        while len(pending):
+            choice = _pick(valid[pending], rng)
+            targets = cells[pending, choice]
+            if self.sparse:
+                # pending is in increasing order, the first occurrence of a cell is the first pedestrian picking it
+                won = np.zeros(len(pending), dtype=bool)
+                won[np.unique(targets, return_index=True)[1]] = True
+            else:
+                np.minimum.at(self._owners, targets, pending)
+                won = self._owners[targets] == pending
+                self._owners[targets] = np.iinfo(np.int64).max
+
+            new_positions[self.pedestrians[pending[won]]] = candidates[pending[won], choice[won]]
+
+            pending = pending[~won]
+            if len(pending):
+                # cells taken in this round cannot be picked again
+                if self.sparse:
+                    valid[pending] &= ~np.isin(cells[pending], targets[won])
+                else:
+                    self._taken[targets[won]] = True
+                    valid[pending] &= ~self._taken[cells[pending]]
+                    self._taken[targets[won]] = False
+                valid[pending[~valid[pending].any(axis=1)], STAY] = True
+
+    def detect_collisions(self, positions):
+        """
+        - Returns the (m, 2) pairs (i, j), i < j, of entities on the same cell, like
+          detect_collision of the notebooks but O(n) with an occupancy grid (hashed cells on sparse grids,
+          see grid_maker.shared_cells)
+        """
+        cells = self._flat(positions)
+        if self.sparse:
+            colliding = np.flatnonzero(shared_cells(positions, self.grid_size))
+        else:
+            colliding = np.flatnonzero(self._count(cells, cells) > 1)
+
+        if not len(colliding):
+            return np.zeros((0, 2), dtype=np.int64)
+
+        # only the colliding entities are grouped by cell
+        colliding = colliding[np.argsort(cells[colliding], kind='stable')]
+        starts = np.flatnonzero(np.diff(cells[colliding], prepend=-1))
+        stops = np.append(starts[1:], len(colliding))
+        pairs = [(colliding[a], colliding[b]) for start, stop in zip(starts, stops)
+                 for a in range(start, stop) for b in range(a + 1, stop)]
+        return np.array(pairs, dtype=np.int64)
+
+    def simulate(self, num_steps=10, rng=None):
+        """
+        - Places the entities and runs num_steps - 1 steps
+        - Returns (positions, collisions): (num_steps, n, 2) positions of every entity at every step,
+          and the pairs of colliding entities of every step (see detect_collisions)
+        """
+        rng = np.random.default_rng() if rng is None else rng
+
+        positions = self.place_entities(rng)
+        if self.sparse:
+            self._obstacle_cells = np.unique(self._flat(positions[:self.num_obstacles]))
+        else:
+            self._obstacles[:] = False
+            self._obstacles[self._flat(positions[:self.num_obstacles])] = True
+
+        trajectory = np.empty((num_steps, len(positions), 2), dtype=coordinate_dtype(self.grid_size))
+        collisions = []
+        for t in range(num_steps):
+            if t > 0:
+                positions = self.step(positions, rng)
+            trajectory[t] = positions
+            collisions.append(self.detect_collisions(positions))
+        return trajectory, collisions
+
+    def collision_report(self, trajectory, collisions):
+        """
+        - Same as analyze_collisions of the notebooks: one dict per collision with
+          the time step (from 1), the location and the types of the two entities
+        """
+        return [
+            {'timestep': t + 1, 'location': tuple(trajectory[t, i].tolist()), 'entities': (ENTITY_TYPES[self.types[i]], ENTITY_TYPES[self.types[j]])}
+            for t, pairs in enumerate(collisions) for i, j in pairs.tolist()
+            ]
+
+    def occupancy(self, positions, window=None):
+        """
+        - (grid_size, grid_size) uint8 grid of the entity types, 0 for empty cells and type + 1 otherwise
+          (the last entity wins on shared cells)
+        - window: (x0, y0, size), only the size x size cells from (x0, y0) on, for rendering a crop of a large grid
+        """
+        x0, y0, size = (0, 0, self.grid_size) if window is None else window
+        grid = np.zeros((size, size), dtype=np.uint8)
+        x, y = positions[:, 0] - x0, positions[:, 1] - y0
+        inside = (x >= 0) & (x < size) & (y >= 0) & (y < size)
+        grid[x[inside], y[inside]] = self.types[inside] + 1
+        return grid
+
+
+def _pick(valid, rng):
+    # uniform choice among the valid moves of every row, like shuffling the moves and taking the first valid one
+    keys = rng.random(valid.shape)
+    keys[~valid] = -1
+    return keys.argmax(axis=1)
+
+
+def _pairwise_collisions(positions):
+    # detect_collision of the notebooks, the O(n^2) reference of the benchmark
+    positions = positions.tolist()
+    return [(i, j) for i in range(len(positions)) for j in range(i + 1, len(positions)) if positions[i] == positions[j]]
+
+
+def benchmark(grid_size, entity_counts, num_steps=20, seed=0, pairwise_limit=2000):
+    """
+    - Times the steps and the collision detection for growing numbers of entities
+      (45% vehicles, 45% pedestrians, 10% obstacles)
+    - Returns one dict per entity count, times in milliseconds per step
+    """
+    results = []
+    for n in entity_counts:
+        num_obstacles = n // 10
+        num_vehicles = (n - num_obstacles) // 2
+        simulator = TrafficSimulator(grid_size, num_vehicles, n - num_obstacles - num_vehicles, num_obstacles)
+        rng = np.random.default_rng(seed)
+
+        # a 1-step simulation places the entities, then the steps and the collision detection are timed
+        positions = simulator.simulate(1, rng)[0][0].astype(np.int64)
+        step_time = detection_time = 0
+        collisions = 0
+        for _ in range(num_steps):
+            start = time.perf_counter()
+            positions = simulator.step(positions, rng)
+            step_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            collisions += len(simulator.detect_collisions(positions))
+            detection_time += time.perf_counter() - start
+
+        result = {
+            'entities': n,
+            'grid_size': grid_size,
+            'step_ms': 1000 * step_time / num_steps,
+            'detect_ms': 1000 * detection_time / num_steps,
+            'collisions': collisions,
+            }
+        if n <= pairwise_limit:
+            start = time.perf_counter()
+            _pairwise_collisions(positions)
+            result['pairwise_detect_ms'] = 1000 * (time.perf_counter() - start)
+        results.append(result)
+    return results
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark of the multi-agent traffic simulator')
+    parser.add_argument('--grid_size', type=int, default=200, help='Size of the grid (grid_size x grid_size)')
+    parser.add_argument('--entities', type=int, nargs='+', default=[100, 300, 1000, 3000, 10000], help='Numbers of entities to benchmark')
+    parser.add_argument('--num_steps', type=int, default=20, help='Number of timed steps')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the simulations')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+
+    results = benchmark(args.grid_size, args.entities, args.num_steps, args.seed)
+    print(f'{args.grid_size}x{args.grid_size} grid, {args.num_steps} steps')
+    print(f'{"entities":>10} {"step (ms)":>10} {"us/entity":>10} {"detect (ms)":>12} {"pairwise (ms)":>14}')
+    for result in results:
+        pairwise = f'{result["pairwise_detect_ms"]:14.2f}' if 'pairwise_detect_ms' in result else f'{"-":>14}'
+        print(f'{result["entities"]:>10} {result["step_ms"]:10.3f} {1000 * result["step_ms"] / result["entities"]:10.2f} '
+              f'{result["detect_ms"]:12.3f} {pairwise}')
@@ -0,0 +1,86 @@
+# Random access to the episodes of a dataset written by data_driver.py
+#
+# TrajectoryDataset follows the PyTorch Dataset protocol (__len__ and __getitem__),
+# so it can be given to a torch DataLoader, but it does not import torch itself.
+
+import numpy as np
+from trajectory_io import load_trajectories, to_padded
+
+
+class TrajectoryDataset:
+    """
+    - Memory-maps the arrays of a .npz dataset, the file can be larger than RAM.
+    - dataset[i] returns episode i as a dict of the dataset columns, object#_action are (length, 2)
+      views into the memory-mapped arrays, so no data is copied.
+    - dataset[a:b], dataset[mask] and dataset[ids] return a new TrajectoryDataset of the selected
+      episodes, that shares the same arrays.
+    """
+    def __init__(self, path, collision_only=False, ids=None):
+        self.path = path
+        self._data = None
+
+        # ids of the episodes of this dataset in the file
+        if ids is None:
+            ids = np.arange(len(self.data['collision_status']))
+        self.ids = np.asarray(ids)
+
+        if collision_only:
+            self.ids = self.ids[self.collision_status == 1]
+
+    @property
+    def data(self):
+        # arrays are opened lazily, so that every dataloader worker maps the file itself
+        if self._data is None:
+            self._data = load_trajectories(self.path, mmap=True)
+        return self._data
+
+    @property
+    def collision_status(self):
+        return np.asarray(self.data['collision_status'][self.ids])
+
+    @property
+    def grid_size(self):
+        return np.asarray(self.data['grid_size'][self.ids])
+
+    @property
+    def lengths(self):
+        offsets = self.data['offsets']
+        return np.asarray(offsets[self.ids + 1] - offsets[self.ids])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.get_episode(self.ids[index])
+
+        subset = TrajectoryDataset.__new__(TrajectoryDataset)
+        subset.path = self.path
+        subset._data = self._data
+        subset.ids = self.ids[index]
+        return subset
+
+    def get_episode(self, episode_id):
+        """
+        - Returns episode `episode_id` of the file (not the index in this dataset)
+        """
+        data = self.data
+        start, stop = data['offsets'][episode_id], data['offsets'][episode_id + 1]
+        return {
+            'grid_size': int(data['grid_size'][episode_id]),
+            'object1_action': data['object1_action'][start:stop],
+            'object2_action': data['object2_action'][start:stop],
+            'collision_status': int(data['collision_status'][episode_id]),
+            }
+
+    def to_padded(self):
+        """
+        - Returns (object1_actions, object2_actions, lengths) of all episodes as padded (n, T, 2) arrays
+        """
+        return to_padded(self.data, self.ids)
+
+    def __getstate__(self):
+        # np.memmap arrays would be pickled as copies, workers map the file again instead
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
@@ -0,0 +1,273 @@
+# Columnar binary format of the trajectory datasets
+#
+# A dataset is stored in a single (uncompressed) .npz file with the arrays
+#   object1_action, object2_action: (total_steps, 2) coordinates of every episode, one after the other
+#   offsets: (num_episodes + 1,) episode i is object#_action[offsets[i]:offsets[i + 1]]
+#   grid_size: (num_episodes,) grid size of every episode
+#   collision_status: (num_episodes,) 1 if the objects of the episode collide, 0 otherwise
+# Coordinates are int8 (or int16 for grids larger than 127, int32 larger than 32767), so a position takes 2 bytes
+# instead of ~8 characters in the csv, and loading needs no eval() of the stringified tuples.
+
+import argparse
+import zipfile
+import numpy as np
+from grid_maker import PAD_VALUE, coordinate_dtype
+
+# Arrays stored in a dataset file
+COLUMNS = ('object1_action', 'object2_action', 'offsets', 'grid_size', 'collision_status')
+
+
+def from_padded(object1_actions, object2_actions, lengths, grid_size, collision_status):
+    """
+    - Converts the padded (n, T, 2) arrays returned by GridMaker.generate_batch to the columnar format
+    """
+    lengths = np.asarray(lengths)
+    grid_size = np.broadcast_to(np.asarray(grid_size), lengths.shape)
+    dtype = coordinate_dtype(grid_size.max(initial=0))
+
+    # keep the first lengths[i] positions of every episode
+    mask = np.arange(object1_actions.shape[1]) < lengths[:, None]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return {
+        'object1_action': object1_actions[mask].astype(dtype),
+        'object2_action': object2_actions[mask].astype(dtype),
+        'offsets': offsets,
+        # int16, unless the coordinates need more
+        'grid_size': grid_size.astype(np.promote_types(dtype, np.int16)),
+        'collision_status': np.asarray(collision_status, dtype=np.int8),
+        }
+
+
+def concatenate_files(paths, output_path):
+    """
+    - Concatenates dataset files into one, episode ids of later files are shifted
+    - Columns are copied file by file, so only one column of one file is in memory at a time
+    - No paths give a dataset without episodes
+    """
+    if not paths:
+        empty = np.zeros((0, 0, 2), dtype=np.int8)
+        save_trajectories(output_path, from_padded(empty, empty, np.zeros(0, dtype=np.int64), 0, []))
+        return
+
+    # shapes and dtypes are read from the headers, memory-mapping does not read the data
+    headers = [load_trajectories(path, mmap=True) for path in paths]
+
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for column in COLUMNS:
+            arrays = [header[column] for header in headers]
+            if column == 'offsets':
+                # every file starts its offsets at 0, shift them by the steps of the previous files
+                shape = (sum(len(array) - 1 for array in arrays) + 1,)
+            else:
+                shape = (sum(len(array) for array in arrays),) + arrays[0].shape[1:]
+            dtype = np.result_type(*arrays)
+
+            write_member(archive, f'{column}.npy', dtype, shape, _column_parts(paths, column, dtype))
+
+
+def _column_parts(paths, column, dtype):
+    # the column of every file, one file at a time, offsets shifted by the steps of the previous files
+    base = 0
+    if column == 'offsets':
+        yield np.zeros(1, dtype=dtype)
+    for path in paths:
+        with np.load(path) as data:
+            array = data[column]
+        if column == 'offsets':
+            array, base = array[1:] + base, base + int(array[-1])
+        yield array.astype(dtype, copy=False)
+
+
+def write_member(archive, name, dtype, shape, parts):
+    """
+    - Writes the .npy member `name` of an open zip archive (an uncompressed .npz) from the arrays `parts`,
+      one after the other, so only one part is in memory at a time
+    - shape: shape of the whole array, the parts are its consecutive rows
+    """
+    with archive.open(name, 'w', force_zip64=True) as f:
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': shape}
+        np.lib.format.write_array_header_1_0(f, header)
+        for part in parts:
+            f.write(np.ascontiguousarray(part, dtype=dtype).tobytes())
+
+
+def save_trajectories(path, dataset):
+    """
+    - Writes a dataset in the columnar format, uncompressed so that the arrays can be memory-mapped
+    """
+    with open(path, 'wb') as f:
+        np.savez(f, **{column: dataset[column] for column in COLUMNS})
+
+
+def load_trajectories(path, mmap=False):
+    """
+    - Loads a dataset written by save_trajectories, or a csv dataset written by the old data_driver.py
+    - With mmap=True the arrays are memory-mapped from the .npz file instead of read,
+      nothing is loaded until an episode is accessed and the pages are shared between processes
+    - A manifest (.json) of a sharded dataset loads the union of its shards, see dataset_shards.py
+    """
+    if path.endswith('.csv'):
+        return read_csv(path)
+
+    if path.endswith('.json'):
+        from dataset_shards import load_shards
+        return load_shards(path, mmap=mmap)
+
+    if mmap:
+        return {column: _memmap_member(path, f'{column}.npy') for column in COLUMNS}
+
+    with np.load(path) as data:
+        return {column: data[column] for column in COLUMNS}
+
+
+def _memmap_member(path, name):
+    # np.load ignores mmap_mode for .npz files, but save_trajectories stores the members uncompressed,
+    # so each .npy member is a contiguous block of the file that can be memory-mapped directly
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f'{path}: {name} is compressed and cannot be memory-mapped, use mmap=False')
+
+    with open(path, 'rb') as f:
+        # local file header: 30 bytes, then the file name and the extra field
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if np.prod(shape) == 0:
+        # np.memmap cannot map an empty array
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+def get_episode(dataset, i):
+    """
+    - Returns (object1_action, object2_action) of episode i as (length, 2) arrays
+    """
+    start, stop = dataset['offsets'][i], dataset['offsets'][i + 1]
+    return dataset['object1_action'][start:stop], dataset['object2_action'][start:stop]
+
+
+def to_padded(dataset, ids, pad_value=PAD_VALUE):
+    """
+    - Gathers episodes `ids` into padded (len(ids), T, 2) arrays, the format of GridMaker.generate_batch
+    - Returns (object1_actions, object2_actions, lengths)
+    """
+    ids = np.asarray(ids)
+    starts = np.asarray(dataset['offsets'][ids])
+    lengths = np.asarray(dataset['offsets'][ids + 1]) - starts
+
+    steps = np.arange(lengths.max(initial=0))
+    valid = steps < lengths[:, None]
+    rows = np.where(valid, starts[:, None] + steps, 0)
+
+    object1_actions = np.where(valid[..., None], dataset['object1_action'][rows], pad_value)
+    object2_actions = np.where(valid[..., None], dataset['object2_action'][rows], pad_value)
+    return object1_actions.astype(dataset['object1_action'].dtype), object2_actions.astype(dataset['object2_action'].dtype), lengths
+
+
+def _parse_actions(column):
+    # parses "[(6, 3), (5, 3), ...]" strings without eval(): every row becomes a (length, 2) block
+    # of one flat array, rows are separated by counting the tuples in each string
+    lengths = column.str.count(r'\(').to_numpy()
+    text = ' '.join(column.tolist()).translate(str.maketrans('[](),', '     '))
+    coordinates = np.array(text.split(), dtype=np.int64).reshape(-1, 2)
+    return coordinates, lengths
+
+
+def read_csv(path):
+    """
+    - Reads a csv dataset (stringified lists of tuples) into the columnar format
+    """
+    import pandas as pd
+    return _csv_columns(pd.read_csv(path), path)
+
+
+def read_csv_rows(path, rows=None, limit=None, collision_only=False, chunksize=10000):
+    """
+    - Reads only some rows of a csv dataset into the columnar format, the file is scanned in chunks
+      of chunksize rows and only the selected rows are parsed
+    - rows: row ids (0-based) to keep, collision_only: keep only the samples with collision,
+      limit: stop reading once limit rows are selected
+    - Returns (dataset, row_ids), row_ids are the ids of the selected rows in the file
+    """
+    import pandas as pd
+
+    frames, row_ids, selected = [], [], 0
+    rows = None if rows is None else np.asarray(rows)
+
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        keep = np.ones(len(chunk), dtype=bool)
+        if rows is not None:
+            keep &= np.isin(chunk.index.to_numpy(), rows)
+        if collision_only:
+            keep &= chunk['collision_status'].to_numpy() == 1
+
+        chunk = chunk[keep]
+        if limit is not None:
+            chunk = chunk.iloc[:limit - selected]
+        frames.append(chunk)
+        row_ids.append(chunk.index.to_numpy())
+        selected += len(chunk)
+
+        if limit is not None and selected >= limit:
+            break
+
+    if not frames:
+        # empty file, only the header
+        frames = [pd.read_csv(path)]
+    return _csv_columns(pd.concat(frames), path), np.concatenate(row_ids or [np.zeros(0, dtype=np.int64)])
+
+
+def _csv_columns(df, path):
+    object1_action, lengths = _parse_actions(df['object1_action'])
+    object2_action, lengths2 = _parse_actions(df['object2_action'])
+    if not np.array_equal(lengths, lengths2):
+        raise ValueError(f'{path}: object1_action and object2_action have different lengths')
+
+    grid_size = df['grid_size'].to_numpy()
+    dtype = coordinate_dtype(grid_size.max(initial=0))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return {
+        'object1_action': object1_action.astype(dtype),
+        'object2_action': object2_action.astype(dtype),
+        'offsets': offsets,
+        # int16, unless the coordinates need more
+        'grid_size': grid_size.astype(np.promote_types(dtype, np.int16)),
+        'collision_status': df['collision_status'].to_numpy().astype(np.int8),
+        }
+
+
+def convert_csv(csv_path, output_path):
+    """
+    - Converts a csv dataset written by the old data_driver.py to the columnar format
+    """
+    dataset = read_csv(csv_path)
+    save_trajectories(output_path, dataset)
+    return dataset
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Convert a csv grid dataset to the columnar .npz format')
+    parser.add_argument('--csv_path', type=str, default='./data/grid_dataset/grid_dataset.csv', help='Path to the csv dataset')
+    parser.add_argument('--output_path', type=str, default=None, help='Path of the .npz dataset, next to the csv file by default')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    output_path = args.output_path or args.csv_path[:-len('.csv')] + '.npz'
+
+    dataset = convert_csv(args.csv_path, output_path)
+    print(f'Converted {len(dataset["collision_status"])} episodes: {args.csv_path} -> {output_path}')